@@ -0,0 +1,73 @@
+import os
+import glob
+import time
+import resource
+import contextlib
+import multiprocessing
+import config
+from src.html_backend import available_backends, make_soup
+from src.page_parser import PageParser
+
+ROUNDS = 10
+
+
+def bench_backend(backend, files):
+    """Парсит фикстуры заданным бэкендом (в отдельном процессе)"""
+    pages = []
+    for path in files:
+        with open(path, 'r', encoding='utf-8') as f:
+            pages.append(f.read())
+
+    parser = PageParser()
+    results = []
+
+    start_time = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(ROUNDS):
+            for html in pages:
+                results.append(parser.parse_soup('bench', make_soup(html, backend)))
+    elapsed = time.perf_counter() - start_time
+
+    # ru_maxrss в Linux измеряется в килобайтах
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    return {
+        'backend': backend,
+        'pages_per_sec': len(results) / elapsed,
+        'peak_rss_mb': peak_rss_mb,
+        'result': results[0],
+    }
+
+
+def main():
+    files = sorted(glob.glob(os.path.join(config.BASE_DIR, 'debug_*.html')))
+    if not files:
+        print("Не найдены файлы debug_*.html")
+        return
+
+    print("\n" + "=" * 60)
+    print("БЕНЧМАРК HTML-БЭКЕНДОВ")
+    print("=" * 60)
+    print(f"Файлов: {len(files)}, повторов: {ROUNDS}")
+
+    # Каждый бэкенд в своем процессе, чтобы пиковая память не смешивалась
+    ctx = multiprocessing.get_context('spawn')
+    stats = []
+    for backend in available_backends():
+        with ctx.Pool(1) as pool:
+            stats.append(pool.apply(bench_backend, (backend, files)))
+
+    print(f"\n{'Бэкенд':<15} {'Страниц/сек':<15} {'Пик RSS, МБ':<15}")
+    print("-" * 45)
+    for stat in stats:
+        print(f"{stat['backend']:<15} {stat['pages_per_sec']:<15.1f} {stat['peak_rss_mb']:<15.1f}")
+
+    reference = stats[-1]['result']
+    for stat in stats[:-1]:
+        same = stat['result'] == reference
+        print(f"\n{stat['backend']} vs {stats[-1]['backend']}: "
+              f"{'результаты совпадают' if same else 'РЕЗУЛЬТАТЫ РАЗЛИЧАЮТСЯ'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import time
+import config
+from src.connections import get_mongo_db, mongo_available, close_mongo
+from src.cached_queries import upcoming_shows_pipeline
+from src.materialized_views import VIEWS
+from src.play_snapshot import PlaySnapshot, SNAPSHOT_PROJECTION, snapshot_enabled
+
+ROUNDS = 50
+
+
+def mongo_queries(db):
+    """Те же агрегаты, посчитанные конвейерами MongoDB"""
+    plays = db[config.MONGO_CONFIG['collection']]
+    shows = db[config.MONGO_CONFIG['shows_collection']]
+    sources = {'plays': plays, 'shows': shows}
+
+    def view(name):
+        pipeline = VIEWS[name]['pipeline'] + [{'$sort': dict(VIEWS[name]['sort'])}]
+        return lambda: list(sources[VIEWS[name]['source']].aggregate(pipeline))
+
+    queries = {name: view(name) for name in VIEWS}
+    queries['upcoming_shows'] = lambda: list(shows.aggregate(upcoming_shows_pipeline(7)))
+    return queries
+
+
+def snapshot_queries(snapshot):
+    """Агрегаты по снимку в памяти"""
+    queries = {name: (lambda name=name: snapshot.read(name)) for name in VIEWS}
+    queries['upcoming_shows'] = lambda: snapshot.upcoming_shows(7)
+    return queries
+
+
+def normalize(name, rows):
+    """Приводит результат к виду, не зависящему от порядка равных строк"""
+    if name == 'upcoming_shows':
+        return sorted((row['_id'], sorted(play['name'] for play in row['plays'])) for row in rows)
+
+    normalized = []
+    for row in rows:
+        normalized.append(sorted(
+            (key, round(value, 6) if isinstance(value, float) else value)
+            for key, value in row.items() if key not in ('_id', '_refreshed_at')
+        ) + [('_id', str(row['_id']))])
+    return sorted(normalized, key=str)
+
+
+def measure(query) -> float:
+    """Среднее время запроса в миллисекундах"""
+    query()  # Прогрев
+    start_time = time.perf_counter()
+    for _ in range(ROUNDS):
+        query()
+    return (time.perf_counter() - start_time) / ROUNDS * 1000
+
+
+def main():
+    if not snapshot_enabled():
+        print("NumPy не установлен или снимок отключен в SNAPSHOT_CONFIG")
+        return
+    if not mongo_available():
+        print("Для сравнения нужна MongoDB с загруженными спектаклями")
+        return
+
+    db = get_mongo_db()
+
+    print("\n" + "=" * 60)
+    print("БЕНЧМАРК: КОНВЕЙЕРЫ MONGODB И СНИМОК В ПАМЯТИ")
+    print("=" * 60)
+
+    start_time = time.perf_counter()
+    snapshot = PlaySnapshot.from_plays(db[config.MONGO_CONFIG['collection']].find({}, SNAPSHOT_PROJECTION))
+    build_time = (time.perf_counter() - start_time) * 1000
+    print(f"Спектаклей: {snapshot.size}, построение снимка: {build_time:.1f} мс, повторов: {ROUNDS}")
+
+    mongo = mongo_queries(db)
+    memory = snapshot_queries(snapshot)
+
+    print(f"\n{'Запрос':<25} {'MongoDB, мс':<14} {'Снимок, мс':<14} {'Ускорение':<10} {'Совпадает':<10}")
+    print("-" * 75)
+    for name in mongo:
+        mongo_time = measure(mongo[name])
+        memory_time = measure(memory[name])
+        same = normalize(name, mongo[name]()) == normalize(name, memory[name]())
+        print(f"{name:<25} {mongo_time:<14.3f} {memory_time:<14.3f} "
+              f"{mongo_time / memory_time:<9.1f}x {'✅' if same else '❌'}")
+
+    close_mongo()
+
+
+if __name__ == "__main__":
+    main()
@@ -16,16 +16,64 @@ HEADERS = {
     'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
 }
 
-# Настройки задержек
-REQUEST_DELAY = 3
+# Таймаут HTTP-запроса, секунд
 TIMEOUT = 10
 
+# Настройки асинхронной загрузки
+FETCH_CONFIG = {
+    'concurrency': 5,  # Максимум одновременных запросов
+    'requests_per_second': 1.0,  # Начальный лимит запросов на один хост
+    'min_requests_per_second': 0.05,
+    'max_requests_per_second': 5.0,
+    'rate_increase': 0.1,  # Прибавка к лимиту после серии успешных ответов
+    'increase_every': 10,  # Длина серии успешных ответов
+    'backoff_factor': 0.5,  # Множитель лимита при 429/503/капче
+    'backoff_pause': 30,  # Пауза, если сайт не прислал Retry-After
+    'max_retries': 2,  # Повторы запроса после замедления
+    # Признаки страницы-заглушки. Просто 'captcha' не подходит: слово есть
+    # в стилях и скриптах SmartCaptcha на каждой обычной странице сайта
+    'captcha_markers': ['доступ временно ограничен', 'showcaptcha', 'checkcaptcha'],
+}
+
+# Настройки конвейера разбора
+PIPELINE_CONFIG = {
+    'workers': os.cpu_count() or 2,  # Процессов-парсеров
+    'queue_size': 32,  # Максимум загруженных, но еще не разобранных страниц
+}
+
+# Настройки дискового кеша HTTP-ответов
+HTTP_CACHE_CONFIG = {
+    'enabled': True,
+    'dir': os.path.join(DATA_DIR, 'http_cache'),
+    # Время, в течение которого страница не перепроверяется, по типам страниц
+    'ttl': {
+        'calendar': 3600,
+        'category': 6 * 3600,
+        'play': 24 * 3600,
+    },
+}
+
+# Настройки архива страниц для офлайн-повтора
+ARCHIVE_CONFIG = {
+    'dir': os.path.join(DATA_DIR, 'archive'),
+    'shard_records': 500,  # Страниц в одном gzip-шарде
+}
+
 # Настройки MongoDB
 MONGO_CONFIG = {
     'host': 'localhost',
     'port': 27017,
     'database': 'theater_db',
-    'collection': 'plays'
+    'collection': 'plays',
+    'max_pool_size': 50,  # Соединений в пуле общего клиента
+    'min_pool_size': 0,
+    'max_idle_time_ms': 60000,
+    'server_selection_timeout_ms': 5000,
+    'shows_collection': 'shows',  # Отдельные показы с датой в формате BSON datetime
+    'batch_size': 1000,  # Документов в одном bulk_write
+    'cursor_batch_size': 200,  # Документов в одной пачке курсора при потоковом чтении
+    # Полная перезагрузка пишет во временную коллекцию и подменяет ею основную
+    'swap_on_reload': True,
 }
 
 # Настройки Redis для кеширования
@@ -37,6 +85,8 @@ REDIS_CONFIG = {
     'socket_timeout': 5,
     'socket_connect_timeout': 5,
     'retry_on_timeout': True,
+    'max_connections': 50,  # Соединений в общем пуле
+    'health_check_interval': 30,  # Секунд простоя, после которых соединение проверяется
 }
 
 # Настройки кеширования
@@ -44,6 +94,56 @@ CACHE_CONFIG = {
     'ttl': 3600,  # Время жизни кеша в секундах
     'prefix': 'theater:',
     'enabled': True,
+    # Меняется при изменении формата кешируемых результатов: старые ключи перестают читаться
+    'schema_version': 2,
+    # Кеш первого уровня в памяти процесса перед Redis
+    'local_enabled': True,
+    'local_max_bytes': 32 * 1024 * 1024,  # Предел по объему сериализованных данных
+    'local_ttl': 60,  # Предел устаревания, если сообщение об инвалидации потерялось
+    'invalidation_channel': 'theater:invalidate',
+    # Пересчет истекшего запроса выполняет один вызывающий, остальные ждут результат
+    'lock_timeout': 60,  # Блокировка пересчета снимается сама, если владелец упал
+    'lock_wait': 10,  # Сколько ждать чужой пересчет, прежде чем считать самим
+    'lock_poll_interval': 0.05,
+    # Формат значений: msgpack/json и zstd/zlib ('auto' - лучшее из установленного)
+    'codec': 'auto',
+    'compression': 'auto',
+    'compress_threshold': 1024,  # Значения меньше этого размера не сжимаются
+    'compression_level': 6,
+    # Записи MongoHandler удаляют из кеша результаты, зависящие от измененных данных
+    'invalidate_on_write': True,
+    'tag_ttl': 24 * 3600,  # Время жизни множеств тегов, не меньше самого длинного TTL запросов
+    'scan_count': 500,  # Ключей за один SCAN и одну пачку команд при обслуживании кеша
+    'reconnect_interval': 30,  # Пауза перед повторным подключением, если Redis был недоступен
+}
+
+# Колоночный снимок спектаклей для аналитики в памяти (нужен NumPy)
+SNAPSHOT_CONFIG = {
+    'enabled': True,
+    'path': os.path.join(DATA_DIR, 'plays_snapshot.npz'),  # Перезаписывается после каждой загрузки
+}
+
+# Инвертированный индекс имен актеров, режиссеров и театров
+NAME_INDEX_CONFIG = {
+    'enabled': True,
+    'path': os.path.join(DATA_DIR, 'name_index.json'),  # Перезаписывается после каждой загрузки
+    'complete_limit': 10,  # Подсказок в автодополнении по умолчанию
+}
+
+# Полнотекстовый поиск по названиям и описаниям спектаклей
+SEARCH_CONFIG = {
+    'enabled': True,
+    'path': os.path.join(DATA_DIR, 'search_index.sqlite3'),
+    'name_weight': 3.0,  # Вес совпадений в названии относительно описания (BM25)
+    'description_weight': 1.0,
+    'limit': 10,  # Результатов по умолчанию
+}
+
+# Настройки HTTP API статистики
+API_CONFIG = {
+    'host': '127.0.0.1',
+    'port': 8080,
+    'max_limit': 100,  # Наибольший limit в запросах к API
 }
 
 # Сложные запросы для кеширования
@@ -60,7 +160,8 @@ PARSING_CONFIG = {
     'min_duration': 30,
     'max_duration': 300,
     'min_actors': 1,
-    'expected_fields': ['name', 'theatre', 'dates', 'duration_minutes']
+    'expected_fields': ['name', 'theatre', 'dates', 'duration_minutes'],
+    'html_backend': 'auto',  # auto, lxml или html.parser
 }
 
 # Метаданные
@@ -1,10 +1,18 @@
 import os
 import json
 import time
+import asyncio
+import argparse
 from datetime import datetime, timedelta
+import config
 from src.url_collector import URLCollector
 from src.page_parser import PageParser
 from src.mongo_handler import MongoHandler
+from src.connections import close_mongo, close_redis
+from src.redis_cache import close_redis_cache
+from src.html_archive import HTMLArchive
+from src.parse_pipeline import ParsePipeline
+from src.play_snapshot import get_snapshot
 
 def load_existing_data():
     """Загружает существующие данные из JSON"""
@@ -30,7 +38,51 @@ def load_existing_data():
     return []
 
 
+def parse_args():
+    """Разбирает аргументы командной строки"""
+    arg_parser = argparse.ArgumentParser(description="Театральный парсер")
+    arg_parser.add_argument(
+        '--replay', nargs='?', const=config.ARCHIVE_CONFIG['dir'], metavar='DIR',
+        help="разобрать страницы из архива без обращения к сети"
+    )
+    return arg_parser.parse_args()
+
+
+def replay_archive(archive_dir):
+    """Прогоняет архив страниц через парсер без обращения к сети"""
+    print("\n" + "=" * 60)
+    print("ОФЛАЙН-ПОВТОР ИЗ АРХИВА")
+    print("=" * 60)
+
+    archive = HTMLArchive(archive_dir)
+    if not archive.shards():
+        print(f"Архив пуст: {archive_dir}")
+        return
+
+    async def parse_archive():
+        plays = []
+        async for play_data in ParsePipeline().run_pages(archive.pages()):
+            plays.append(play_data)
+        return plays
+
+    start_time = time.time()
+    plays = asyncio.run(parse_archive())
+    elapsed = time.time() - start_time
+
+    print(f"\nРазобрано {len(plays)} спектаклей за {elapsed:.2f} сек "
+          f"({len(plays) / elapsed if elapsed > 0 else 0:.1f} стр/сек)")
+
+    mongo = MongoHandler()
+    mongo.save_to_json(plays, "data/plays_replay.json")
+    show_final_stats(mongo, plays)
+
+
 def main():
+    args = parse_args()
+    if args.replay:
+        replay_archive(args.replay)
+        return
+
     print("\n" + "=" * 60)
     print("ТЕАТРАЛЬНЫЙ ПАРСЕР")
     print("=" * 60)
@@ -68,16 +120,8 @@ def main():
 
             print(f"Загружено {len(urls)} ссылок")
 
-            plays = []
-            for i, url in enumerate(urls, 1):
-                print(f"   [{i}/{len(urls)}] Парсим {url[:50]}...")
-
-                # Большая задержка для избежания 429
-                time.sleep(5)
-
-                play_data = parser.parse_play_page(url)
-                if play_data:
-                    plays.append(play_data)
+            # Лимит запросов к хосту соблюдает сам парсер
+            plays = asyncio.run(collect_plays(parser, urls))
 
         if not plays:
             print("Не удалось собрать данные")
@@ -116,9 +160,26 @@ def main():
     print("=" * 60)
 
     mongo.close()
+    # Клиент MongoDB и пул Redis общие для процесса, поэтому закрываются здесь, а не в обработчиках
+    close_redis_cache()
+    close_redis()
+    close_mongo()
+    print("🔌 Соединения с MongoDB и Redis закрыты")
+
+async def collect_plays(parser, urls):
+    """Собирает спектакли по списку ссылок"""
+    plays = []
+    async for play_data in parser.parse_many(urls):
+        plays.append(play_data)
+        print(f"   [{len(plays)}/{len(urls)}] {play_data['name'][:50]}")
+    return plays
 
 def execute_mongo_queries(mongo):
     """Выполняет запросы из лабораторной работы"""
+    # Снимок спектаклей в памяти отвечает на те же запросы без обращения к MongoDB
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        print(f"\nЗапросы выполняются по снимку в памяти ({snapshot.size} спектаклей)")
 
     print("\nПРОСТЫЕ ЗАПРОСЫ:")
     print("-" * 30)
@@ -132,13 +193,19 @@ def execute_mongo_queries(mongo):
         {'$limit': 3}
     ]
 
-    top_theatres = list(mongo.collection.aggregate(pipeline))
+    if snapshot is not None:
+        top_theatres = snapshot.group_counts('theatre', limit=3)
+    else:
+        top_theatres = list(mongo.collection.aggregate(pipeline))
 
     for theatre_info in top_theatres:
         theatre = theatre_info['_id']
         if theatre and theatre != "Не указан":
             query = {'theatre': theatre}
-            plays_in_theatre = list(mongo.collection.find(query, {'name': 1, 'dates': 1}).limit(3))
+            if snapshot is not None:
+                plays_in_theatre = snapshot.find('theatre', theatre, limit=3)
+            else:
+                plays_in_theatre = list(mongo.collection.find(query, {'name': 1, 'dates': 1}).limit(3))
 
             print(f"\n   Театр: {theatre}")
             print(f"   Спектаклей в БД: {theatre_info['count']}")
@@ -158,16 +225,22 @@ def execute_mongo_queries(mongo):
         {'$limit': 3}
     ]
 
-    top_directors = list(mongo.collection.aggregate(pipeline))
+    if snapshot is not None:
+        top_directors = snapshot.group_counts('director', limit=3)
+    else:
+        top_directors = list(mongo.collection.aggregate(pipeline))
 
     for director_info in top_directors:
         director = director_info['_id']
         if director:
             query = {'director': director}
-            director_plays = list(mongo.collection.find(
-                query,
-                {'name': 1, 'theatre': 1, 'dates': 1}
-            ).limit(3))
+            if snapshot is not None:
+                director_plays = snapshot.find('director', director, limit=3)
+            else:
+                director_plays = list(mongo.collection.find(
+                    query,
+                    {'name': 1, 'theatre': 1, 'dates': 1}
+                ).limit(3))
 
             print(f"\n   Режиссер: {director}")
             print(f"   Спектаклей в БД: {director_info['count']}")
@@ -188,7 +261,11 @@ def execute_mongo_queries(mongo):
         {'$limit': 1}
     ]
 
-    nearest_date_result = list(mongo.collection.aggregate(pipeline))
+    if snapshot is not None:
+        first_date = snapshot.first_date()
+        nearest_date_result = [{'_id': first_date.isoformat()}] if first_date else []
+    else:
+        nearest_date_result = list(mongo.collection.aggregate(pipeline))
 
     if nearest_date_result:
         target_date = nearest_date_result[0]['_id']
@@ -196,10 +273,13 @@ def execute_mongo_queries(mongo):
 
         # Ищем спектакли на эту дату
         query = {'dates': target_date}
-        plays_on_date = list(mongo.collection.find(
-            query,
-            {'name': 1, 'theatre': 1, 'duration_minutes': 1}
-        ).limit(5))
+        if snapshot is not None:
+            plays_on_date = snapshot.plays_at(datetime.fromisoformat(target_date), limit=5)
+        else:
+            plays_on_date = list(mongo.collection.find(
+                query,
+                {'name': 1, 'theatre': 1, 'duration_minutes': 1}
+            ).limit(5))
 
         if plays_on_date:
             print(f"   Спектакли на {target_date}:")
@@ -215,21 +295,8 @@ def execute_mongo_queries(mongo):
     # 4. SELECT theatre, COUNT(*) as play_count, AVG(duration_minutes) as avg_duration
     print("4. Самые активные театры:")
 
-    pipeline = [
-        {'$match': {'duration_minutes': {'$exists': True, '$ne': None}}},
-        {'$group': {
-            '_id': '$theatre',
-            'play_count': {'$sum': 1},
-            'avg_duration': {'$avg': '$duration_minutes'},
-            'min_duration': {'$min': '$duration_minutes'},
-            'max_duration': {'$max': '$duration_minutes'}
-        }},
-        {'$match': {'_id': {'$ne': 'Не указан'}}},
-        {'$sort': {'play_count': -1}},
-        {'$limit': 10}
-    ]
-
-    theatre_stats = list(mongo.collection.aggregate(pipeline))
+    # Агрегаты уже посчитаны при сохранении (src/materialized_views.py)
+    theatre_stats = (snapshot or mongo.views).read('theatre_stats', limit=10)
 
     if theatre_stats:
         print(f"   {'Театр':<40} {'Спектаклей':<12} {'Средняя длит.':<12}")
@@ -245,24 +312,7 @@ def execute_mongo_queries(mongo):
     # 5. SELECT genre, COUNT(*) as total_plays, COUNT(DISTINCT theatre) as theatre_count...
     print("\n5. Популярность жанров:")
 
-    pipeline = [
-        {'$match': {'genre': {'$exists': True, '$ne': ''}}},
-        {'$group': {
-            '_id': '$genre',
-            'total_plays': {'$sum': 1},
-            'unique_theatres': {'$addToSet': '$theatre'},
-            'total_shows': {'$sum': {'$size': {'$ifNull': ['$dates', []]}}}
-        }},
-        {'$project': {
-            'genre': '$_id',
-            'total_plays': 1,
-            'theatre_count': {'$size': '$unique_theatres'},
-            'total_shows': 1
-        }},
-        {'$sort': {'total_shows': -1}}
-    ]
-
-    genre_stats = list(mongo.collection.aggregate(pipeline))
+    genre_stats = (snapshot or mongo.views).read('genre_stats')
 
     if genre_stats:
         print(f"   {'Жанр':<20} {'Спектаклей':<12} {'Театров':<10} {'Показов':<10}")
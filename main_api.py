@@ -0,0 +1,35 @@
+import argparse
+from aiohttp import web
+import config
+from src.api_server import create_app
+
+
+def parse_args():
+    """Разбирает аргументы командной строки"""
+    arg_parser = argparse.ArgumentParser(description="HTTP API статистики спектаклей")
+    arg_parser.add_argument('--host', default=config.API_CONFIG['host'])
+    arg_parser.add_argument('--port', type=int, default=config.API_CONFIG['port'])
+    return arg_parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    print("\n" + "=" * 60)
+    print("HTTP API СТАТИСТИКИ СПЕКТАКЛЕЙ")
+    print("=" * 60)
+    print(f"Адрес: http://{args.host}:{args.port}")
+    print("   • /theatres/{театр}/plays, /directors/{режиссер}/plays, /plays?date=YYYY-MM-DD")
+    print("   • /stats/theatres, /stats/genres, /stats/actors?limit=10, /stats/months")
+    print("   • /actors/{актер}/plays?prefix=1, /complete/{actors|directors|theatres}?q=...")
+    print("   • /search?q=..., /shows/upcoming?days=7, /health")
+    print("   • Списки спектаклей постранично: ?limit=50, далее ?cursor=<next_cursor>")
+
+    web.run_app(create_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\nОстановлено пользователем")
@@ -1,8 +1,10 @@
 import time
 import json
 from datetime import datetime
-from pymongo import MongoClient
-import redis
+from src.materialized_views import MaterializedViews
+from src.connections import get_mongo_db, get_redis_client, close_mongo, close_redis
+from src.cache_codec import CacheCodec
+from src.query_stream import list_query, stream_plays
 
 def test_tz_queries_with_cache():
     """Тест кеширования запросов из ТЗ предыдущей работы"""
@@ -11,9 +13,9 @@ def test_tz_queries_with_cache():
     print("-" * 40)
 
     try:
-        mongo_client = MongoClient('localhost', 27017)
-        mongo_db = mongo_client['theater_db']
+        mongo_db = get_mongo_db()
         mongo_collection = mongo_db['plays']
+        views = MaterializedViews(mongo_db)
 
         count = mongo_collection.count_documents({})
         print(f"Подключено к MongoDB. Спектаклей в базе: {count}")
@@ -30,14 +32,7 @@ def test_tz_queries_with_cache():
     print("-" * 40)
 
     try:
-        redis_client = redis.Redis(
-            host='localhost',
-            port=6379,
-            db=0,
-            socket_timeout=5,
-            socket_connect_timeout=5,
-            decode_responses=False
-        )
+        redis_client = get_redis_client()
 
         # Проверяем подключение
         redis_client.ping()
@@ -65,6 +60,7 @@ def test_tz_queries_with_cache():
         use_memory_cache = False
 
     memory_cache = {}
+    codec = CacheCodec()
 
     # Определяем ЗАПРОСЫ ИЗ ТЗ для кеширования
     print("\nЗАПРОСЫ ИЗ ТЗ ДЛЯ КЕШИРОВАНИЯ")
@@ -75,19 +71,9 @@ def test_tz_queries_with_cache():
         """Запрос 1 из ТЗ: Весь репертуар конкретного театра"""
         print(f"Запрос 1: Репертуар театра '{theatre_name}'")
 
-        query = {'theatre': theatre_name}
-        plays = list(mongo_collection.find(query))
-
-        # Форматируем результат
-        result = []
-        for play in plays:
-            result.append({
-                'name': play.get('name'),
-                'director': play.get('director', 'Не указан'),
-                'genre': play.get('genre'),
-                'duration_minutes': play.get('duration_minutes'),
-                'dates_count': len(play.get('dates', []))
-            })
+        query = list_query('theatre_repertoire', theatre_name)
+        # Строки формируются по мере чтения курсора, число дат считает MongoDB
+        result = list(stream_plays(mongo_collection, 'theatre_repertoire', query))
 
         print(f"Найдено спектаклей: {len(result)}")
         return result
@@ -97,21 +83,9 @@ def test_tz_queries_with_cache():
         """Запрос 2 из ТЗ: Творчество конкретного режиссера"""
         print(f"Запрос 2: Работы режиссера '{director_name}'")
 
-        query = {'director': director_name}
-        plays = list(mongo_collection.find(
-            query,
-            {'name': 1, 'theatre': 1, 'dates': 1, '_id': 0}
-        ))
-
-        # Форматируем результат
-        result = []
-        for play in plays:
-            result.append({
-                'name': play.get('name'),
-                'theatre': play.get('theatre'),
-                'dates_count': len(play.get('dates', [])),
-                'dates': play.get('dates', [])[:3]
-            })
+        # Индекс имен находит режиссера без учета регистра и падежа, без просмотра коллекции
+        query = list_query('director_works', director_name)
+        result = list(stream_plays(mongo_collection, 'director_works', query))
 
         print(f"Найдено работ: {len(result)}")
         return result
@@ -121,20 +95,8 @@ def test_tz_queries_with_cache():
         """Запрос 3 из ТЗ: Спектакли на конкретную дату"""
         print(f"Запрос 3: Спектакли на дату '{target_date}'")
 
-        query = {'dates': target_date}
-        plays = list(mongo_collection.find(
-            query,
-            {'name': 1, 'theatre': 1, 'duration_minutes': 1, '_id': 0}
-        ))
-
-        # Форматируем результат
-        result = []
-        for play in plays:
-            result.append({
-                'name': play.get('name'),
-                'theatre': play.get('theatre'),
-                'duration_minutes': play.get('duration_minutes')
-            })
+        query = list_query('plays_on_date', target_date)
+        result = list(stream_plays(mongo_collection, 'plays_on_date', query))
 
         print(f"Найдено спектаклей: {len(result)}")
         return result
@@ -144,23 +106,7 @@ def test_tz_queries_with_cache():
         """Запрос 4 из ТЗ: Статистика по театрам"""
         print("Запрос 4: Статистика театров (сложный агрегационный)")
 
-        pipeline = [
-            {'$match': {
-                'theatre': {'$exists': True, '$ne': 'Не указан'},
-                'duration_minutes': {'$exists': True, '$ne': None}
-            }},
-            {'$group': {
-                '_id': '$theatre',
-                'play_count': {'$sum': 1},
-                'avg_duration': {'$avg': '$duration_minutes'},
-                'min_duration': {'$min': '$duration_minutes'},
-                'max_duration': {'$max': '$duration_minutes'}
-            }},
-            {'$sort': {'play_count': -1}},
-            {'$limit': 10}
-        ]
-
-        results = list(mongo_collection.aggregate(pipeline))
+        results = views.stream('theatre_stats', limit=10)
 
         # Форматируем результат
         formatted = []
@@ -180,25 +126,7 @@ def test_tz_queries_with_cache():
         """Запрос 5 из ТЗ: Популярность жанров"""
         print("Запрос 5: Статистика жанров (сложный агрегационный)")
 
-        pipeline = [
-            {'$match': {'genre': {'$exists': True, '$ne': ''}}},
-            {'$group': {
-                '_id': '$genre',
-                'total_plays': {'$sum': 1},
-                'unique_theatres': {'$addToSet': '$theatre'},
-                'total_shows': {'$sum': {'$size': {'$ifNull': ['$dates', []]}}}
-            }},
-            {'$project': {
-                'genre': '$_id',
-                'total_plays': 1,
-                'theatre_count': {'$size': '$unique_theatres'},
-                'total_shows': 1,
-                'avg_shows_per_play': {'$divide': ['$total_shows', '$total_plays']}
-            }},
-            {'$sort': {'total_shows': -1}}
-        ]
-
-        results = list(mongo_collection.aggregate(pipeline))
+        results = views.stream('genre_stats')
 
         # Форматируем результат
         formatted = []
@@ -234,7 +162,7 @@ def test_tz_queries_with_cache():
                     cached_data = redis_client.get(key_with_params)
                     if cached_data:
                         print(f"[CACHE HIT] Данные из Redis: {key_with_params}")
-                        return json.loads(cached_data.decode('utf-8'))
+                        return codec.decode(cached_data)
                 except:
                     pass
 
@@ -258,7 +186,7 @@ def test_tz_queries_with_cache():
             if data is not None:
                 if redis_client and not use_memory_cache:
                     try:
-                        redis_client.setex(key_with_params, ttl, json.dumps(data))
+                        redis_client.set(key_with_params, codec.encode(data), ex=ttl)
                         print(f"[CACHE SET] Данные в Redis: {key_with_params} (TTL: {ttl} сек)")
                     except Exception as e:
                         print(f"Не удалось сохранить в Redis: {e}")
@@ -526,7 +454,7 @@ def test_tz_queries_with_cache():
         try:
             cached = redis_client.get('query4_theatre_stats')
             if cached:
-                stats = json.loads(cached.decode('utf-8'))
+                stats = codec.decode(cached)
             else:
                 stats = result1 if result1 else []
         except:
@@ -546,10 +474,10 @@ def test_tz_queries_with_cache():
     print("ТЕСТИРОВАНИЕ ЗАПРОСОВ ИЗ ТЗ ЗАВЕРШЕНО")
     print("=" * 60)
 
-    mongo_client.close()
+    close_mongo()
     if redis_client:
         try:
-            redis_client.close()
+            close_redis()
         except:
             pass
 
@@ -1,20 +1,60 @@
 import os
 import json
-import time
+import asyncio
+import argparse
 from datetime import datetime
+import config
 from src.url_collector import URLCollector
 from src.page_parser import PageParser
 from src.mongo_handler import MongoHandler
+from src.connections import close_mongo, close_redis
+from src.redis_cache import close_redis_cache
+from src.parse_pipeline import ParsePipeline
+from src.html_archive import HTMLArchive
+from src.http_cache import HTTPCache
+from src.rate_limiter import get_rate_limiter
+
+
+def parse_args():
+    """Разбирает аргументы командной строки"""
+    arg_parser = argparse.ArgumentParser(description="Сбор и парсинг спектаклей")
+    arg_parser.add_argument(
+        '--archive', nargs='?', const=config.ARCHIVE_CONFIG['dir'], metavar='DIR',
+        help="сохранять загруженные страницы в архив для офлайн-повтора"
+    )
+    arg_parser.add_argument(
+        '--incremental', action='store_true',
+        help="перепроверять все страницы и обновлять в базе только изменившиеся спектакли"
+    )
+    return arg_parser.parse_args()
 
 
 def main():
+    args = parse_args()
+
     print("\n" + "=" * 60)
     print("ТЕАТРАЛЬНЫЙ ПАРСЕР")
     print("=" * 60)
 
     # 1. Инициализация
-    collector = URLCollector()
-    parser = PageParser()
+    archive = HTMLArchive(args.archive) if args.archive else None
+    try:
+        crawl(args, archive)
+    finally:
+        # Незакрытый шард остается оборванным gzip-файлом
+        if archive:
+            archive.close()
+            print(f"Архив страниц: {args.archive}")
+
+
+def crawl(args, archive):
+    """Собирает ссылки, парсит спектакли и сохраняет результаты"""
+    # Общий лимитер: сбор ссылок и парсинг делят один бюджет запросов к сайту
+    rate_limiter = get_rate_limiter()
+    collector = URLCollector(rate_limiter=rate_limiter)
+    # В инкрементальном режиме каждая страница перепроверяется условным запросом (304 - дешево)
+    http_cache = HTTPCache(max_age=0) if args.incremental else None
+    parser = PageParser(rate_limiter=rate_limiter, http_cache=http_cache, archive=archive)
     mongo = MongoHandler()
 
     # 2. Подключаемся к MongoDB
@@ -24,51 +64,46 @@ def main():
     if not mongo.connect():
         print("Продолжаем без MongoDB")
 
-    # 3. Сбор ссылок
-    print("\nСБОР ССЫЛОК")
-    print("-" * 40)
-
-    urls = collector.run(force_collect=True)
-
-    if not urls:
-        print("Не удалось собрать ссылки")
-        return
+    known_fingerprints = {}
+    if args.incremental:
+        known_fingerprints = mongo.get_fingerprints()
+        print(f"Известно отпечатков страниц: {len(known_fingerprints)}")
 
-    print(f"Собрано {len(urls)} ссылок")
+    pipeline = ParsePipeline(parser, known_fingerprints=known_fingerprints)
 
-    # 4. Парсинг
-    print(f"\nПАРСИНГ {len(urls)} СПЕКТАКЛЕЙ")
+    # 3-4. Сбор ссылок и парсинг: ссылки уходят в парсинг сразу по мере обнаружения
+    print("\nСБОР ССЫЛОК И ПАРСИНГ")
     print("-" * 40)
 
-    all_plays = []
-    successful = 0
-
-    for i, url in enumerate(urls, 1):
-        try:
-            print(f"\r[{i:3d}/{len(urls)}] Парсим...", end="")
-
-            play_data = parser.parse_play_page(url)
+    all_plays = asyncio.run(parse_all(pipeline, collector.stream_urls(), mongo, args.incremental))
+    successful = len(all_plays)
+    total_urls = len(collector.play_urls)
 
-            if play_data and play_data.get('name') and play_data.get('dates'):
-                all_plays.append(play_data)
-                successful += 1
-
-                # Периодически сохраняем в MongoDB
-                if mongo.connected and i % 20 == 0:
-                    mongo.save_play(play_data)
-
-        except Exception as e:
-            print(f"\nОшибка: {url[:50]}... - {e}")
-            continue
+    if not total_urls:
+        print("Не удалось собрать ссылки")
+        return
 
-    print(f"\nПарсинг завершен: {successful}/{len(urls)} успешно")
+    if args.incremental:
+        # all_plays содержит только изменившиеся спектакли
+        unchanged = pipeline.stats['unchanged']
+        skipped = total_urls - successful - unchanged - pipeline.stats['failed']
+        print(f"\nПроверено страниц: {total_urls}")
+        print(f"Изменилось: {successful}, без изменений: {unchanged}, "
+              f"пропущено (не загружено или без названия и дат): {skipped}, "
+              f"ошибок разбора: {pipeline.stats['failed']}")
+    else:
+        print(f"\nПарсинг завершен: {successful}/{total_urls} успешно")
 
     # 5. Сохранение в MongoDB
     print(f"\nСОХРАНЕНИЕ В MONGODB")
     print("-" * 40)
 
     if mongo.connected:
-        mongo.save_all_plays(all_plays)
+        if args.incremental:
+            # Неизменившиеся спектакли остаются в базе как есть
+            mongo.upsert_plays(all_plays)
+        else:
+            mongo.save_all_plays(all_plays)
 
         stats = mongo.get_stats()
         print(f"В базе: {stats.get('total_plays', 0)} спектаклей")
@@ -83,14 +118,23 @@ def main():
     print("-" * 40)
 
     json_file = "data/plays_final.json"
-    mongo.save_to_json(all_plays, json_file)
+    # Выгрузка и статистика описывают полный набор спектаклей
+    export_plays = all_plays
+    if args.incremental:
+        # Изменившаяся часть не должна затирать полную выгрузку: берем весь набор из базы
+        export_plays = mongo.get_all_plays() if mongo.connected else None
+
+    if export_plays is not None:
+        mongo.save_to_json(export_plays, json_file)
+    else:
+        print(f"Нет подключения к MongoDB: {json_file} не перезаписан")
 
     # 7. Статистика
     print(f"\nСТАТИСТИКА")
     print("-" * 40)
 
-    if all_plays:
-        print(f"Обработано спектаклей: {len(all_plays)}")
+    if export_plays:
+        print(f"Спектаклей в выгрузке: {len(export_plays)}")
 
         # Анализ качества данных
         fields = {
@@ -106,26 +150,59 @@ def main():
         print("\nЗаполненность полей:")
         for field, name in fields.items():
             if field == 'actors':
-                count = sum(1 for p in all_plays if p.get(field) and len(p[field]) > 0)
+                count = sum(1 for p in export_plays if p.get(field) and len(p[field]) > 0)
             elif field == 'dates':
-                count = sum(1 for p in all_plays if p.get(field) and len(p[field]) > 0)
+                count = sum(1 for p in export_plays if p.get(field) and len(p[field]) > 0)
             else:
-                count = sum(1 for p in all_plays if p.get(field))
+                count = sum(1 for p in export_plays if p.get(field))
 
-            percentage = (count / len(all_plays)) * 100
+            percentage = (count / len(export_plays)) * 100
             icon = "✅" if percentage > 80 else "⚠️" if percentage > 50 else "❌"
 
-            print(f"   {icon} {name}: {count}/{len(all_plays)} ({percentage:.1f}%)")
+            print(f"   {icon} {name}: {count}/{len(export_plays)} ({percentage:.1f}%)")
 
     # 8. Закрытие
     print(f"\n" + "=" * 60)
     print("ВЫПОЛНЕНО!")
-    print(f"   Спектаклей: {len(all_plays)}")
-    print(f"   JSON: {json_file}")
+    if args.incremental:
+        print(f"   Изменилось спектаклей: {len(all_plays)}")
+    else:
+        print(f"   Спектаклей: {len(all_plays)}")
+    if export_plays is not None:
+        print(f"   JSON: {json_file}")
     print("=" * 60)
 
     if mongo.connected:
         mongo.close()
+    # Клиент MongoDB и пул Redis общие для процесса, поэтому закрываются здесь, а не в обработчиках
+    close_redis_cache()
+    close_redis()
+    close_mongo()
+    print("🔌 Соединения с MongoDB и Redis закрыты")
+
+    print("\nЛимит запросов к сайту:")
+    for host, metrics in rate_limiter.get_metrics().items():
+        print(f"   • {host}: {metrics['rate']} запр/сек, запросов {metrics['requests']}, "
+              f"замедлений {metrics['backoffs']}")
+
+async def parse_all(pipeline, urls, mongo, incremental=False):
+    """Параллельно парсит спектакли, сохраняя их по мере готовности"""
+    all_plays = []
+    # В инкрементальном режиме пайплайн отдает только изменившиеся спектакли
+    label = "Изменилось" if incremental else "Спарсено"
+
+    async for play_data in pipeline.run(urls):
+        if play_data.get('name') and play_data.get('dates'):
+            all_plays.append(play_data)
+            print(f"\r[{len(all_plays):3d}] {label}", end="")
+
+            # Периодически сохраняем в MongoDB, чтобы не потерять результаты при сбое.
+            # Агрегаты, снимок и индексы обновит итоговая запись. В инкрементальном режиме
+            # upsert_plays должен увидеть прежние версии спектаклей, поэтому здесь не пишем
+            if mongo.connected and not incremental and len(all_plays) % 20 == 0:
+                mongo.save_play(play_data, refresh=False)
+
+    return all_plays
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,54 @@
+import time
+import argparse
+import config
+from src.connections import get_mongo_db, mongo_available, close_mongo
+from src.search_index import SearchIndex
+
+
+def parse_args():
+    """Разбирает аргументы командной строки"""
+    arg_parser = argparse.ArgumentParser(description="Полнотекстовый поиск спектаклей")
+    arg_parser.add_argument('query', nargs='*', help="поисковый запрос")
+    arg_parser.add_argument('--limit', type=int, default=config.SEARCH_CONFIG['limit'])
+    arg_parser.add_argument(
+        '--rebuild', action='store_true',
+        help="перестроить индекс по коллекции спектаклей в MongoDB"
+    )
+    return arg_parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    index = SearchIndex()
+
+    if args.rebuild:
+        if not mongo_available():
+            print("Для перестроения индекса нужна MongoDB")
+            return
+
+        plays = get_mongo_db()[config.MONGO_CONFIG['collection']].find(
+            {}, {'url': 1, 'name': 1, 'theatre': 1, 'genre': 1, 'description': 1, '_id': 0}
+        )
+        start_time = time.time()
+        count = index.rebuild(plays)
+        print(f"Индекс поиска перестроен: {count} спектаклей за {time.time() - start_time:.2f} сек")
+        close_mongo()
+
+    if args.query:
+        query = ' '.join(args.query)
+        start_time = time.perf_counter()
+        results = index.search(query, args.limit)
+        elapsed = (time.perf_counter() - start_time) * 1000
+
+        print(f"\nПоиск «{query}»: найдено {len(results)} за {elapsed:.1f} мс")
+        for i, play in enumerate(results, 1):
+            print(f"   {i}. {play['name']} ({play['theatre']}, {play['genre']}) - {play['score']}")
+            print(f"      {play['url']}")
+    else:
+        print(f"Спектаклей в индексе: {index.count()}")
+
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import json
+from datetime import datetime
+from functools import partial
+from aiohttp import web
+import config
+from src.connections import create_async_mongo_client, create_async_redis_client
+from src.query_service import AsyncQueryService
+
+SERVICE_KEY = web.AppKey('service', AsyncQueryService)
+
+# Поля подсказок в адресе и в индексе имен
+COMPLETE_FIELDS = {'actors': 'actors', 'directors': 'director', 'theatres': 'theatre'}
+
+# Даты и ObjectId отдаются строками
+json_response = partial(web.json_response, dumps=partial(json.dumps, ensure_ascii=False, default=str))
+
+
+def _int_param(request, name: str, default: int) -> int:
+    """Целочисленный параметр запроса в допустимых пределах"""
+    value = request.query.get(name, default)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(text=f"Параметр {name} должен быть числом")
+
+    if not 1 <= value <= config.API_CONFIG['max_limit']:
+        raise web.HTTPBadRequest(text=f"Параметр {name} должен быть от 1 до {config.API_CONFIG['max_limit']}")
+    return value
+
+
+async def _play_list(request, list_name: str, value: str, prefix: bool = False):
+    """Список целиком из кеша или, если задан limit или cursor, одна страница"""
+    service = request.app[SERVICE_KEY]
+    if 'limit' not in request.query and 'cursor' not in request.query:
+        return None
+
+    limit = _int_param(request, 'limit', config.API_CONFIG['max_limit'])
+    try:
+        page = await service.page_plays(list_name, value, limit, request.query.get('cursor'), prefix)
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+    return json_response(page)
+
+
+async def theatre_repertoire(request):
+    """GET /theatres/{theatre}/plays?limit=50&cursor=..."""
+    theatre = request.match_info['theatre']
+    page = await _play_list(request, 'theatre_repertoire', theatre)
+    return page or json_response(await request.app[SERVICE_KEY].theatre_repertoire(theatre))
+
+
+async def director_works(request):
+    """GET /directors/{director}/plays?limit=50&cursor=..."""
+    director = request.match_info['director']
+    page = await _play_list(request, 'director_works', director)
+    return page or json_response(await request.app[SERVICE_KEY].director_works(director))
+
+
+async def actor_plays(request):
+    """GET /actors/{actor}/plays?prefix=1&limit=50&cursor=..."""
+    actor = request.match_info['actor']
+    prefix = request.query.get('prefix', '0') in ('1', 'true')
+    page = await _play_list(request, 'actor_plays', actor, prefix)
+    return page or json_response(await request.app[SERVICE_KEY].actor_plays(actor, prefix))
+
+
+async def complete(request):
+    """GET /complete/{field}?q=...&limit=10 - подсказки актеров, режиссеров и театров"""
+    field = COMPLETE_FIELDS.get(request.match_info['field'])
+    if field is None:
+        raise web.HTTPNotFound(text=f"Поле для подсказок: {', '.join(COMPLETE_FIELDS)}")
+
+    limit = _int_param(request, 'limit', config.NAME_INDEX_CONFIG['complete_limit'])
+    suggestions = request.app[SERVICE_KEY].complete(field, request.query.get('q', ''), limit)
+    if suggestions is None:
+        raise web.HTTPServiceUnavailable(text="Индекс имен еще не построен")
+    return json_response(suggestions)
+
+
+async def search(request):
+    """GET /search?q=...&limit=10 - поиск по названиям и описаниям"""
+    query = request.query.get('q', '').strip()
+    if not query:
+        raise web.HTTPBadRequest(text="Укажите поисковый запрос q")
+
+    limit = _int_param(request, 'limit', config.SEARCH_CONFIG['limit'])
+    return json_response(await request.app[SERVICE_KEY].search(query, limit))
+
+
+async def plays_on_date(request):
+    """GET /plays?date=YYYY-MM-DD"""
+    try:
+        day = datetime.strptime(request.query['date'], '%Y-%m-%d')
+    except (KeyError, ValueError):
+        raise web.HTTPBadRequest(text="Укажите дату в формате date=YYYY-MM-DD")
+
+    service = request.app[SERVICE_KEY]
+    return json_response(await service.plays_on_date(day))
+
+
+async def theatre_stats(request):
+    """GET /stats/theatres"""
+    return json_response(await request.app[SERVICE_KEY].theatre_stats())
+
+
+async def genre_stats(request):
+    """GET /stats/genres"""
+    return json_response(await request.app[SERVICE_KEY].genre_stats())
+
+
+async def upcoming_shows(request):
+    """GET /shows/upcoming?days=7"""
+    days = _int_param(request, 'days', 7)
+    return json_response(await request.app[SERVICE_KEY].upcoming_shows(days))
+
+
+async def top_actors(request):
+    """GET /stats/actors?limit=10"""
+    limit = _int_param(request, 'limit', 10)
+    return json_response(await request.app[SERVICE_KEY].top_actors(limit))
+
+
+async def date_distribution(request):
+    """GET /stats/months"""
+    return json_response(await request.app[SERVICE_KEY].date_distribution())
+
+
+async def health(request):
+    """GET /health - доступность MongoDB и Redis"""
+    service = request.app[SERVICE_KEY]
+    status = {'mongo': False, 'redis': False, 'cache': service.counters}
+
+    try:
+        await service.db.command('ping')
+        status['mongo'] = True
+    except Exception as e:
+        print(f"MongoDB недоступна: {e}")
+
+    if service.redis is not None:
+        try:
+            status['redis'] = bool(await service.redis.ping())
+        except Exception as e:
+            print(f"Redis недоступен: {e}")
+
+    return json_response(status, status=200 if status['mongo'] else 503)
+
+
+def create_app(db=None, redis_client=None) -> web.Application:
+    """Создает приложение; db и redis_client можно подменить (например, в проверках)"""
+    app = web.Application()
+
+    async def connect(app):
+        clients = {}
+        if db is None:
+            clients['mongo'] = create_async_mongo_client()
+        redis = redis_client if redis_client is not None else create_async_redis_client()
+        if redis_client is None:
+            clients['redis'] = redis
+
+        database = db if db is not None else clients['mongo'][config.MONGO_CONFIG['database']]
+        app[SERVICE_KEY] = AsyncQueryService(database, redis)
+        yield
+
+        # Закрываем только клиенты, созданные приложением
+        if 'mongo' in clients:
+            await clients['mongo'].close()
+        if 'redis' in clients:
+            await clients['redis'].aclose()
+
+    app.cleanup_ctx.append(connect)
+    app.router.add_get('/theatres/{theatre}/plays', theatre_repertoire)
+    app.router.add_get('/directors/{director}/plays', director_works)
+    app.router.add_get('/actors/{actor}/plays', actor_plays)
+    app.router.add_get('/complete/{field}', complete)
+    app.router.add_get('/search', search)
+    app.router.add_get('/plays', plays_on_date)
+    app.router.add_get('/stats/theatres', theatre_stats)
+    app.router.add_get('/stats/genres', genre_stats)
+    app.router.add_get('/stats/actors', top_actors)
+    app.router.add_get('/stats/months', date_distribution)
+    app.router.add_get('/shows/upcoming', upcoming_shows)
+    app.router.add_get('/health', health)
+    return app
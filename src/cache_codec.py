@@ -0,0 +1,124 @@
+import json
+import struct
+import zlib
+from datetime import datetime
+from typing import Any, Optional
+import config
+
+# Необязательные зависимости: используются, если установлены
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Заголовок значения: метка, версия формата, кодек, сжатие, версия схемы данных
+MAGIC = b'TC'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('>2sBBBH')
+
+CODECS = {'json': 1, 'msgpack': 2}
+COMPRESSIONS = {'none': 0, 'zlib': 1, 'zstd': 2}
+
+
+class CodecError(ValueError):
+    """Значение в кеше не удалось прочитать"""
+
+
+def _encode_default(value):
+    """Кодирует типы, которых нет в JSON/msgpack"""
+    if isinstance(value, datetime):
+        return {'$date': value.isoformat()}
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    # ObjectId и прочее сохраняем строкой
+    return str(value)
+
+
+def _decode_hook(value):
+    """Восстанавливает даты после декодирования"""
+    if len(value) == 1 and '$date' in value:
+        return datetime.fromisoformat(value['$date'])
+    return value
+
+
+def resolve_codec(name: Optional[str] = None) -> str:
+    """Выбирает кодек: заданный в настройках или самый компактный из доступных"""
+    name = name or config.CACHE_CONFIG['codec']
+    if name == 'auto':
+        return 'msgpack' if msgpack is not None else 'json'
+    if name == 'msgpack' and msgpack is None:
+        print("msgpack не установлен, используем json")
+        return 'json'
+    return name
+
+
+def resolve_compression(name: Optional[str] = None) -> str:
+    """Выбирает сжатие: заданное в настройках или лучшее из доступных"""
+    name = name or config.CACHE_CONFIG['compression']
+    if name == 'auto':
+        return 'zstd' if zstandard is not None else 'zlib'
+    if name == 'zstd' and zstandard is None:
+        print("zstandard не установлен, используем zlib")
+        return 'zlib'
+    return name
+
+
+class CacheCodec:
+    """Сериализует значения кеша в компактный формат с заголовком"""
+
+    def __init__(self, codec: Optional[str] = None, compression: Optional[str] = None,
+                 threshold: Optional[int] = None, schema_version: Optional[int] = None):
+        self.codec = resolve_codec(codec)
+        self.compression = resolve_compression(compression)
+        self.threshold = threshold if threshold is not None else config.CACHE_CONFIG['compress_threshold']
+        self.level = config.CACHE_CONFIG['compression_level']
+        self.schema_version = schema_version or config.CACHE_CONFIG['schema_version']
+
+    def encode(self, value: Any) -> bytes:
+        """Кодирует значение; небольшие значения не сжимаются"""
+        if self.codec == 'msgpack':
+            body = msgpack.packb(value, default=_encode_default, use_bin_type=True)
+        else:
+            body = json.dumps(value, ensure_ascii=False, separators=(',', ':'),
+                              default=_encode_default).encode('utf-8')
+
+        compression = self.compression if len(body) >= self.threshold else 'none'
+        if compression == 'zlib':
+            body = zlib.compress(body, self.level)
+        elif compression == 'zstd':
+            body = zstandard.ZstdCompressor(level=self.level).compress(body)
+
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, CODECS[self.codec],
+                             COMPRESSIONS[compression], self.schema_version)
+        return header + body
+
+    def decode(self, data: bytes) -> Any:
+        """Декодирует значение по его заголовку"""
+        if len(data) < HEADER.size:
+            raise CodecError("Слишком короткое значение")
+
+        magic, version, codec_id, compression_id, schema_version = HEADER.unpack_from(data)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise CodecError("Неизвестный формат значения")
+        if schema_version != self.schema_version:
+            raise CodecError(f"Устаревшая версия схемы: {schema_version}")
+
+        body = data[HEADER.size:]
+        if compression_id == COMPRESSIONS['zlib']:
+            body = zlib.decompress(body)
+        elif compression_id == COMPRESSIONS['zstd']:
+            if zstandard is None:
+                raise CodecError("Для чтения нужен zstandard")
+            body = zstandard.ZstdDecompressor().decompress(body)
+
+        if codec_id == CODECS['msgpack']:
+            if msgpack is None:
+                raise CodecError("Для чтения нужен msgpack")
+            return msgpack.unpackb(body, object_hook=_decode_hook, raw=False)
+        return json.loads(body, object_hook=_decode_hook)
+
@@ -1,213 +1,173 @@
-from pymongo import MongoClient
 import time
 from datetime import datetime, timedelta
-from src.redis_cache import RedisCache, cache_query
+from src.redis_cache import get_redis_cache, close_redis_cache, cache_query, date_tags
+from src.connections import get_mongo_client, close_mongo, close_redis
+from src.materialized_views import MaterializedViews
+from src.play_snapshot import get_snapshot
+from src.query_stream import list_query, stream_plays, page_plays
+import config
+
+MONTHS = {
+    1: 'Январь', 2: 'Февраль', 3: 'Март', 4: 'Апрель',
+    5: 'Май', 6: 'Июнь', 7: 'Июль', 8: 'Август',
+    9: 'Сентябрь', 10: 'Октябрь', 11: 'Ноябрь', 12: 'Декабрь'
+}
+
+
+def format_theatre_stats(results):
+    """Форматирует строки theatre_stats"""
+    formatted = []
+    for stat in results:
+        formatted.append({
+            'theatre': stat['_id'],
+            'play_count': stat['play_count'],
+            'avg_duration': round(stat['avg_duration'], 1),
+            'duration_range': f"{stat['min_duration']}-{stat['max_duration']}",
+            'total_shows': stat['total_shows']
+        })
+    return formatted
+
+
+def format_genre_stats(results):
+    """Форматирует строки genre_stats"""
+    formatted = []
+    for stat in results:
+        formatted.append({
+            'genre': stat['genre'],
+            'total_plays': stat['total_plays'],
+            'theatre_count': stat['theatre_count'],
+            'total_shows': stat['total_shows'],
+            'avg_duration': round(stat.get('avg_duration', 0), 1) if stat.get('avg_duration') else None,
+            'avg_shows_per_play': round(stat['avg_shows_per_play'], 1)
+        })
+    return formatted
+
+
+def upcoming_shows_pipeline(days):
+    """Конвейер показов на N дней вперед"""
+    # Рассчитываем даты
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    future_date = today + timedelta(days=days)
+
+    # Диапазон по индексу (date, theatre) вместо разворачивания всех спектаклей
+    return [
+        {'$match': {
+            'date': {'$gte': today, '$lt': future_date}
+        }},
+        {'$group': {
+            '_id': '$date',
+            'plays': {'$push': {
+                'name': '$name',
+                'theatre': '$theatre',
+                'genre': '$genre',
+                'duration': '$duration_minutes'
+            }}
+        }},
+        {'$sort': {'_id': 1}},
+        {'$limit': 20}
+    ]
+
+
+def format_upcoming_shows(results):
+    """Форматирует показы по датам"""
+    formatted = []
+    for day in results:
+        formatted.append({
+            'date': day['_id'].isoformat(),
+            'play_count': len(day['plays']),
+            'plays': day['plays'][:5]  # Ограничиваем количество для отображения
+        })
+    return formatted
+
+
+def format_date_distribution(results):
+    """Форматирует распределение по месяцам"""
+    formatted = []
+    for stat in results:
+        formatted.append({
+            'period': f"{MONTHS[stat['_id']['month']]} {stat['_id']['year']}",
+            'show_count': stat['show_count'],
+            'play_count': stat['play_count']
+        })
+    return formatted
+
 
 class CachedQueries:
     def __init__(self, db_name='theater_db', collection_name='plays'):
-        self.client = MongoClient('localhost', 27017)
+        self.client = get_mongo_client()
         self.db = self.client[db_name]
         self.collection = self.db[collection_name]
-        self.cache = RedisCache()
-
-    @cache_query('theatre_stats', ttl=1800)
+        # Показы с датами в формате datetime (см. MongoHandler.rebuild_shows)
+        self.shows = self.db[config.MONGO_CONFIG['shows_collection']]
+        # Агрегаты пересчитываются при загрузке, запросы только читают готовые строки
+        self.views = MaterializedViews(self.db)
+        self.cache = get_redis_cache()
+
+    def _aggregate_rows(self, name, limit=0):
+        """Строки агрегата: из снимка в памяти, если он построен, иначе потоком из представления"""
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            return snapshot.read(name, limit)
+        return self.views.stream(name, limit)
+
+    def stream_plays(self, list_name, value, batch_size=None):
+        """Спектакли театра, режиссера, актера или даты потоком, без загрузки всего списка в память"""
+        return stream_plays(self.collection, list_name, list_query(list_name, value), batch_size)
+
+    def page_plays(self, list_name, value, limit=50, cursor=None):
+        """Страница списка спектаклей; cursor из предыдущей страницы продолжает выдачу"""
+        return page_plays(self.collection, list_name, list_query(list_name, value), limit, cursor)
+
+    # Записи в MongoDB сбрасывают зависимые результаты по тегам, поэтому TTL длинные
+    @cache_query('theatre_stats', ttl=6 * 3600, stale_ttl=600, tags=['theatres'])
     def get_theatre_statistics(self):
         """Статистика по театрам (с кешированием)"""
-        print("Выполняем сложный запрос: статистика театров...")
-
-        pipeline = [
-            {'$match': {
-                'theatre': {'$exists': True, '$ne': 'Не указан'},
-                'duration_minutes': {'$exists': True, '$ne': None}
-            }},
-            {'$group': {
-                '_id': '$theatre',
-                'play_count': {'$sum': 1},
-                'avg_duration': {'$avg': '$duration_minutes'},
-                'min_duration': {'$min': '$duration_minutes'},
-                'max_duration': {'$max': '$duration_minutes'},
-                'total_shows': {'$sum': {'$size': {'$ifNull': ['$dates', []]}}}
-            }},
-            {'$sort': {'play_count': -1}},
-            {'$limit': 15}
-        ]
-
-        results = list(self.collection.aggregate(pipeline))
-
-        # Форматируем результаты
-        formatted = []
-        for stat in results:
-            formatted.append({
-                'theatre': stat['_id'],
-                'play_count': stat['play_count'],
-                'avg_duration': round(stat['avg_duration'], 1),
-                'duration_range': f"{stat['min_duration']}-{stat['max_duration']}",
-                'total_shows': stat['total_shows']
-            })
-
-        return formatted
-
-    @cache_query('genre_stats', ttl=1800)
+        print("Выполняем запрос: статистика театров...")
+
+        results = self._aggregate_rows('theatre_stats', limit=15)
+
+        return format_theatre_stats(results)
+
+    @cache_query('genre_stats', ttl=6 * 3600, tags=['genres'])
     def get_genre_statistics(self):
         """Статистика по жанрам (с кешированием)"""
-        print("Выполняем сложный запрос: статистика жанров...")
-
-        pipeline = [
-            {'$match': {'genre': {'$exists': True, '$ne': ''}}},
-            {'$group': {
-                '_id': '$genre',
-                'total_plays': {'$sum': 1},
-                'unique_theatres': {'$addToSet': '$theatre'},
-                'total_shows': {'$sum': {'$size': {'$ifNull': ['$dates', []]}}},
-                'avg_duration': {'$avg': '$duration_minutes'}
-            }},
-            {'$project': {
-                'genre': '$_id',
-                'total_plays': 1,
-                'theatre_count': {'$size': '$unique_theatres'},
-                'total_shows': 1,
-                'avg_duration': 1,
-                'avg_shows_per_play': {'$divide': ['$total_shows', '$total_plays']}
-            }},
-            {'$sort': {'total_shows': -1}}
-        ]
-
-        results = list(self.collection.aggregate(pipeline))
-
-        formatted = []
-        for stat in results:
-            formatted.append({
-                'genre': stat['genre'],
-                'total_plays': stat['total_plays'],
-                'theatre_count': stat['theatre_count'],
-                'total_shows': stat['total_shows'],
-                'avg_duration': round(stat.get('avg_duration', 0), 1) if stat.get('avg_duration') else None,
-                'avg_shows_per_play': round(stat['avg_shows_per_play'], 1)
-            })
-
-        return formatted
-
-    @cache_query('upcoming_shows', ttl=300)  # Кешируем на 5 минут (часто меняется)
+        print("Выполняем запрос: статистика жанров...")
+
+        results = self._aggregate_rows('genre_stats')
+
+        return format_genre_stats(results)
+
+    @cache_query('upcoming_shows', ttl=300, tags=lambda params: date_tags(params['days']))  # Окно сдвигается каждый день
     def get_upcoming_shows(self, days=7):
         """Предстоящие спектакли на N дней (с кешированием)"""
         print(f"Выполняем сложный запрос: предстоящие спектакли на {days} дней...")
 
-        # Рассчитываем даты
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        future_date = today + timedelta(days=days)
-
-        pipeline = [
-            {'$unwind': '$dates'},
-            {'$match': {
-                'dates': {'$gte': today.isoformat(), '$lt': future_date.isoformat()}
-            }},
-            {'$group': {
-                '_id': {'date': '$dates', 'play_id': '$_id'},
-                'name': {'$first': '$name'},
-                'theatre': {'$first': '$theatre'},
-                'genre': {'$first': '$genre'},
-                'duration': {'$first': '$duration_minutes'}
-            }},
-            {'$group': {
-                '_id': '$_id.date',
-                'plays': {'$push': {
-                    'name': '$name',
-                    'theatre': '$theatre',
-                    'genre': '$genre',
-                    'duration': '$duration'
-                }}
-            }},
-            {'$sort': {'_id': 1}},
-            {'$limit': 20}
-        ]
-
-        results = list(self.collection.aggregate(pipeline))
-
-        formatted = []
-        for day in results:
-            formatted.append({
-                'date': day['_id'],
-                'play_count': len(day['plays']),
-                'plays': day['plays'][:5]  # Ограничиваем количество для отображения
-            })
-
-        return formatted
-
-    @cache_query('top_actors', ttl=3600)
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            results = snapshot.upcoming_shows(days)
+        else:
+            results = self.shows.aggregate(upcoming_shows_pipeline(days),
+                                           batchSize=config.MONGO_CONFIG['cursor_batch_size'])
+
+        return format_upcoming_shows(results)
+
+    @cache_query('top_actors', ttl=6 * 3600, stale_ttl=600, tags=['actors'])
     def get_top_actors(self, limit=10):
         """Самые популярные актеры (с кешированием)"""
-        print("Выполняем сложный запрос: топ актеров...")
-
-        pipeline = [
-            {'$unwind': '$actors'},
-            {'$match': {'actors': {'$exists': True, '$ne': ''}}},
-            {'$group': {
-                '_id': '$actors',
-                'play_count': {'$sum': 1},
-                'total_shows': {'$sum': {'$size': {'$ifNull': ['$dates', []]}}},
-                'genres': {'$addToSet': '$genre'},
-                'theatres': {'$addToSet': '$theatre'}
-            }},
-            {'$project': {
-                'actor': '$_id',
-                'play_count': 1,
-                'total_shows': 1,
-                'genre_count': {'$size': '$genres'},
-                'theatre_count': {'$size': '$theatres'}
-            }},
-            {'$sort': {'play_count': -1}},
-            {'$limit': limit}
-        ]
-
-        results = list(self.collection.aggregate(pipeline))
-
-        return results
-
-    @cache_query('date_distribution', ttl=7200)
+        print("Выполняем запрос: топ актеров...")
+
+        results = self._aggregate_rows('actor_stats', limit=limit)
+
+        return list(results)
+
+    @cache_query('date_distribution', ttl=6 * 3600, tags=['dates'])
     def get_date_distribution(self):
         """Распределение спектаклей по месяцам (с кешированием)"""
-        print("Выполняем сложный запрос: распределение по датам...")
-
-        pipeline = [
-            {'$unwind': '$dates'},
-            {'$addFields': {
-                'date_obj': {'$dateFromString': {'dateString': '$dates'}}
-            }},
-            {'$group': {
-                '_id': {
-                    'year': {'$year': '$date_obj'},
-                    'month': {'$month': '$date_obj'}
-                },
-                'show_count': {'$sum': 1},
-                'unique_plays': {'$addToSet': '$_id'}
-            }},
-            {'$project': {
-                'year': '$_id.year',
-                'month': '$_id.month',
-                'show_count': 1,
-                'play_count': {'$size': '$unique_plays'}
-            }},
-            {'$sort': {'_id.year': 1, '_id.month': 1}}
-        ]
-
-        results = list(self.collection.aggregate(pipeline))
-
-        # Форматируем месяцы
-        months = {
-            1: 'Январь', 2: 'Февраль', 3: 'Март', 4: 'Апрель',
-            5: 'Май', 6: 'Июнь', 7: 'Июль', 8: 'Август',
-            9: 'Сентябрь', 10: 'Октябрь', 11: 'Ноябрь', 12: 'Декабрь'
-        }
-
-        formatted = []
-        for stat in results:
-            formatted.append({
-                'period': f"{months[stat['_id']['month']]} {stat['_id']['year']}",
-                'show_count': stat['show_count'],
-                'play_count': stat['play_count']
-            })
-
-        return formatted
+        print("Выполняем запрос: распределение по датам...")
+
+        results = self._aggregate_rows('monthly_distribution')
+
+        return format_date_distribution(results)
 
     def run_comparison_test(self):
         """Запускает тест сравнения времени с кешем и без"""
@@ -229,6 +189,7 @@ class CachedQueries:
 
         # Второй запуск (с кешем)
         print("Второй запуск (с кешем)...")
+        hits_before = self.cache.counters['hits']
         start_time = time.time()
         result2 = self.get_theatre_statistics()
         time_with_cache = time.time() - start_time
@@ -237,7 +198,8 @@ class CachedQueries:
             'query': 'Статистика театров',
             'time_without_cache': round(time_without_cache, 3),
             'time_with_cache': round(time_with_cache, 3),
-            'speedup': round(time_without_cache / time_with_cache, 1) if time_with_cache > 0 else 0
+            'speedup': round(time_without_cache / time_with_cache, 1) if time_with_cache > 0 else 0,
+            'from_cache': self.cache.counters['hits'] > hits_before
         })
 
         # Тест 2: Статистика жанров
@@ -250,6 +212,7 @@ class CachedQueries:
         time_without_cache = time.time() - start_time
 
         print("Второй запуск (с кешем)...")
+        hits_before = self.cache.counters['hits']
         start_time = time.time()
         self.get_genre_statistics()
         time_with_cache = time.time() - start_time
@@ -258,19 +221,21 @@ class CachedQueries:
             'query': 'Статистика жанров',
             'time_without_cache': round(time_without_cache, 3),
             'time_with_cache': round(time_with_cache, 3),
-            'speedup': round(time_without_cache / time_with_cache, 1) if time_with_cache > 0 else 0
+            'speedup': round(time_without_cache / time_with_cache, 1) if time_with_cache > 0 else 0,
+            'from_cache': self.cache.counters['hits'] > hits_before
         })
 
         # Тест 3: Предстоящие спектакли
         print("\nТЕСТ 3: Предстоящие спектакли")
 
-        self.cache.delete('upcoming_shows')
+        self.cache.delete('upcoming_shows', {'days': 7})
         print("Первый запуск (без кеша)...")
         start_time = time.time()
         self.get_upcoming_shows(7)
         time_without_cache = time.time() - start_time
 
         print("Второй запуск (с кешем)...")
+        hits_before = self.cache.counters['hits']
         start_time = time.time()
         self.get_upcoming_shows(7)
         time_with_cache = time.time() - start_time
@@ -279,30 +244,41 @@ class CachedQueries:
             'query': 'Предстоящие спектакли',
             'time_without_cache': round(time_without_cache, 3),
             'time_with_cache': round(time_with_cache, 3),
-            'speedup': round(time_without_cache / time_with_cache, 1) if time_with_cache > 0 else 0
+            'speedup': round(time_without_cache / time_with_cache, 1) if time_with_cache > 0 else 0,
+            'from_cache': self.cache.counters['hits'] > hits_before
         })
 
         # Вывод результатов
         print("\n" + "=" * 60)
         print("РЕЗУЛЬТАТЫ ТЕСТА")
         print("=" * 60)
-        print(f"{'Запрос':<30} {'Без кеша':<10} {'С кешом':<10} {'Ускорение':<10}")
-        print("-" * 60)
+        print(f"{'Запрос':<30} {'Без кеша':<10} {'С кешом':<10} {'Ускорение':<10} {'Из кеша':<8}")
+        print("-" * 70)
 
         for result in test_results:
             print(f"{result['query']:<30} "
                   f"{result['time_without_cache']:<10.3f} "
                   f"{result['time_with_cache']:<10.3f} "
-                  f"{result['speedup']:<10.1f}x")
+                  f"{result['speedup']:<9.1f}x "
+                  f"{'✅' if result['from_cache'] else '❌'}")
+
+        if not all(result['from_cache'] for result in test_results):
+            print("\nПовторные запросы не попали в кеш - проверьте ключи cache_query")
 
         # Статистика кеша
         print("\nСТАТИСТИКА КЕША")
         print("-" * 40)
         cache_stats = self.cache.get_stats()
         print(f"• Всего ключей в кеше: {cache_stats.get('total_keys', 0)}")
+        print(f"• Попаданий: {cache_stats.get('hits', 0)}, промахов: {cache_stats.get('misses', 0)}, "
+              f"доля попаданий: {cache_stats.get('hit_rate', 0):.0%}")
+        print(f"• Память: {cache_stats.get('memory_usage', 0)} байт")
         print(f"• Распределение по типам запросов:")
         for query_type, count in cache_stats.get('keys_by_type', {}).items():
-            print(f"  - {query_type}: {count} ключей")
+            print(f"  - {query_type}: {count} ключей, {cache_stats['bytes_by_type'].get(query_type, 0)} байт")
+        print(f"• Оставшееся время жизни:")
+        for bucket, count in cache_stats.get('ttl_distribution', {}).items():
+            print(f"  - {bucket}: {count} ключей")
 
         return test_results
 
@@ -346,12 +322,6 @@ class CachedQueries:
         # 5. Тест производительности
         self.run_comparison_test()
 
-    def close(self):
-        """Закрывает соединения"""
-        self.client.close()
-        self.cache.close()
-
-
 def main():
     """Основная функция для демонстрации"""
     queries = CachedQueries()
@@ -365,7 +335,10 @@ def main():
         print("=" * 60)
 
     finally:
-        queries.close()
+        # Клиент MongoDB, кеш и пул Redis общие для процесса: закрываем их только здесь
+        close_redis_cache()
+        close_redis()
+        close_mongo()
 
 
 if __name__ == "__main__":
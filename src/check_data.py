@@ -3,8 +3,8 @@ import os
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-from pymongo import MongoClient
 import json
+from src.connections import get_mongo_db, close_mongo
 
 
 def check_mongo_data():
@@ -13,8 +13,7 @@ def check_mongo_data():
     print("=" * 60)
 
     try:
-        client = MongoClient('localhost', 27017)
-        db = client.theater_db
+        db = get_mongo_db()
         collection = db.plays
 
         count = collection.count_documents({})
@@ -99,7 +98,7 @@ def check_mongo_data():
             print(f"   Дат: {len(play.get('dates', []))}")
             print(f"   Продолжительность: {play.get('duration_minutes')} мин")
 
-        client.close()
+        close_mongo()
 
     except Exception as e:
         print(f"Ошибка: {e}")
@@ -0,0 +1,134 @@
+import threading
+import time
+from typing import Optional
+import redis
+import redis.asyncio
+from pymongo import AsyncMongoClient, MongoClient
+import config
+
+# Общие для процесса клиенты: пул соединений создается один раз и переиспользуется
+_mongo_client = None
+_redis_pool = None
+_redis_state = {'healthy': None, 'checked_at': 0.0}
+_lock = threading.Lock()
+
+
+def get_mongo_client() -> MongoClient:
+    """Общий клиент MongoDB с пулом соединений"""
+    global _mongo_client
+    with _lock:
+        if _mongo_client is None:
+            _mongo_client = MongoClient(
+                host=config.MONGO_CONFIG['host'],
+                port=config.MONGO_CONFIG['port'],
+                maxPoolSize=config.MONGO_CONFIG['max_pool_size'],
+                minPoolSize=config.MONGO_CONFIG['min_pool_size'],
+                maxIdleTimeMS=config.MONGO_CONFIG['max_idle_time_ms'],
+                serverSelectionTimeoutMS=config.MONGO_CONFIG['server_selection_timeout_ms']
+            )
+        return _mongo_client
+
+
+def get_mongo_db(db_name: Optional[str] = None):
+    """База данных на общем клиенте"""
+    return get_mongo_client()[db_name or config.MONGO_CONFIG['database']]
+
+
+def get_redis_client() -> redis.Redis:
+    """Клиент Redis на общем пуле соединений"""
+    global _redis_pool
+    with _lock:
+        if _redis_pool is None:
+            _redis_pool = redis.ConnectionPool(
+                host=config.REDIS_CONFIG['host'],
+                port=config.REDIS_CONFIG['port'],
+                db=config.REDIS_CONFIG['db'],
+                password=config.REDIS_CONFIG.get('password'),
+                socket_timeout=config.REDIS_CONFIG['socket_timeout'],
+                socket_connect_timeout=config.REDIS_CONFIG['socket_connect_timeout'],
+                retry_on_timeout=config.REDIS_CONFIG['retry_on_timeout'],
+                max_connections=config.REDIS_CONFIG['max_connections'],
+                # Простаивающее соединение проверяется PING-ом перед использованием
+                health_check_interval=config.REDIS_CONFIG['health_check_interval'],
+                decode_responses=False
+            )
+    return redis.Redis(connection_pool=_redis_pool)
+
+
+def create_async_mongo_client() -> AsyncMongoClient:
+    """Асинхронный клиент MongoDB с теми же настройками пула.
+
+    Привязан к циклу событий, поэтому создается приложением, а не общий для процесса.
+    """
+    return AsyncMongoClient(
+        host=config.MONGO_CONFIG['host'],
+        port=config.MONGO_CONFIG['port'],
+        maxPoolSize=config.MONGO_CONFIG['max_pool_size'],
+        minPoolSize=config.MONGO_CONFIG['min_pool_size'],
+        maxIdleTimeMS=config.MONGO_CONFIG['max_idle_time_ms'],
+        serverSelectionTimeoutMS=config.MONGO_CONFIG['server_selection_timeout_ms']
+    )
+
+
+def create_async_redis_client() -> redis.asyncio.Redis:
+    """Асинхронный клиент Redis на собственном пуле соединений"""
+    pool = redis.asyncio.ConnectionPool(
+        host=config.REDIS_CONFIG['host'],
+        port=config.REDIS_CONFIG['port'],
+        db=config.REDIS_CONFIG['db'],
+        password=config.REDIS_CONFIG.get('password'),
+        socket_timeout=config.REDIS_CONFIG['socket_timeout'],
+        socket_connect_timeout=config.REDIS_CONFIG['socket_connect_timeout'],
+        retry_on_timeout=config.REDIS_CONFIG['retry_on_timeout'],
+        max_connections=config.REDIS_CONFIG['max_connections'],
+        health_check_interval=config.REDIS_CONFIG['health_check_interval'],
+        decode_responses=False
+    )
+    return redis.asyncio.Redis(connection_pool=pool)
+
+
+def mongo_available() -> bool:
+    """Проверяет, что MongoDB отвечает"""
+    try:
+        get_mongo_client().admin.command('ping')
+        return True
+    except Exception as e:
+        print(f"MongoDB недоступна: {e}")
+        return False
+
+
+def redis_available() -> bool:
+    """Проверяет Redis не чаще раза в health_check_interval секунд"""
+    now = time.monotonic()
+    if (_redis_state['healthy'] is not None
+            and now - _redis_state['checked_at'] < config.REDIS_CONFIG['health_check_interval']):
+        return _redis_state['healthy']
+
+    try:
+        get_redis_client().ping()
+        healthy = True
+    except Exception as e:
+        print(f"Redis недоступен: {e}")
+        healthy = False
+
+    _redis_state.update(healthy=healthy, checked_at=now)
+    return healthy
+
+
+def close_mongo():
+    """Закрывает общий клиент MongoDB"""
+    global _mongo_client
+    with _lock:
+        if _mongo_client is not None:
+            _mongo_client.close()
+            _mongo_client = None
+
+
+def close_redis():
+    """Закрывает соединения общего пула Redis"""
+    global _redis_pool
+    with _lock:
+        if _redis_pool is not None:
+            _redis_pool.disconnect()
+            _redis_pool = None
+        _redis_state.update(healthy=None, checked_at=0.0)
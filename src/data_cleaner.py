@@ -3,6 +3,12 @@ from datetime import datetime
 from typing import List, Optional
 
 class DataCleaner:
+    @staticmethod
+    def base_form(name: str) -> str:
+        """Нормализует падежное окончание (Анны -> Анна, Марии -> Мария)"""
+        name = re.sub(r'ы$', 'а', name)
+        return re.sub(r'и$', 'я', name)
+
     @staticmethod
     def clean_text(text: str) -> str:
         """Очищает текст"""
@@ -0,0 +1,84 @@
+import os
+import glob
+import gzip
+import json
+import zlib
+import threading
+from datetime import datetime
+from typing import Dict, Iterator, Optional
+import config
+
+
+class HTMLArchive:
+    """Архив загруженных страниц: gzip-шарды в формате JSON Lines.
+
+    Каждая запись хранит URL, статус, заголовки и тело ответа, поэтому
+    архив можно прогнать через PageParser без доступа к сети.
+    """
+
+    SHARD_PATTERN = 'pages-*.jsonl.gz'
+
+    def __init__(self, path: Optional[str] = None, shard_records: Optional[int] = None):
+        self.path = path or config.ARCHIVE_CONFIG['dir']
+        self.shard_records = shard_records or config.ARCHIVE_CONFIG['shard_records']
+        self._file = None
+        self._records_in_shard = 0
+        self._lock = threading.Lock()
+
+    def shards(self):
+        """Файлы шардов в порядке записи"""
+        return sorted(glob.glob(os.path.join(self.path, self.SHARD_PATTERN)))
+
+    def _open_next_shard(self):
+        """Открывает новый шард после уже существующих"""
+        os.makedirs(self.path, exist_ok=True)
+        index = len(self.shards())
+        shard_path = os.path.join(self.path, f"pages-{index:05d}.jsonl.gz")
+        self._file = gzip.open(shard_path, 'at', encoding='utf-8')
+        self._records_in_shard = 0
+
+    def write(self, url: str, response):
+        """Добавляет ответ в архив"""
+        record = {
+            'url': url,
+            'status': response.status_code,
+            'headers': dict(response.headers),
+            'body': response.text,
+            'fetched_at': datetime.now().isoformat(),
+        }
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+
+        with self._lock:
+            if self._file is None or self._records_in_shard >= self.shard_records:
+                self.close()
+                self._open_next_shard()
+
+            self._file.write(line)
+            self._records_in_shard += 1
+
+    def records(self) -> Iterator[Dict]:
+        """Читает все записи архива по порядку"""
+        for shard_path in self.shards():
+            try:
+                with gzip.open(shard_path, 'rt', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            yield json.loads(line)
+                        except ValueError:
+                            # Недописанная строка в конце шарда после аварийной остановки
+                            continue
+            except (EOFError, OSError, zlib.error) as e:
+                # Шард не закрыт при аварийной остановке: прочитанные записи уже отданы
+                print(f"Шард {os.path.basename(shard_path)} оборван: {e}")
+
+    def pages(self) -> Iterator[tuple]:
+        """Успешные страницы в виде (url, байты, кодировка) для ParsePipeline"""
+        for record in self.records():
+            if record.get('status') == 200:
+                yield record['url'], record['body'].encode('utf-8'), 'utf-8'
+
+    def close(self):
+        """Закрывает текущий шард"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,44 @@
+import importlib.util
+from functools import lru_cache
+from typing import List, Optional
+from bs4 import BeautifulSoup
+import config
+
+# Построители дерева BeautifulSoup в порядке предпочтения.
+# html5lib не используется: он медленнее html.parser и строит другое дерево.
+BACKENDS = {
+    'lxml': 'lxml',
+    'html.parser': None,
+}
+
+FALLBACK_BACKEND = 'html.parser'
+
+
+@lru_cache(maxsize=None)
+def available_backends() -> List[str]:
+    """Возвращает установленные бэкенды в порядке предпочтения"""
+    return [
+        name for name, module in BACKENDS.items()
+        if module is None or importlib.util.find_spec(module) is not None
+    ]
+
+
+@lru_cache(maxsize=None)
+def resolve_backend(name: Optional[str] = None) -> str:
+    """Выбирает бэкенд: заданный в настройках или самый быстрый из доступных"""
+    name = name or config.PARSING_CONFIG.get('html_backend', 'auto')
+    available = available_backends()
+
+    if name == 'auto':
+        return available[0]
+
+    if name not in available:
+        print(f"Бэкенд {name} недоступен, используем {FALLBACK_BACKEND}")
+        return FALLBACK_BACKEND
+
+    return name
+
+
+def make_soup(markup, backend: Optional[str] = None) -> BeautifulSoup:
+    """Строит BeautifulSoup выбранным бэкендом"""
+    return BeautifulSoup(markup, resolve_backend(backend))
@@ -0,0 +1,161 @@
+import os
+import re
+import gzip
+import json
+import time
+import hashlib
+from typing import Dict, Optional
+import config
+from src.rate_limiter import throttle_reason
+
+
+class CachedResponse:
+    """Ответ из дискового кеша с тем же интерфейсом, что у requests.Response"""
+
+    def __init__(self, url: str, meta: Dict, content: bytes):
+        self.url = url
+        self.status_code = meta.get('status', 200)
+        self.headers = meta.get('headers', {})
+        self.encoding = meta.get('encoding')
+        self.content = content
+        self.from_cache = True
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def raise_for_status(self):
+        """В кеш попадают только успешные ответы"""
+        return None
+
+
+class HTTPCache:
+    """Дисковый кеш HTTP-ответов с перепроверкой по ETag/Last-Modified"""
+
+    # Заголовки, которые сохраняются вместе с телом
+    STORED_HEADERS = ['Content-Type', 'ETag', 'Last-Modified', 'Date']
+
+    def __init__(self, cache_dir: Optional[str] = None, max_age: Optional[int] = None):
+        self.cache_dir = cache_dir or config.HTTP_CACHE_CONFIG['dir']
+        self.ttl = config.HTTP_CACHE_CONFIG['ttl']
+        self.enabled = config.HTTP_CACHE_CONFIG['enabled']
+        # Переопределяет TTL для всех страниц (0 - всегда перепроверять)
+        self.max_age = max_age
+
+    @staticmethod
+    def classify(url: str) -> str:
+        """Определяет тип страницы для выбора TTL"""
+        if '/teatr/' in url:
+            return 'play'
+        if re.search(r'/\d{4}-\d{2}-\d{2}(?:$|[/?])', url):
+            return 'calendar'
+        return 'category'
+
+    def ttl_for(self, url: str) -> int:
+        """TTL страницы в секундах"""
+        if self.max_age is not None:
+            return self.max_age
+        return self.ttl[self.classify(url)]
+
+    def _paths(self, url: str):
+        """Пути к метаданным и телу ответа"""
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        shard_dir = os.path.join(self.cache_dir, key[:2])
+        return os.path.join(shard_dir, f"{key}.json"), os.path.join(shard_dir, f"{key}.html.gz")
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        """Записывает файл через временный, чтобы читатели не видели половину"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _load_meta(self, url: str) -> Optional[Dict]:
+        meta_path, _ = self._paths(url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _load_response(self, url: str, meta: Dict) -> Optional[CachedResponse]:
+        _, body_path = self._paths(url)
+        try:
+            with open(body_path, 'rb') as f:
+                return CachedResponse(url, meta, gzip.decompress(f.read()))
+        except (OSError, EOFError):
+            return None
+
+    def _save_meta(self, url: str, meta: Dict):
+        meta_path, _ = self._paths(url)
+        self._write_atomic(meta_path, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+
+    def get_fresh(self, url: str) -> Optional[CachedResponse]:
+        """Возвращает ответ из кеша, если его TTL еще не истек"""
+        if not self.enabled:
+            return None
+
+        meta = self._load_meta(url)
+        if not meta or time.time() - meta['fetched_at'] >= self.ttl_for(url):
+            return None
+
+        return self._load_response(url, meta)
+
+    def store(self, url: str, response):
+        """Сохраняет успешный ответ на диск; страница-заглушка (капча) не сохраняется"""
+        if not self.enabled or response.status_code != 200 or throttle_reason(response):
+            return
+
+        headers = {name: response.headers[name] for name in self.STORED_HEADERS if name in response.headers}
+        meta = {
+            'url': url,
+            'status': response.status_code,
+            'headers': headers,
+            'encoding': response.encoding or response.apparent_encoding,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fetched_at': time.time(),
+        }
+
+        _, body_path = self._paths(url)
+        self._write_atomic(body_path, gzip.compress(response.content))
+        self._save_meta(url, meta)
+
+    def invalidate(self, url: str):
+        """Удаляет страницу из кеша"""
+        for path in self._paths(url):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def fetch(self, session, url: str, headers: Optional[Dict] = None, **kwargs):
+        """Выполняет запрос; при наличии копии в кеше - условный (304 отдает копию)"""
+        meta = self._load_meta(url) if self.enabled else None
+        headers = dict(headers or {})
+
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        response = session.get(url, headers=headers, **kwargs)
+
+        if response.status_code == 304:
+            cached = self._load_response(url, meta) if meta else None
+            if cached is not None:
+                meta['fetched_at'] = time.time()
+                self._save_meta(url, meta)
+                return cached
+
+            # Тело потерялось - запрашиваем страницу заново без условий
+            self.invalidate(url)
+            headers.pop('If-None-Match', None)
+            headers.pop('If-Modified-Since', None)
+            response = session.get(url, headers=headers, **kwargs)
+
+        self.store(url, response)
+        return response
@@ -0,0 +1,180 @@
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+import config
+
+# Агрегаты по спектаклям: коллекция-источник, поле-ключ группы и конвейер группировки
+VIEWS = {
+    'theatre_stats': {
+        'source': 'plays',
+        'key': 'theatre',
+        'pipeline': [
+            {'$match': {
+                'theatre': {'$exists': True, '$ne': 'Не указан'},
+                'duration_minutes': {'$exists': True, '$ne': None}
+            }},
+            {'$group': {
+                '_id': '$theatre',
+                'play_count': {'$sum': 1},
+                'avg_duration': {'$avg': '$duration_minutes'},
+                'min_duration': {'$min': '$duration_minutes'},
+                'max_duration': {'$max': '$duration_minutes'},
+                'total_shows': {'$sum': {'$size': {'$ifNull': ['$dates', []]}}}
+            }}
+        ],
+        'sort': [('play_count', -1)]
+    },
+    'genre_stats': {
+        'source': 'plays',
+        'key': 'genre',
+        'pipeline': [
+            {'$match': {'genre': {'$exists': True, '$ne': ''}}},
+            {'$group': {
+                '_id': '$genre',
+                'total_plays': {'$sum': 1},
+                'unique_theatres': {'$addToSet': '$theatre'},
+                'total_shows': {'$sum': {'$size': {'$ifNull': ['$dates', []]}}},
+                'avg_duration': {'$avg': '$duration_minutes'}
+            }},
+            {'$project': {
+                'genre': '$_id',
+                'total_plays': 1,
+                'theatre_count': {'$size': '$unique_theatres'},
+                'total_shows': 1,
+                'avg_duration': 1,
+                'avg_shows_per_play': {'$divide': ['$total_shows', '$total_plays']}
+            }}
+        ],
+        'sort': [('total_shows', -1)]
+    },
+    'actor_stats': {
+        'source': 'plays',
+        'key': 'actors',
+        'pipeline': [
+            {'$unwind': '$actors'},
+            {'$match': {'actors': {'$exists': True, '$ne': ''}}},
+            {'$group': {
+                '_id': '$actors',
+                'play_count': {'$sum': 1},
+                'total_shows': {'$sum': {'$size': {'$ifNull': ['$dates', []]}}},
+                'genres': {'$addToSet': '$genre'},
+                'theatres': {'$addToSet': '$theatre'}
+            }},
+            {'$project': {
+                'actor': '$_id',
+                'play_count': 1,
+                'total_shows': 1,
+                'genre_count': {'$size': '$genres'},
+                'theatre_count': {'$size': '$theatres'}
+            }}
+        ],
+        'sort': [('play_count', -1)]
+    },
+    'monthly_distribution': {
+        'source': 'shows',
+        'key': None,
+        'pipeline': [
+            {'$group': {
+                '_id': {
+                    'year': {'$year': '$date'},
+                    'month': {'$month': '$date'}
+                },
+                'show_count': {'$sum': 1},
+                'unique_plays': {'$addToSet': '$url'}
+            }},
+            {'$project': {
+                'year': '$_id.year',
+                'month': '$_id.month',
+                'show_count': 1,
+                'play_count': {'$size': '$unique_plays'}
+            }}
+        ],
+        'sort': [('_id.year', 1), ('_id.month', 1)]
+    },
+}
+
+
+class MaterializedViews:
+    """Предрассчитанные агрегаты по спектаклям, обновляемые после загрузки"""
+
+    def __init__(self, db):
+        self.db = db
+        self.sources = {
+            'plays': db[config.MONGO_CONFIG['collection']],
+            'shows': db[config.MONGO_CONFIG['shows_collection']],
+        }
+        self._checked = False
+
+    def refresh(self, names: Optional[Iterable[str]] = None):
+        """Полностью пересчитывает представления через $out"""
+        for name in names or VIEWS:
+            view = VIEWS[name]
+            try:
+                # $out подменяет коллекцию целиком, читатели не видят промежуточного состояния
+                self.sources[view['source']].aggregate(view['pipeline'] + [{'$out': name}])
+                self.db[name].create_index(view['sort'], name=f"{name}_sort_index")
+            except Exception as e:
+                print(f"Ошибка при обновлении {name}: {e}")
+
+        print("Предрассчитанные агрегаты обновлены")
+
+    def refresh_keys(self, keys: Dict[str, set]):
+        """Пересчитывает через $merge только группы с переданными ключами: {поле: значения}"""
+        stamp = datetime.now()
+
+        for name, view in VIEWS.items():
+            values = list(keys.get(view['key']) or []) if view['key'] else []
+            if not values:
+                continue
+
+            pipeline = (
+                [{'$match': {view['key']: {'$in': values}}}]
+                + view['pipeline']
+                # Спектакль попадает и в чужие группы (актеры), их не трогаем
+                + [{'$match': {'_id': {'$in': values}}},
+                   {'$addFields': {'_refreshed_at': stamp}},
+                   {'$merge': {'into': name, 'on': '_id',
+                               'whenMatched': 'replace', 'whenNotMatched': 'insert'}}]
+            )
+
+            try:
+                self.sources[view['source']].aggregate(pipeline)
+                # Группы, в которых не осталось спектаклей
+                self.db[name].delete_many({'_id': {'$in': values}, '_refreshed_at': {'$ne': stamp}})
+            except Exception as e:
+                print(f"Ошибка при обновлении {name}: {e}")
+
+        # Распределение по месяцам пересчитывается по компактной коллекции показов
+        self.refresh(name for name, view in VIEWS.items() if not view['key'])
+
+    def stream(self, name: str, limit: int = 0, batch_size: Optional[int] = None) -> Iterator[Dict]:
+        """Строки представления в порядке сортировки, по одной"""
+        if not self._checked:
+            # Представления еще не строились (например, база загружена старой версией)
+            if name not in self.db.list_collection_names():
+                self.refresh()
+            self._checked = True
+
+        cursor = (self.db[name].find({}, {'_refreshed_at': 0})
+                  .sort(VIEWS[name]['sort'])
+                  .limit(limit)
+                  .batch_size(batch_size or config.MONGO_CONFIG['cursor_batch_size']))
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+
+    def read(self, name: str, limit: int = 0) -> List[Dict]:
+        """Возвращает строки представления в порядке сортировки"""
+        return list(self.stream(name, limit))
+
+    @staticmethod
+    def keys_of(plays: Iterable[Dict]) -> Dict[str, set]:
+        """Собирает ключи групп, которые затрагивают спектакли"""
+        keys = {'theatre': set(), 'genre': set(), 'actors': set()}
+        for play in plays:
+            if play.get('theatre'):
+                keys['theatre'].add(play['theatre'])
+            if play.get('genre'):
+                keys['genre'].add(play['genre'])
+            keys['actors'].update(actor for actor in play.get('actors') or [] if actor)
+        return keys
@@ -1,25 +1,29 @@
 import json
 import os
 from datetime import datetime
-from pymongo import MongoClient, errors
-from typing import List, Dict
+from pymongo import UpdateOne, errors
+from typing import List, Dict, Optional
 import config
+from src.materialized_views import MaterializedViews
+from src.connections import get_mongo_client
+from src.redis_cache import get_redis_cache, write_tags
+from src.play_snapshot import PlaySnapshot, SNAPSHOT_PROJECTION, snapshot_enabled
+from src.name_index import NameIndex, INDEX_PROJECTION
+from src.search_index import get_search_index
 
 class MongoHandler:
     def __init__(self):
         self.client = None
         self.db = None
         self.collection = None
+        self.shows = None
+        self.views = None
         self.connected = False
 
     def connect(self):
         """Подключается к MongoDB"""
         try:
-            self.client = MongoClient(
-                host=config.MONGO_CONFIG['host'],
-                port=config.MONGO_CONFIG['port'],
-                serverSelectionTimeoutMS=5000
-            )
+            self.client = get_mongo_client()
 
             # Проверяем подключение
             self.client.admin.command('ping')
@@ -27,8 +31,11 @@ class MongoHandler:
 
             self.db = self.client[config.MONGO_CONFIG['database']]
             self.collection = self.db[config.MONGO_CONFIG['collection']]
+            self.shows = self.db[config.MONGO_CONFIG['shows_collection']]
+            self.views = MaterializedViews(self.db)
 
             self.create_indexes()
+            self.create_show_indexes()
 
             self.connected = True
             return True
@@ -41,49 +48,179 @@ class MongoHandler:
             print(f"Ошибка: {e}")
             return False
 
-    def create_indexes(self):
+    def create_indexes(self, collection=None):
         """Создает необходимые индексы"""
+        collection = collection if collection is not None else self.collection
         try:
-            self.collection.create_index([('url', 1)], unique=True, name='url_index')
+            collection.create_index([('url', 1)], unique=True, name='url_index')
 
-            self.collection.create_index([('name', 1)], name='name_index')
-            self.collection.create_index([('theatre', 1)], name='theatre_index')
-            self.collection.create_index([('genre', 1)], name='genre_index')
-            self.collection.create_index([('dates', 1)], name='dates_index')
+            collection.create_index([('name', 1)], name='name_index')
+            collection.create_index([('theatre', 1)], name='theatre_index')
+            collection.create_index([('genre', 1)], name='genre_index')
+            collection.create_index([('director', 1)], name='director_index')
+            collection.create_index([('actors', 1)], name='actors_index')
+            collection.create_index([('dates', 1)], name='dates_index')
 
             print("Созданы индексы для оптимизации запросов")
         except Exception as e:
             print(f"Ошибка при создании индексов: {e}")
 
-    def save_play(self, play_data: Dict) -> bool:
-        """Сохраняет один спектакль в MongoDB"""
+    def invalidate_cache(self, plays: List[Dict], full_reload: bool = False):
+        """Удаляет из кеша результаты запросов, зависящие от записанных спектаклей"""
+        if not config.CACHE_CONFIG['enabled'] or not config.CACHE_CONFIG['invalidate_on_write']:
+            return
+
+        cache = get_redis_cache()
+        if cache.enabled:
+            cache.invalidate_tags(write_tags(plays, full_reload))
+
+    def refresh_snapshot(self):
+        """Перестраивает колоночный снимок спектаклей для аналитики в памяти"""
+        if not self.connected or not snapshot_enabled():
+            return
+
+        try:
+            snapshot = PlaySnapshot.from_plays(self.collection.find({}, SNAPSHOT_PROJECTION))
+            snapshot.save()
+            print(f"Снимок спектаклей для аналитики обновлен: {snapshot.size} спектаклей")
+        except Exception as e:
+            print(f"Ошибка при обновлении снимка спектаклей: {e}")
+
+    def refresh_name_index(self):
+        """Перестраивает индекс имен актеров, режиссеров и театров"""
+        if not self.connected or not config.NAME_INDEX_CONFIG['enabled']:
+            return
+
+        try:
+            index = NameIndex.from_plays(self.collection.find({}, INDEX_PROJECTION))
+            index.save()
+            print(f"Индекс имен обновлен: {len(index.names['actors'])} актеров, "
+                  f"{len(index.names['director'])} режиссеров, {len(index.names['theatre'])} театров")
+        except Exception as e:
+            print(f"Ошибка при обновлении индекса имен: {e}")
+
+    def update_search_index(self, plays: List[Dict], full_reload: bool = False):
+        """Обновляет полнотекстовый индекс названий и описаний"""
+        index = get_search_index()
+        if index is None:
+            return
+
+        try:
+            if full_reload:
+                count = index.rebuild(plays)
+                print(f"Индекс поиска перестроен: {count} спектаклей")
+            else:
+                index.update(plays)
+        except Exception as e:
+            print(f"Ошибка при обновлении индекса поиска: {e}")
+
+    def create_show_indexes(self, collection=None):
+        """Создает индексы коллекции показов для запросов по диапазону дат"""
+        collection = collection if collection is not None else self.shows
+        try:
+            collection.create_index([('date', 1), ('theatre', 1)], name='date_theatre_index')
+            collection.create_index([('date', 1), ('genre', 1)], name='date_genre_index')
+            collection.create_index([('url', 1)], name='show_url_index')
+        except Exception as e:
+            print(f"Ошибка при создании индексов показов: {e}")
+
+    @staticmethod
+    def _show_documents(plays: List[Dict], play_ids: Optional[Dict] = None) -> List[Dict]:
+        """Разворачивает даты спектаклей в отдельные показы; play_ids - сохраненные _id по url"""
+        shows = []
+        for play in plays:
+            dates = set()
+            for date_str in play.get('dates') or []:
+                try:
+                    date = datetime.fromisoformat(date_str)
+                except (TypeError, ValueError):
+                    continue
+                # Храним местное время показа, как в исходных строках
+                dates.add(date.replace(tzinfo=None))
+
+            for date in sorted(dates):
+                shows.append({
+                    'play_id': play_ids[play['url']] if play_ids is not None else play['_id'],
+                    'url': play['url'],
+                    'name': play.get('name'),
+                    'theatre': play.get('theatre'),
+                    'genre': play.get('genre'),
+                    'duration_minutes': play.get('duration_minutes'),
+                    'date': date
+                })
+        return shows
+
+    def rebuild_shows(self) -> int:
+        """Перестраивает коллекцию показов по текущей коллекции спектаклей"""
+        if not self.connected:
+            return 0
+
+        projection = {'url': 1, 'name': 1, 'theatre': 1, 'genre': 1, 'duration_minutes': 1, 'dates': 1}
+        shows = self._show_documents(list(self.collection.find({}, projection)))
+
+        staging = self.db[f"{self.shows.name}_staging"]
+        try:
+            staging.drop()
+            self.create_show_indexes(staging)
+            if shows:
+                staging.insert_many(shows, ordered=False)
+                staging.rename(self.shows.name, dropTarget=True)
+            else:
+                staging.drop()
+                self.shows.delete_many({})
+
+            print(f"Коллекция показов перестроена: {len(shows)} показов")
+            return len(shows)
+        except Exception as e:
+            print(f"Ошибка при перестроении показов: {e}")
+            return 0
+
+    def update_shows(self, plays: List[Dict]) -> int:
+        """Обновляет показы только для переданных спектаклей"""
+        if not self.connected or not plays:
+            return 0
+
+        try:
+            plays = [play for play in plays if 'url' in play]
+            urls = [play['url'] for play in plays]
+            # _id задается только при вставке и может не совпадать с _id переданной версии
+            play_ids = {doc['url']: doc['_id'] for doc in self.collection.find({'url': {'$in': urls}}, {'url': 1})}
+
+            self.shows.delete_many({'url': {'$in': urls}})
+            shows = self._show_documents([play for play in plays if play['url'] in play_ids], play_ids)
+            if shows:
+                self.shows.insert_many(shows, ordered=False)
+            return len(shows)
+        except Exception as e:
+            print(f"Ошибка при обновлении показов: {e}")
+            return 0
+
+    def save_play(self, play_data: Dict, refresh: bool = True) -> bool:
+        """Сохраняет один спектакль в MongoDB.
+
+        refresh=False пропускает обновление производных данных и кеша: так пишут
+        промежуточные сохранения, после которых все равно идет полная запись.
+        """
         if not self.connected:
             print("Нет подключения к MongoDB")
             return False
 
-        try:
-            # Удаляем конфликтующие поля, если они уже есть
-            play_data_copy = play_data.copy()
-
-            # Убираем временные метки, которые могут конфликтовать
-            fields_to_remove = ['_created_at', '_updated_at', '_parsed_date']
-            for field in fields_to_remove:
-                play_data_copy.pop(field, None)
-
-            # Добавляем свежие метаданные
-            now = datetime.now()
-            update_data = {
-                '$set': play_data_copy,
-                '$setOnInsert': {'_created_at': now},
-                '$currentDate': {'_updated_at': True}
-            }
+        if 'url' not in play_data:
+            print(f"Нет URL у спектакля: {play_data.get('name', 'Без названия')}")
+            return False
 
+        try:
+            # Тот же _id, что при пакетной записи, а не ObjectId от MongoDB
+            play_data['_id'] = self.generate_id(play_data)
+            previous = self._previous_versions([play_data])
             # Пробуем вставить или обновить
             result = self.collection.update_one(
                 {'url': play_data['url']},
-                update_data,
+                self._build_update(play_data),
                 upsert=True
             )
+            if refresh:
+                self._refresh_derived(previous, [play_data])
 
             if result.upserted_id:
                 print(f"Добавлен: {play_data.get('name', 'Без названия')[:40]}...")
@@ -99,6 +236,85 @@ class MongoHandler:
             print(f"Ошибка при сохранении: {e}")
             return False
 
+    def _build_update(self, play_data: Dict) -> Dict:
+        """Формирует операцию обновления для upsert спектакля"""
+        # Удаляем конфликтующие поля, если они уже есть
+        play_data_copy = play_data.copy()
+
+        # _id неизменяем: задаем его только при вставке
+        play_id = play_data_copy.pop('_id', None)
+
+        # Убираем временные метки, которые могут конфликтовать
+        fields_to_remove = ['_created_at', '_updated_at', '_parsed_date']
+        for field in fields_to_remove:
+            play_data_copy.pop(field, None)
+
+        # Добавляем свежие метаданные
+        on_insert = {'_created_at': datetime.now()}
+        if play_id is not None:
+            on_insert['_id'] = play_id
+
+        return {
+            '$set': play_data_copy,
+            '$setOnInsert': on_insert,
+            '$currentDate': {'_updated_at': True}
+        }
+
+    def bulk_save_plays(self, plays: List[Dict], batch_size: Optional[int] = None,
+                        collection=None) -> Dict[str, int]:
+        """Сохраняет спектакли пачками через bulk_write; возвращает итоговые счетчики"""
+        collection = collection if collection is not None else self.collection
+        batch_size = batch_size or config.MONGO_CONFIG['batch_size']
+        totals = {'inserted': 0, 'updated': 0, 'failed': 0}
+
+        operations = []
+        for play in plays:
+            # Убедимся, что есть URL
+            if 'url' not in play:
+                print(f"Нет URL у спектакля: {play.get('name', 'Без названия')}")
+                totals['failed'] += 1
+                continue
+
+            play['_id'] = self.generate_id(play)
+            operations.append(UpdateOne({'url': play['url']}, self._build_update(play), upsert=True))
+
+        for start in range(0, len(operations), batch_size):
+            batch = operations[start:start + batch_size]
+            batch_stats = self._write_batch(collection, batch)
+
+            for key in totals:
+                totals[key] += batch_stats[key]
+
+            print(f"Пачка {start // batch_size + 1}: добавлено {batch_stats['inserted']}, "
+                  f"обновлено {batch_stats['updated']}, ошибок {batch_stats['failed']}")
+
+        return totals
+
+    def _write_batch(self, collection, batch: List[UpdateOne]) -> Dict[str, int]:
+        """Выполняет одну пачку upsert-операций без остановки на ошибках"""
+        try:
+            result = collection.bulk_write(batch, ordered=False)
+            return {
+                'inserted': result.upserted_count,
+                'updated': result.matched_count,
+                'failed': 0
+            }
+        except errors.BulkWriteError as e:
+            # Неупорядоченная запись: остальные операции пачки выполнены
+            details = e.details
+            write_errors = details.get('writeErrors', [])
+            for error in write_errors[:3]:
+                print(f"Ошибка записи: {error.get('errmsg')}")
+
+            return {
+                'inserted': details.get('nUpserted', 0),
+                'updated': details.get('nMatched', 0),
+                'failed': len(write_errors)
+            }
+        except Exception as e:
+            print(f"Ошибка при пакетном сохранении: {e}")
+            return {'inserted': 0, 'updated': 0, 'failed': len(batch)}
+
     def save_all_plays(self, plays: List[Dict]) -> bool:
         """Сохраняет все спектакли в MongoDB"""
         if not self.connected:
@@ -107,38 +323,109 @@ class MongoHandler:
 
         print(f"Сохраняем {len(plays)} спектаклей в MongoDB...")
 
-        successful = 0
-        failed = 0
+        if config.MONGO_CONFIG['swap_on_reload']:
+            return self.reload_plays(plays)
 
         # Сначала очистим коллекцию, чтобы избежать конфликтов
         print("Очищаем коллекцию...")
         self.collection.delete_many({})
 
-        for i, play in enumerate(plays, 1):
-            try:
-                # Убедимся, что есть URL
-                if 'url' not in play:
-                    print(f"Нет URL у спектакля: {play.get('name', 'Без названия')}")
-                    failed += 1
-                    continue
+        totals = self.bulk_save_plays(plays)
+        successful = totals['inserted'] + totals['updated']
 
-                play['_id'] = self.generate_id(play)
+        print(f"Завершено: ✅ {successful} успешно, ❌ {totals['failed']} ошибок")
+        self.rebuild_shows()
+        self.views.refresh()
+        self.refresh_snapshot()
+        self.refresh_name_index()
+        self.update_search_index(plays, full_reload=True)
+        self.invalidate_cache(plays, full_reload=True)
+        return successful > 0
 
-                if self.save_play(play):
-                    successful += 1
-                else:
-                    failed += 1
+    def reload_plays(self, plays: List[Dict]) -> bool:
+        """Загружает спектакли во временную коллекцию и атомарно подменяет ею основную"""
+        staging_name = f"{self.collection.name}_staging"
+        staging = self.db[staging_name]
 
-                # Прогресс
-                if i % 10 == 0:
-                    print(f"Обработано: {i}/{len(plays)}")
+        try:
+            # Остатки прерванной загрузки
+            staging.drop()
+            self.create_indexes(staging)
 
-            except Exception as e:
-                failed += 1
-                print(f"Ошибка при сохранении {play.get('name', 'Без названия')}: {e}")
+            totals = self.bulk_save_plays(plays, collection=staging)
+            successful = totals['inserted'] + totals['updated']
+            print(f"Завершено: ✅ {successful} успешно, ❌ {totals['failed']} ошибок")
 
-        print(f"Завершено: ✅ {successful} успешно, ❌ {failed} ошибок")
-        return successful > 0
+            if not successful:
+                # Не подменяем рабочие данные пустой коллекцией
+                staging.drop()
+                return False
+
+            # Читатели видят либо старую, либо новую коллекцию целиком
+            staging.rename(self.collection.name, dropTarget=True)
+            print(f"Коллекция {self.collection.name} заменена новыми данными")
+
+            self.rebuild_shows()
+            self.views.refresh()
+            self.refresh_snapshot()
+            self.refresh_name_index()
+            self.update_search_index(plays, full_reload=True)
+            self.invalidate_cache(plays, full_reload=True)
+            return True
+
+        except Exception as e:
+            print(f"Ошибка при перезагрузке коллекции: {e}")
+            return False
+
+    def upsert_plays(self, plays: List[Dict]) -> bool:
+        """Добавляет или обновляет спектакли, не трогая остальные документы"""
+        if not self.connected:
+            if not self.connect():
+                return False
+
+        previous = self._previous_versions(plays)
+        totals = self.bulk_save_plays(plays)
+        self._refresh_derived(previous, plays)
+
+        print(f"Добавлено: {totals['inserted']}, обновлено: {totals['updated']}, "
+              f"ошибок: {totals['failed']}")
+        return totals['failed'] == 0
+
+    def _previous_versions(self, plays: List[Dict]) -> List[Dict]:
+        """Сохраненные версии спектаклей: группы, из которых они могут уйти (сменился театр, жанр, состав)"""
+        urls = [play['url'] for play in plays if 'url' in play]
+        return list(self.collection.find(
+            {'url': {'$in': urls}}, {'theatre': 1, 'genre': 1, 'actors': 1, 'director': 1, 'dates': 1}
+        ))
+
+    def _refresh_derived(self, previous: List[Dict], plays: List[Dict]):
+        """Обновляет производные данные после записи части спектаклей; кеш сбрасывается последним,
+        чтобы пересчет не прочитал устаревшие агрегаты"""
+        self.update_shows(plays)
+        self.views.refresh_keys(MaterializedViews.keys_of(previous + plays))
+        self.refresh_snapshot()
+        self.refresh_name_index()
+        self.update_search_index(plays)
+        self.invalidate_cache(previous + plays)
+
+    def get_fingerprints(self) -> Dict[str, str]:
+        """Возвращает отпечатки страниц сохраненных спектаклей: {url: fingerprint}"""
+        if not self.connected:
+            return {}
+
+        cursor = self.collection.find(
+            {'_fingerprint': {'$exists': True}},
+            {'url': 1, '_fingerprint': 1, '_id': 0}
+        )
+        return {doc['url']: doc['_fingerprint'] for doc in cursor}
+
+    def get_all_plays(self) -> Optional[List[Dict]]:
+        """Все спектакли коллекции без служебного _id; None при ошибке"""
+        try:
+            return list(self.collection.find({}, {'_id': 0}))
+        except Exception as e:
+            print(f"Ошибка при чтении спектаклей: {e}")
+            return None
 
     def generate_id(self, play_data: Dict) -> str:
         """Генерирует ID для спектакля"""
@@ -226,7 +513,6 @@ class MongoHandler:
             return False
 
     def close(self):
-        """Закрывает соединение с MongoDB"""
-        if self.client:
-            self.client.close()
-            print("🔌 Соединение с MongoDB закрыто")
\ No newline at end of file
+        """Отключает обработчик от базы; общий клиент закрывает точка входа (close_mongo)"""
+        self.client = None
+        self.connected = False
\ No newline at end of file
@@ -0,0 +1,149 @@
+import os
+import re
+import json
+import threading
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Set
+from bson import json_util
+import config
+from src.data_cleaner import DataCleaner
+
+NOT_SPECIFIED = 'Не указан'
+INDEX_FIELDS = ('actors', 'director', 'theatre')
+INDEX_PROJECTION = {'_id': 1, 'actors': 1, 'director': 1, 'theatre': 1}
+INDEX_VERSION = 1
+
+_index = None
+_index_mtime = None
+_lock = threading.Lock()
+
+
+def words(text: str) -> List[str]:
+    """Слова текста в нижнем регистре, ё заменена на е"""
+    return re.findall(r'\w+', text.lower().replace('ё', 'е'))
+
+
+def tokenize(text: str) -> List[str]:
+    """Слова имени без регистра и падежного окончания"""
+    return [DataCleaner.base_form(word) for word in words(text)]
+
+
+class NameIndex:
+    """Инвертированный индекс имен актеров, режиссеров и театров.
+
+    Нормализованные слова указывают на имена, имена - на id спектаклей,
+    поэтому поиск и автодополнение не просматривают коллекцию.
+    """
+
+    def __init__(self, names: Dict[str, Dict[str, List]]):
+        # {поле: {имя: [id спектаклей]}}
+        self.names = names
+        # {поле: {слово: {имена}}}
+        self.tokens = {field: {} for field in INDEX_FIELDS}
+        for field, field_names in names.items():
+            for name in field_names:
+                for token in tokenize(name):
+                    self.tokens[field].setdefault(token, set()).add(name)
+        # Отсортированные слова для поиска по префиксу
+        self.terms = {field: sorted(tokens) for field, tokens in self.tokens.items()}
+
+    @classmethod
+    def from_plays(cls, plays: Iterable[Dict]) -> 'NameIndex':
+        """Строит индекс по документам спектаклей"""
+        names = {field: {} for field in INDEX_FIELDS}
+        for play in plays:
+            for field in INDEX_FIELDS:
+                values = play.get(field)
+                for value in values if isinstance(values, list) else [values]:
+                    if value and value != NOT_SPECIFIED:
+                        ids = names[field].setdefault(value, [])
+                        # Актер может быть указан в спектакле дважды
+                        if not ids or ids[-1] != play['_id']:
+                            ids.append(play['_id'])
+        return cls(names)
+
+    def save(self, path: Optional[str] = None):
+        """Записывает индекс на диск; читатели видят либо старый, либо новый файл"""
+        path = path or config.NAME_INDEX_CONFIG['path']
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            # id спектаклей могут быть ObjectId (документы, вставленные не загрузчиком)
+            json.dump({'version': INDEX_VERSION, 'names': self.names}, f, ensure_ascii=False,
+                      default=json_util.default)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> 'NameIndex':
+        """Читает индекс с диска"""
+        with open(path or config.NAME_INDEX_CONFIG['path'], 'r', encoding='utf-8') as f:
+            data = json.load(f, object_hook=json_util.object_hook)
+        if data.get('version') != INDEX_VERSION:
+            raise ValueError(f"Неизвестная версия индекса: {data.get('version')}")
+        return cls(data['names'])
+
+    def _prefixed(self, field: str, prefix: str) -> Set[str]:
+        """Имена со словом, начинающимся с prefix"""
+        terms = self.terms[field]
+        names = set()
+        i = bisect_left(terms, prefix)
+        while i < len(terms) and terms[i].startswith(prefix):
+            names |= self.tokens[field][terms[i]]
+            i += 1
+        return names
+
+    def match(self, field: str, query: str, prefix: bool = False) -> Set[str]:
+        """Имена, содержащие все слова запроса; при prefix последнее слово может быть неполным"""
+        query_words = words(query)
+        matched = None
+
+        for i, word in enumerate(query_words):
+            base = DataCleaner.base_form(word)
+            if prefix and i == len(query_words) - 1:
+                # Неполное слово ищем и как есть (Мари -> Мария), и с нормальным окончанием (Анны -> Анна)
+                names = self._prefixed(field, word) | self._prefixed(field, base)
+            else:
+                names = self.tokens[field].get(base, set())
+
+            matched = set(names) if matched is None else matched & names
+            if not matched:
+                break
+
+        return matched or set()
+
+    def lookup(self, field: str, query: str, prefix: bool = False) -> List:
+        """id спектаклей, в которых есть подходящее имя"""
+        ids = set()
+        for name in self.match(field, query, prefix):
+            ids.update(self.names[field][name])
+        return sorted(ids, key=str)
+
+    def complete(self, field: str, query: str, limit: Optional[int] = None) -> List[Dict]:
+        """Подсказки имен по началу ввода, сначала самые частые"""
+        limit = limit or config.NAME_INDEX_CONFIG['complete_limit']
+        names = self.names[field]
+        ranked = sorted(self.match(field, query, prefix=True), key=lambda name: (-len(names[name]), name))
+        return [{'name': name, 'play_count': len(names[name])} for name in ranked[:limit]]
+
+
+def get_name_index() -> Optional[NameIndex]:
+    """Текущий индекс имен; перечитывается с диска, когда загрузчик записал новый"""
+    global _index, _index_mtime
+    if not config.NAME_INDEX_CONFIG['enabled']:
+        return None
+
+    try:
+        mtime = os.stat(config.NAME_INDEX_CONFIG['path']).st_mtime_ns
+    except OSError:
+        # Индекс еще не строился
+        return None
+
+    with _lock:
+        if _index is None or mtime != _index_mtime:
+            try:
+                _index = NameIndex.load()
+                _index_mtime = mtime
+            except Exception as e:
+                print(f"Ошибка при чтении индекса имен: {e}")
+                return None
+        return _index
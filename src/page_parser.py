@@ -1,18 +1,107 @@
 import re
-import time
 import json
+import asyncio
+import hashlib
 from datetime import datetime
-from typing import Dict, List, Optional
+from functools import cached_property
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
 from bs4 import BeautifulSoup
 import requests
+from requests.adapters import HTTPAdapter
 import config
 from src.data_cleaner import DataCleaner
+from src.html_backend import make_soup
+from src.http_cache import HTTPCache
+from src.html_archive import HTMLArchive
+from src.rate_limiter import AdaptiveRateLimiter, get_rate_limiter
+
+class PageContext:
+    """Данные страницы, вычисляемые один раз за разбор"""
+
+    def __init__(self, soup: BeautifulSoup):
+        self.soup = soup
+        self.director: Optional[str] = None
+
+    @cached_property
+    def scripts(self) -> List:
+        """Все теги script страницы"""
+        return self.soup.find_all('script')
+
+    @cached_property
+    def headings(self) -> List:
+        """Заголовки h2-h4 в порядке следования"""
+        return self.soup.find_all(['h2', 'h3', 'h4'])
+
+    @cached_property
+    def json_data(self) -> Optional[Dict]:
+        """Данные JSON-LD с типом Event"""
+        for script in self.scripts:
+            if script.get('type') != 'application/ld+json':
+                continue
+            try:
+                data = json.loads(script.string)
+                if isinstance(data, dict) and data.get('@type') == 'Event':
+                    return data
+                elif isinstance(data, list):
+                    for item in data:
+                        if isinstance(item, dict) and item.get('@type') == 'Event':
+                            return item
+            except:
+                continue
+
+        return None
+
+    @cached_property
+    def text(self) -> str:
+        """Весь текст страницы"""
+        return self.soup.get_text()
+
+    @cached_property
+    def lines(self) -> List[str]:
+        """Текст страницы по строкам"""
+        return self.text.split('\n')
+
+    @cached_property
+    def content_block(self):
+        """Блок с описанием спектакля"""
+        return self.soup.find('div', class_='content-block')
+
+    @cached_property
+    def content_text(self) -> str:
+        """Исходный текст блока описания"""
+        return self.content_block.get_text() if self.content_block else ""
+
+    @cached_property
+    def description(self) -> str:
+        """Описание с нормализованными пробелами"""
+        return re.sub(r'\s+', ' ', self.content_text).strip()
+
+    def find_heading(self, names, pattern):
+        """Находит первый заголовок из names, текст которого подходит под pattern"""
+        for heading in self.headings:
+            if heading.name in names and heading.string and pattern.search(heading.string):
+                return heading
+        return None
+
 
 class PageParser:
-    def __init__(self):
+    # Увеличивается при изменении логики извлечения, чтобы инкрементальный
+    # обход заново разобрал все страницы
+    FINGERPRINT_VERSION = 1
+
+    def __init__(self, rate_limiter: Optional[AdaptiveRateLimiter] = None, http_cache: Optional[HTTPCache] = None,
+                 archive: Optional[HTMLArchive] = None):
         self.cleaner = DataCleaner()
         self.session = requests.Session()
         self.session.headers.update(config.HEADERS)
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.http_cache = http_cache or HTTPCache()
+        self.archive = archive
+
+        # Пул соединений должен вмещать все одновременные запросы
+        adapter = HTTPAdapter(pool_maxsize=config.FETCH_CONFIG['concurrency'])
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
 
     @staticmethod
     def parse_russian_date(date_text):
@@ -63,35 +152,72 @@ class PageParser:
 
         return True
 
-    def fetch_page(self, url: str) -> Optional[BeautifulSoup]:
-        """Загружает страницу"""
+    def _request(self, url: str) -> Optional[requests.Response]:
+        """Выполняет HTTP-запрос (условный, если страница есть в кеше)"""
         try:
             print(f"Загружаем: {url}")
-            response = self.session.get(url, timeout=config.TIMEOUT)
+            response = self.rate_limiter.send_with_backoff(
+                url, lambda: self.http_cache.fetch(self.session, url, timeout=config.TIMEOUT)
+            )
+            if response is None:
+                self.http_cache.invalidate(url)
+                return None
+
             response.raise_for_status()
-            time.sleep(config.REQUEST_DELAY)
-            return BeautifulSoup(response.text, 'html.parser')
+            return response
         except Exception as e:
             print(f"Ошибка: {e}")
             return None
 
-    def extract_json_ld(self, soup: BeautifulSoup) -> Optional[Dict]:
-        """Извлекает JSON-LD данные"""
-        scripts = soup.find_all('script', type='application/ld+json')
+    def _record(self, url: str, response):
+        """Записывает загруженную страницу в архив, если он подключен"""
+        if self.archive is not None and response is not None:
+            self.archive.write(url, response)
+
+    def _fetch(self, url: str):
+        """Берет свежую копию из кеша или ждет слота и идет в сеть"""
+        response = self.http_cache.get_fresh(url)
+        if response is None:
+            self.rate_limiter.wait(url)
+            response = self._request(url)
+
+        self._record(url, response)
+        return response
+
+    def fetch_html(self, url: str) -> Optional[str]:
+        """Загружает HTML страницы с учетом кеша и лимита запросов"""
+        response = self._fetch(url)
+        return response.text if response is not None else None
+
+    async def fetch_html_async(self, url: str) -> Optional[str]:
+        """Асинхронно загружает HTML страницы с учетом кеша и лимита запросов"""
+        response = await self._fetch_async(url)
+        return response.text if response is not None else None
+
+    async def fetch_raw_async(self, url: str) -> Optional[Tuple[bytes, Optional[str]]]:
+        """Асинхронно загружает страницу как байты вместе с кодировкой"""
+        response = await self._fetch_async(url)
+        if response is None:
+            return None
+        return response.content, response.encoding
 
-        for script in scripts:
-            try:
-                data = json.loads(script.string)
-                if isinstance(data, dict) and data.get('@type') == 'Event':
-                    return data
-                elif isinstance(data, list):
-                    for item in data:
-                        if isinstance(item, dict) and item.get('@type') == 'Event':
-                            return item
-            except:
-                continue
+    async def _fetch_async(self, url: str):
+        """Берет свежую копию из кеша или ждет слота и идет в сеть"""
+        response = await asyncio.to_thread(self.http_cache.get_fresh, url)
+        if response is None:
+            await self.rate_limiter.wait_async(url)
+            response = await asyncio.to_thread(self._request, url)
 
-        return None
+        if self.archive is not None:
+            await asyncio.to_thread(self._record, url, response)
+        return response
+
+    def fetch_page(self, url: str) -> Optional[BeautifulSoup]:
+        """Загружает страницу"""
+        html = self.fetch_html(url)
+        if html is None:
+            return None
+        return make_soup(html)
 
     def parse_play_page(self, url: str) -> Optional[Dict]:
         """Парсит страницу спектакля"""
@@ -99,19 +225,70 @@ class PageParser:
         if not soup:
             return None
 
-        json_data = self.extract_json_ld(soup)
+        return self.parse_soup(url, soup)
+
+    @classmethod
+    def fingerprint(cls, html: str) -> str:
+        """Отпечаток содержимого страницы: JSON-LD и даты показов.
+
+        Считается регулярными выражениями по сырому HTML, без построения
+        дерева, поэтому проверка неизмененной страницы почти бесплатна.
+        """
+        json_ld = re.findall(r'<script[^>]*application/ld\+json[^>]*>(.*?)</script>', html, re.DOTALL)
+        dates = sorted(set(re.findall(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}', html)))
+
+        payload = json.dumps([cls.FINGERPRINT_VERSION, json_ld, dates], ensure_ascii=False)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def parse_html(self, url: str, html: str) -> Optional[Dict]:
+        """Парсит уже загруженный HTML спектакля"""
+        play_data = self.parse_soup(url, make_soup(html))
+        if play_data:
+            play_data['_fingerprint'] = self.fingerprint(html)
+        return play_data
+
+    async def parse_many(self, urls: Iterable[str], concurrency: Optional[int] = None) -> AsyncIterator[Dict]:
+        """Асинхронно парсит страницы и отдает спектакли по мере готовности"""
+        semaphore = asyncio.Semaphore(concurrency or config.FETCH_CONFIG['concurrency'])
+
+        async def parse_one(url):
+            async with semaphore:
+                html = await self.fetch_html_async(url)
+            if html is None:
+                return None
+
+            try:
+                return await asyncio.to_thread(self.parse_html, url, html)
+            except Exception as e:
+                print(f"Ошибка разбора {url}: {e}")
+                return None
+
+        tasks = [asyncio.create_task(parse_one(url)) for url in urls]
+
+        try:
+            for future in asyncio.as_completed(tasks):
+                play_data = await future
+                if play_data:
+                    yield play_data
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def parse_soup(self, url: str, soup: BeautifulSoup) -> Optional[Dict]:
+        """Извлекает данные спектакля из разобранной страницы"""
+        ctx = PageContext(soup)
 
         play_data = {
             'url': url,
-            'name': self.extract_name(soup, json_data),
-            'theatre': self.extract_theatre(soup, json_data),
-            'director': self.extract_director(soup, json_data),
-            'actors': self.extract_actors(soup, json_data),
-            'dates': self.extract_dates(soup, json_data),
-            'genre': self.extract_genre(soup, json_data),
-            'duration_minutes': self.extract_duration(soup, json_data),
-            'age_rating': self.extract_age_rating(soup, json_data),
-            'description': self.extract_description(soup, json_data),
+            'name': self.extract_name(ctx),
+            'theatre': self.extract_theatre(ctx),
+            'director': self.extract_director(ctx),
+            'actors': self.extract_actors(ctx),
+            'dates': self.extract_dates(ctx),
+            'genre': self.extract_genre(ctx),
+            'duration_minutes': self.extract_duration(ctx),
+            'age_rating': self.extract_age_rating(ctx),
+            'description': self.extract_description(ctx),
         }
 
         if not play_data['name'] or not play_data['dates']:
@@ -120,8 +297,10 @@ class PageParser:
         print(f"Спарсено: {play_data['name'][:50]}...")
         return play_data
 
-    def extract_name(self, soup: BeautifulSoup, json_data: Optional[Dict]) -> str:
+    def extract_name(self, ctx: PageContext) -> str:
         """Извлекает название"""
+        soup, json_data = ctx.soup, ctx.json_data
+
         if json_data and json_data.get('name'):
             name = json_data['name']
             return self.cleaner.clean_text(name)
@@ -136,8 +315,10 @@ class PageParser:
 
         return ""
 
-    def extract_theatre(self, soup: BeautifulSoup, json_data: Optional[Dict]) -> str:
+    def extract_theatre(self, ctx: PageContext) -> str:
         """Извлекает театр"""
+        soup, json_data = ctx.soup, ctx.json_data
+
         # 1. Из JSON-LD
         if json_data and json_data.get('location'):
             location = json_data['location']
@@ -161,12 +342,16 @@ class PageParser:
 
         return "Не указан"
 
-    def extract_director(self, soup: BeautifulSoup, json_data: Optional[Dict]) -> str:
-        """Извлекает режиссера"""
-
-        all_text = soup.get_text()
+    def extract_director(self, ctx: PageContext) -> str:
+        """Извлекает режиссера (результат запоминается в контексте)"""
+        if ctx.director is None:
+            ctx.director = self._find_director(ctx)
+        return ctx.director
 
-        lines = all_text.split('\n')
+    def _find_director(self, ctx: PageContext) -> str:
+        """Ищет режиссера в тексте страницы"""
+        # Строки перебираем, только если слово вообще встречается на странице
+        lines = ctx.lines if 'Режиссер' in ctx.text else []
 
         for line in lines:
             line = line.strip()
@@ -189,7 +374,7 @@ class PageParser:
                             return director
 
         # 3. Если не нашли, пробуем через описание
-        description = self.extract_description(soup, json_data)
+        description = ctx.description
         if description:
             # Прямой поиск в описании
             if 'Режиссер' in description:
@@ -203,8 +388,9 @@ class PageParser:
 
         return "Не указан"
 
-    def extract_actors(self, soup: BeautifulSoup, json_data: Optional[Dict]) -> List[str]:
+    def extract_actors(self, ctx: PageContext) -> List[str]:
         """Извлекает актеров"""
+        soup = ctx.soup
         actors = []
 
         # 1. Сначала ищем блок "Исполнители" с карточками
@@ -212,7 +398,7 @@ class PageParser:
 
         # Ищем заголовок "Исполнители"
         for tag in ['h2', 'h3', 'h4']:
-            performers_header = soup.find(tag, string=re.compile(r'Исполнители', re.IGNORECASE))
+            performers_header = ctx.find_heading([tag], re.compile(r'Исполнители', re.IGNORECASE))
             if performers_header:
                 performers_section = performers_header.find_parent('section')
                 if not performers_section:
@@ -244,9 +430,8 @@ class PageParser:
         if not actors:
             # Получаем полное описание
             description = ""
-            content_block = soup.find('div', class_='content-block')
-            if content_block:
-                description = content_block.get_text()
+            if ctx.content_block:
+                description = ctx.content_text
             else:
                 # Ищем любой текст на странице
                 main_content = soup.find('main') or soup.find('article') or soup.find('div', class_=lambda
@@ -264,7 +449,7 @@ class PageParser:
                     if not any(word in name.lower() for word in ['город', 'страна', 'улица', 'площадь']):
                         actors.append(name)
 
-        director = self.extract_director(soup, json_data)
+        director = self.extract_director(ctx)
         if director and director != "Не указан":
             # Простое сравнение: если актер совпадает с режиссером - пропускаем
             actors = [actor for actor in actors if actor != director]
@@ -297,8 +482,7 @@ class PageParser:
         unique = []
         for actor in cleaned:
             # Нормализуем окончания (Анны -> Анна)
-            base_name = re.sub(r'ы$', 'а', actor)
-            base_name = re.sub(r'и$', 'я', base_name)
+            base_name = DataCleaner.base_form(actor)
 
             if actor not in unique and base_name not in unique:
                 unique.append(actor)
@@ -320,12 +504,13 @@ class PageParser:
 
         return ' '.join(normalized_words)
 
-    def extract_dates(self, soup: BeautifulSoup, json_data: Optional[Dict]) -> List[str]:
+    def extract_dates(self, ctx: PageContext) -> List[str]:
         """Извлекает даты из расписания - ОПТИМИЗИРОВАНО ДЛЯ KASSIR.RU"""
+        soup, json_data = ctx.soup, ctx.json_data
         dates = []
 
         # 1. Ищем блок "Расписание"
-        schedule_header = soup.find(['h2', 'h3'], string=re.compile('Расписание', re.IGNORECASE))
+        schedule_header = ctx.find_heading(['h2', 'h3'], re.compile('Расписание', re.IGNORECASE))
 
         if schedule_header:
             # Ищем контейнер с датами
@@ -380,8 +565,7 @@ class PageParser:
                             dates.append(formatted)
 
             if not dates:
-                scripts = soup.find_all('script')
-                for script in scripts:
+                for script in ctx.scripts:
                     if script.string:
                         iso_dates = re.findall(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}', script.string)
                         for date_str in iso_dates:
@@ -391,10 +575,10 @@ class PageParser:
 
         return sorted(set(dates))
 
-    def extract_genre(self, soup: BeautifulSoup, json_data: Optional[Dict]) -> str:
+    def extract_genre(self, ctx: PageContext) -> str:
         """Извлекает жанр"""
-        name = self.extract_name(soup, json_data).lower()
-        description = self.extract_description(soup, json_data).lower()
+        name = self.extract_name(ctx).lower()
+        description = ctx.description.lower()
 
         text = name + " " + description
 
@@ -417,8 +601,10 @@ class PageParser:
 
         return "Спектакль"
 
-    def extract_duration(self, soup: BeautifulSoup, json_data: Optional[Dict]) -> Optional[int]:
+    def extract_duration(self, ctx: PageContext) -> Optional[int]:
         """Извлекает продолжительность"""
+        json_data = ctx.json_data
+
         if json_data and json_data.get('duration'):
             duration_iso = json_data['duration']
             match = re.match(r'PT(?:(\d+)H)?(?:(\d+)M)?', duration_iso)
@@ -429,22 +615,12 @@ class PageParser:
                 if total > 0:
                     return total
 
-        all_text = soup.get_text()
-        return self.cleaner.parse_duration(all_text)
+        return self.cleaner.parse_duration(ctx.text)
 
-    def extract_age_rating(self, soup: BeautifulSoup, json_data: Optional[Dict]) -> str:
+    def extract_age_rating(self, ctx: PageContext) -> str:
         """Извлекает возрастной рейтинг"""
-        text = soup.get_text()
-        return self.cleaner.parse_age_rating(text)
-
-    def extract_description(self, soup: BeautifulSoup, json_data: Optional[Dict]) -> str:
-        """Извлекает полное описание"""
-
-        # Просто ищем content-block и берем весь текст
-        content_block = soup.find('div', class_='content-block')
-        if content_block:
-            full_text = content_block.get_text()
-            full_text = re.sub(r'\s+', ' ', full_text).strip()
-            return full_text
+        return self.cleaner.parse_age_rating(ctx.text)
 
-        return ""
\ No newline at end of file
+    def extract_description(self, ctx: PageContext) -> str:
+        """Извлекает полное описание из content-block"""
+        return ctx.description
\ No newline at end of file
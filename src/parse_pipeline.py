@@ -0,0 +1,165 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, Optional, Tuple, Union
+import config
+from src.page_parser import PageParser
+
+# Парсер создается один раз в каждом процессе пула
+_worker_parser = None
+
+_DONE = object()
+
+
+def _init_worker():
+    """Инициализирует процесс-парсер"""
+    global _worker_parser
+    _worker_parser = PageParser()
+
+
+def _parse_in_worker(url: str, content: bytes, encoding: Optional[str],
+                     known_fingerprint: Optional[str] = None) -> Tuple[str, Optional[Dict]]:
+    """Разбирает страницу внутри процесса пула; возвращает (статус, спектакль)"""
+    try:
+        html = content.decode(encoding or 'utf-8', errors='replace')
+
+        # Страница не менялась с прошлого обхода - разбирать ее незачем
+        if known_fingerprint and PageParser.fingerprint(html) == known_fingerprint:
+            return 'unchanged', None
+
+        play_data = _worker_parser.parse_html(url, html)
+        return ('parsed', play_data) if play_data else ('failed', None)
+    except Exception as e:
+        print(f"Ошибка разбора {url}: {e}")
+        return 'failed', None
+
+
+async def _gather_or_cancel(*coros):
+    """Выполняет корутины вместе; если одна упала, отменяет остальные и дожидается их"""
+    tasks = [asyncio.create_task(coro) for coro in coros]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class ParsePipeline:
+    """Конвейер: асинхронная загрузка -> ограниченная очередь -> пул процессов разбора"""
+
+    def __init__(self, parser: Optional[PageParser] = None, workers: Optional[int] = None,
+                 queue_size: Optional[int] = None, concurrency: Optional[int] = None,
+                 known_fingerprints: Optional[Dict[str, str]] = None):
+        self.parser = parser or PageParser()
+        self.workers = workers or config.PIPELINE_CONFIG['workers']
+        self.queue_size = queue_size or config.PIPELINE_CONFIG['queue_size']
+        self.concurrency = concurrency or config.FETCH_CONFIG['concurrency']
+        # Отпечатки страниц с прошлого обхода: {url: fingerprint}
+        self.known_fingerprints = known_fingerprints or {}
+        self.stats = {'parsed': 0, 'unchanged': 0, 'failed': 0}
+
+    async def _feed(self, urls, url_queue: asyncio.Queue):
+        """Передает ссылки загрузчикам; поддерживает и потоковые источники"""
+        if hasattr(urls, '__aiter__'):
+            async for url in urls:
+                await url_queue.put(url)
+        else:
+            for url in urls:
+                await url_queue.put(url)
+
+        for _ in range(self.concurrency):
+            await url_queue.put(_DONE)
+
+    async def _fetch(self, url_queue: asyncio.Queue, pages: asyncio.Queue):
+        """Загружает страницы и кладет их в очередь на разбор"""
+        while True:
+            url = await url_queue.get()
+            if url is _DONE:
+                break
+
+            raw = await self.parser.fetch_raw_async(url)
+            if raw is not None:
+                # Если парсеры не успевают, загрузка ждет освобождения очереди
+                await pages.put((url, *raw))
+
+    async def _parse(self, executor, pages: asyncio.Queue, results: asyncio.Queue):
+        """Передает страницы из очереди в пул процессов"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            item = await pages.get()
+            if item is _DONE:
+                break
+
+            url = item[0]
+            status, play_data = await loop.run_in_executor(
+                executor, _parse_in_worker, *item, self.known_fingerprints.get(url)
+            )
+            self.stats[status] += 1
+            if play_data:
+                await results.put(play_data)
+
+    async def run(self, urls: Union[Iterable[str], AsyncIterable[str]]) -> AsyncIterator[Dict]:
+        """Загружает и разбирает ссылки, отдавая спектакли по мере готовности"""
+        url_queue = asyncio.Queue(maxsize=self.concurrency)
+
+        async def produce(pages):
+            await _gather_or_cancel(
+                self._feed(urls, url_queue),
+                *(self._fetch(url_queue, pages) for _ in range(self.concurrency))
+            )
+
+        async for play_data in self._run(produce):
+            yield play_data
+
+    async def run_pages(self, pages: Iterable[Tuple[str, bytes, Optional[str]]]) -> AsyncIterator[Dict]:
+        """Разбирает уже загруженные страницы (url, байты, кодировка) без сети"""
+
+        async def produce(queue):
+            for page in pages:
+                await queue.put(page)
+
+        async for play_data in self._run(produce):
+            yield play_data
+
+    async def _run(self, produce) -> AsyncIterator[Dict]:
+        """Запускает источник страниц и пул процессов разбора"""
+        pages = asyncio.Queue(maxsize=self.queue_size)
+        results = asyncio.Queue(maxsize=self.queue_size)
+
+        executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+
+        async def produce_all():
+            await produce(pages)
+            for _ in range(self.workers):
+                await pages.put(_DONE)
+
+        error = None
+
+        async def run_all():
+            nonlocal error
+            try:
+                await _gather_or_cancel(
+                    produce_all(),
+                    *(self._parse(executor, pages, results) for _ in range(self.workers))
+                )
+            except Exception as e:
+                # Например, BrokenProcessPool или ошибка источника ссылок
+                error = e
+            # Конец выдачи ставится и после ошибки, иначе потребитель ждал бы результатов вечно
+            await results.put(_DONE)
+
+        task = asyncio.create_task(run_all())
+
+        try:
+            while True:
+                play_data = await results.get()
+                if play_data is _DONE:
+                    break
+                yield play_data
+
+            if error is not None:
+                raise error
+        finally:
+            task.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,345 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+import config
+
+# Необязательная зависимость: без NumPy запросы выполняются в MongoDB
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+NOT_SPECIFIED = 'Не указан'
+FIELDS = ('theatre', 'genre', 'director')
+
+# Поля спектакля, из которых строится снимок
+SNAPSHOT_PROJECTION = {
+    'url': 1, 'name': 1, 'theatre': 1, 'genre': 1, 'director': 1,
+    'actors': 1, 'dates': 1, 'duration_minutes': 1, '_id': 0
+}
+
+_snapshot = None
+_snapshot_mtime = None
+_lock = threading.Lock()
+
+
+def snapshot_enabled() -> bool:
+    """Снимок включен в настройках и NumPy установлен"""
+    return np is not None and config.SNAPSHOT_CONFIG['enabled']
+
+
+def _number(value):
+    """Целые значения возвращаются как int, как их хранит MongoDB"""
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def _order(counts, limit: int = 0):
+    """Номера непустых групп по убыванию счетчика"""
+    groups = np.flatnonzero(counts)
+    order = groups[np.argsort(-counts[groups], kind='stable')]
+    return order[:limit] if limit else order
+
+
+def _distinct(groups, values, n_groups: int):
+    """Число различных значений в каждой группе (значения < 0 не учитываются)"""
+    mask = values >= 0
+    groups, values = groups[mask], values[mask]
+    width = int(values.max()) + 1 if len(values) else 1
+    pairs = np.unique(groups.astype(np.int64) * width + values)
+    return np.bincount(pairs // width, minlength=n_groups)
+
+
+class PlaySnapshot:
+    """Колоночный снимок коллекции спектаклей для аналитики в памяти.
+
+    Театры, жанры, режиссеры и актеры хранятся кодами в словарях, актеры и даты
+    показов - в CSR-виде: элементы спектакля i лежат в idx[ptr[i]:ptr[i + 1]].
+    """
+
+    def __init__(self, arrays: Dict):
+        self.arrays = arrays
+        self.names = arrays['names']
+        self.urls = arrays['urls']
+        self.vocab = {field: arrays[f"{field}_vocab"] for field in FIELDS + ('actor',)}
+        self.codes = {field: arrays[f"{field}_codes"] for field in FIELDS}
+        self.duration = arrays['duration']  # NaN, если продолжительность не указана
+        self.dates_count = arrays['dates_count']  # Число дат в документе, как $size
+        self.actor_ptr = arrays['actor_ptr']
+        self.actor_idx = arrays['actor_idx']
+        self.date_ptr = arrays['date_ptr']
+        self.date_values = arrays['date_values']  # datetime64[s], без повторов внутри спектакля
+        self.size = len(self.names)
+
+        # Номер спектакля для каждого элемента CSR-массивов
+        self.actor_play = np.repeat(np.arange(self.size), np.diff(self.actor_ptr))
+        self.date_play = np.repeat(np.arange(self.size), np.diff(self.date_ptr))
+        self._lookup = {field: {value: code for code, value in enumerate(self.vocab[field])}
+                        for field in FIELDS}
+
+    @classmethod
+    def from_plays(cls, plays: Iterable[Dict]) -> 'PlaySnapshot':
+        """Строит снимок по документам спектаклей"""
+        vocabs = {field: {} for field in FIELDS + ('actor',)}
+
+        def intern(field, value):
+            if not value:
+                return -1
+            return vocabs[field].setdefault(value, len(vocabs[field]))
+
+        columns = {name: [] for name in ('names', 'urls', 'duration', 'dates_count')}
+        codes = {field: [] for field in FIELDS}
+        actor_ptr, actor_idx = [0], []
+        date_ptr, date_values = [0], []
+
+        for play in plays:
+            columns['names'].append(play.get('name') or '')
+            columns['urls'].append(play.get('url') or '')
+            duration = play.get('duration_minutes')
+            columns['duration'].append(duration if isinstance(duration, (int, float)) else np.nan)
+            columns['dates_count'].append(len(play.get('dates') or []))
+            for field in FIELDS:
+                codes[field].append(intern(field, play.get(field)))
+
+            actor_idx.extend(code for code in (intern('actor', actor) for actor in play.get('actors') or [])
+                             if code >= 0)
+            actor_ptr.append(len(actor_idx))
+
+            # Даты разбираются так же, как при построении коллекции показов
+            dates = set()
+            for date_str in play.get('dates') or []:
+                try:
+                    dates.add(datetime.fromisoformat(date_str).replace(tzinfo=None))
+                except (TypeError, ValueError):
+                    continue
+            date_values.extend(sorted(dates))
+            date_ptr.append(len(date_values))
+
+        arrays = {
+            'names': np.array(columns['names'], dtype=str),
+            'urls': np.array(columns['urls'], dtype=str),
+            'duration': np.array(columns['duration'], dtype=np.float64),
+            'dates_count': np.array(columns['dates_count'], dtype=np.int32),
+            'actor_ptr': np.array(actor_ptr, dtype=np.int64),
+            'actor_idx': np.array(actor_idx, dtype=np.int32),
+            'date_ptr': np.array(date_ptr, dtype=np.int64),
+            'date_values': np.array(date_values, dtype='datetime64[s]'),
+        }
+        for field in FIELDS + ('actor',):
+            arrays[f"{field}_vocab"] = np.array(list(vocabs[field]), dtype=str)
+        for field in FIELDS:
+            arrays[f"{field}_codes"] = np.array(codes[field], dtype=np.int32)
+
+        return cls(arrays)
+
+    def save(self, path: Optional[str] = None):
+        """Записывает снимок на диск; читатели видят либо старый, либо новый файл"""
+        path = path or config.SNAPSHOT_CONFIG['path']
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            np.savez(f, **self.arrays)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> 'PlaySnapshot':
+        """Читает снимок с диска"""
+        with np.load(path or config.SNAPSHOT_CONFIG['path'], allow_pickle=False) as data:
+            return cls({name: data[name] for name in data.files})
+
+    def _code(self, field: str, value) -> int:
+        """Код значения в словаре поля или -1"""
+        return self._lookup[field].get(value, -1)
+
+    def _play(self, i: int) -> Dict:
+        """Документ спектакля по номеру"""
+        play = {'url': str(self.urls[i]), 'name': str(self.names[i])}
+        for field in FIELDS:
+            code = self.codes[field][i]
+            if code >= 0:
+                play[field] = str(self.vocab[field][code])
+        if not np.isnan(self.duration[i]):
+            play['duration_minutes'] = _number(self.duration[i])
+        play['actors'] = [str(self.vocab['actor'][code])
+                          for code in self.actor_idx[self.actor_ptr[i]:self.actor_ptr[i + 1]]]
+        play['dates'] = [date.isoformat()
+                         for date in self.date_values[self.date_ptr[i]:self.date_ptr[i + 1]].astype(datetime)]
+        return play
+
+    def read(self, name: str, limit: int = 0) -> List[Dict]:
+        """Строки агрегата в формате MaterializedViews.read"""
+        readers = {
+            'theatre_stats': self.theatre_stats,
+            'genre_stats': self.genre_stats,
+            'actor_stats': self.actor_stats,
+            'monthly_distribution': self.monthly_distribution,
+        }
+        return readers[name](limit)
+
+    def theatre_stats(self, limit: int = 0) -> List[Dict]:
+        """Спектакли, продолжительность и показы по театрам"""
+        codes = self.codes['theatre']
+        mask = (codes >= 0) & (codes != self._code('theatre', NOT_SPECIFIED)) & ~np.isnan(self.duration)
+        groups, duration = codes[mask], self.duration[mask]
+        n = len(self.vocab['theatre'])
+
+        counts = np.bincount(groups, minlength=n)
+        totals = np.bincount(groups, weights=duration, minlength=n)
+        shows = np.bincount(groups, weights=self.dates_count[mask], minlength=n)
+        minimum = np.full(n, np.inf)
+        np.minimum.at(minimum, groups, duration)
+        maximum = np.full(n, -np.inf)
+        np.maximum.at(maximum, groups, duration)
+
+        vocab = self.vocab['theatre']
+        return [{
+            '_id': str(vocab[g]),
+            'play_count': int(counts[g]),
+            'avg_duration': float(totals[g] / counts[g]),
+            'min_duration': _number(minimum[g]),
+            'max_duration': _number(maximum[g]),
+            'total_shows': int(shows[g])
+        } for g in _order(counts, limit)]
+
+    def genre_stats(self, limit: int = 0) -> List[Dict]:
+        """Спектакли, театры, показы и продолжительность по жанрам"""
+        codes = self.codes['genre']
+        mask = codes >= 0
+        n = len(self.vocab['genre'])
+
+        counts = np.bincount(codes[mask], minlength=n)
+        shows = np.bincount(codes[mask], weights=self.dates_count[mask], minlength=n)
+        theatres = _distinct(codes[mask], self.codes['theatre'][mask], n)
+        timed = mask & ~np.isnan(self.duration)
+        timed_counts = np.bincount(codes[timed], minlength=n)
+        totals = np.bincount(codes[timed], weights=self.duration[timed], minlength=n)
+
+        groups = np.flatnonzero(counts)
+        groups = groups[np.argsort(-shows[groups], kind='stable')]
+        vocab = self.vocab['genre']
+        return [{
+            '_id': str(vocab[g]),
+            'genre': str(vocab[g]),
+            'total_plays': int(counts[g]),
+            'theatre_count': int(theatres[g]),
+            'total_shows': int(shows[g]),
+            'avg_duration': float(totals[g] / timed_counts[g]) if timed_counts[g] else None,
+            'avg_shows_per_play': float(shows[g] / counts[g])
+        } for g in (groups[:limit] if limit else groups)]
+
+    def actor_stats(self, limit: int = 0) -> List[Dict]:
+        """Спектакли, показы, жанры и театры по актерам"""
+        actors, plays = self.actor_idx, self.actor_play
+        n = len(self.vocab['actor'])
+
+        counts = np.bincount(actors, minlength=n)
+        shows = np.bincount(actors, weights=self.dates_count[plays], minlength=n)
+        genres = _distinct(actors, self.codes['genre'][plays], n)
+        theatres = _distinct(actors, self.codes['theatre'][plays], n)
+
+        vocab = self.vocab['actor']
+        return [{
+            '_id': str(vocab[a]),
+            'actor': str(vocab[a]),
+            'play_count': int(counts[a]),
+            'total_shows': int(shows[a]),
+            'genre_count': int(genres[a]),
+            'theatre_count': int(theatres[a])
+        } for a in _order(counts, limit)]
+
+    def monthly_distribution(self, limit: int = 0) -> List[Dict]:
+        """Показы и спектакли по месяцам"""
+        months = self.date_values.astype('datetime64[M]').astype(np.int64)
+        periods, inverse = np.unique(months, return_inverse=True)
+        shows = np.bincount(inverse, minlength=len(periods))
+        plays = _distinct(inverse, self.date_play, len(periods))
+
+        results = []
+        for i, period in enumerate(periods[:limit] if limit else periods):
+            year, month = 1970 + int(period) // 12, int(period) % 12 + 1
+            results.append({
+                '_id': {'year': year, 'month': month},
+                'year': year,
+                'month': month,
+                'show_count': int(shows[i]),
+                'play_count': int(plays[i])
+            })
+        return results
+
+    def upcoming_shows(self, days: int = 7, limit: int = 20) -> List[Dict]:
+        """Показы на N дней вперед по датам, в формате upcoming_shows_pipeline"""
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        start = np.datetime64(today, 's')
+        end = np.datetime64(today + timedelta(days=days), 's')
+
+        mask = (self.date_values >= start) & (self.date_values < end)
+        dates, plays = self.date_values[mask], self.date_play[mask]
+        order = np.lexsort((plays, dates))
+        dates, plays = dates[order], plays[order]
+        moments, first = np.unique(dates, return_index=True)
+        bounds = np.append(first, len(dates))
+
+        results = []
+        for i, moment in enumerate(moments[:limit]):
+            day_plays = []
+            for p in plays[bounds[i]:bounds[i + 1]]:
+                play = {'name': str(self.names[p])}
+                for field in ('theatre', 'genre'):
+                    code = self.codes[field][p]
+                    if code >= 0:
+                        play[field] = str(self.vocab[field][code])
+                if not np.isnan(self.duration[p]):
+                    play['duration'] = _number(self.duration[p])
+                day_plays.append(play)
+            results.append({'_id': moment.astype(datetime), 'plays': day_plays})
+        return results
+
+    def group_counts(self, field: str, limit: int = 0) -> List[Dict]:
+        """Число спектаклей по значениям поля, без пустых и «Не указан»"""
+        codes = self.codes[field]
+        mask = (codes >= 0) & (codes != self._code(field, NOT_SPECIFIED))
+        counts = np.bincount(codes[mask], minlength=len(self.vocab[field]))
+        return [{'_id': str(self.vocab[field][g]), 'count': int(counts[g])} for g in _order(counts, limit)]
+
+    def find(self, field: str, value: str, limit: int = 0) -> List[Dict]:
+        """Спектакли с заданным значением поля"""
+        code = self._code(field, value)
+        rows = np.flatnonzero(self.codes[field] == code) if code >= 0 else np.array([], dtype=np.int64)
+        rows = rows[:limit] if limit else rows
+        return [self._play(i) for i in rows]
+
+    def first_date(self) -> Optional[datetime]:
+        """Самый ранний показ"""
+        if not len(self.date_values):
+            return None
+        return self.date_values.min().astype(datetime)
+
+    def plays_at(self, moment: datetime, limit: int = 0) -> List[Dict]:
+        """Спектакли с показом в указанное время"""
+        rows = np.unique(self.date_play[self.date_values == np.datetime64(moment, 's')])
+        rows = rows[:limit] if limit else rows
+        return [self._play(i) for i in rows]
+
+
+def get_snapshot() -> Optional[PlaySnapshot]:
+    """Текущий снимок; перечитывается с диска, когда загрузчик записал новый"""
+    global _snapshot, _snapshot_mtime
+    if not snapshot_enabled():
+        return None
+
+    try:
+        mtime = os.stat(config.SNAPSHOT_CONFIG['path']).st_mtime_ns
+    except OSError:
+        # Снимок еще не строился
+        return None
+
+    with _lock:
+        if _snapshot is None or mtime != _snapshot_mtime:
+            try:
+                _snapshot = PlaySnapshot.load()
+                _snapshot_mtime = mtime
+            except Exception as e:
+                print(f"Ошибка при чтении снимка спектаклей: {e}")
+                return None
+        return _snapshot
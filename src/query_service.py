@@ -0,0 +1,253 @@
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import config
+from src.cache_codec import CacheCodec, CodecError
+from src.cached_queries import (
+    format_theatre_stats, format_genre_stats, format_upcoming_shows,
+    format_date_distribution, upcoming_shows_pipeline
+)
+from src.materialized_views import VIEWS
+from src.play_snapshot import get_snapshot
+from src.name_index import get_name_index, words, tokenize
+from src.search_index import get_search_index
+from src.query_stream import list_query, list_pipeline, format_row, decode_cursor, split_page
+from src.redis_cache import make_key, make_tag_key, date_tags, PLAYS_TAG
+
+
+# Теги записей, которые могут изменить результат поиска по индексу имен (см. write_tags)
+INDEX_TAGS = {'director': 'directors', 'actors': 'actors'}
+
+
+class AsyncQueryService:
+    """Асинхронные запросы к базе с кешем в Redis.
+
+    Ключи, формат значений и теги совпадают с CachedQueries, поэтому кеш общий,
+    а инвалидация из MongoHandler действует и на сервис.
+    """
+
+    def __init__(self, db, redis_client=None):
+        self.db = db
+        self.plays = db[config.MONGO_CONFIG['collection']]
+        self.shows = db[config.MONGO_CONFIG['shows_collection']]
+        self.redis = redis_client
+        self.codec = CacheCodec()
+        self.sizes_key = f"{config.CACHE_CONFIG['prefix']}__sizes__"
+        self.instance_id = uuid.uuid4().hex
+        # Одинаковые запросы, пришедшие одновременно, выполняются один раз
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.counters = {'hits': 0, 'misses': 0, 'shared': 0, 'errors': 0}
+
+    async def _cached(self, query_name: str, params: Optional[Dict], ttl: int, tags: List[str], compute):
+        """Возвращает результат из кеша или вычисляет его"""
+        key = make_key(query_name, params)
+
+        data = await self._cache_get(key)
+        if data is not None:
+            self.counters['hits'] += 1
+            return data
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.counters['shared'] += 1
+            return await asyncio.shield(inflight)
+
+        self.counters['misses'] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await compute()
+            future.set_result(result)
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение получат ожидающие; отмечаем, что оно обработано
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+        await self._cache_set(key, result, ttl, tags)
+        return result
+
+    async def _cache_get(self, key: str):
+        """Читает свежее значение из Redis"""
+        if self.redis is None or not config.CACHE_CONFIG['enabled']:
+            return None
+        try:
+            data = await self.redis.get(key)
+            if not data:
+                return None
+            fresh_until, result = self.codec.decode(data)
+            return result if time.time() < fresh_until else None
+        except CodecError:
+            return None
+        except Exception as e:
+            self.counters['errors'] += 1
+            print(f"Ошибка при чтении из кеша: {e}")
+            return None
+
+    async def _cache_set(self, key: str, result, ttl: int, tags: List[str]):
+        """Сохраняет значение, его размер и теги одним конвейером"""
+        if self.redis is None or not config.CACHE_CONFIG['enabled'] or result is None:
+            return
+        try:
+            serialized = self.codec.encode([time.time() + ttl, result])
+            tag_ttl = max(config.CACHE_CONFIG['tag_ttl'], ttl)
+
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.set(key, serialized, ex=ttl)
+            pipe.hset(self.sizes_key, key, len(serialized))
+            for tag in {PLAYS_TAG, *tags}:
+                pipe.sadd(make_tag_key(tag), key)
+                pipe.expire(make_tag_key(tag), tag_ttl)
+            # Процессы с CachedQueries сбрасывают копию в памяти
+            pipe.publish(config.CACHE_CONFIG['invalidation_channel'], f"{self.instance_id} {key}")
+            await pipe.execute()
+        except Exception as e:
+            self.counters['errors'] += 1
+            print(f"Ошибка при сохранении в кеш: {e}")
+
+    async def _read_view(self, name: str, limit: int = 0) -> List[Dict]:
+        """Читает строки агрегата из снимка в памяти или из представления"""
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            return snapshot.read(name, limit)
+        cursor = self.db[name].find({}, {'_refreshed_at': 0}).sort(VIEWS[name]['sort']).limit(limit)
+        return await cursor.to_list(None)
+
+    async def _list_plays(self, list_name: str, query: Dict) -> List[Dict]:
+        """Строки списка спектаклей, формируемые по мере чтения курсора"""
+        cursor = await self.plays.aggregate(list_pipeline(list_name, query),
+                                            batchSize=config.MONGO_CONFIG['cursor_batch_size'])
+        return [format_row(list_name, doc) async for doc in cursor]
+
+    async def page_plays(self, list_name: str, value: str, limit: int, cursor: Optional[str] = None,
+                         prefix: bool = False) -> Dict:
+        """Страница списка спектаклей и курсор следующей; страницы не кешируются"""
+        after = decode_cursor(cursor) if cursor else None
+        pipeline = list_pipeline(list_name, list_query(list_name, value, prefix), after=after, limit=limit + 1)
+        docs = await (await self.plays.aggregate(pipeline, batchSize=limit + 1)).to_list(None)
+        docs, next_cursor = split_page(docs, limit)
+        return {'items': [format_row(list_name, doc) for doc in docs], 'next_cursor': next_cursor}
+
+    async def theatre_repertoire(self, theatre: str) -> List[Dict]:
+        """Весь репертуар театра"""
+
+        async def compute():
+            return await self._list_plays('theatre_repertoire', list_query('theatre_repertoire', theatre))
+
+        return await self._cached('theatre_repertoire', {'theatre': theatre}, 3600,
+                                  [f"theatre:{theatre}"], compute)
+
+    async def director_works(self, director: str) -> List[Dict]:
+        """Спектакли режиссера"""
+
+        async def compute():
+            return await self._list_plays('director_works', list_query('director_works', director))
+
+        params, tags = self._name_cache_params('director', director)
+        return await self._cached('director_works', params, 3600, tags, compute)
+
+    async def actor_plays(self, actor: str, prefix: bool = False) -> List[Dict]:
+        """Спектакли с участием актера"""
+
+        async def compute():
+            return await self._list_plays('actor_plays', list_query('actor_plays', actor, prefix))
+
+        params, tags = self._name_cache_params('actors', actor, prefix)
+        return await self._cached('actor_plays', params, 3600, tags, compute)
+
+    @staticmethod
+    def _name_cache_params(field: str, name: str, prefix: bool = False):
+        """Параметры ключа и теги запроса по имени.
+
+        Через индекс имен «Товстоногова» и «товстоногов» - один запрос, поэтому ключ строится
+        по нормализованному имени, а сбрасывается он записью любого спектакля с этим полем:
+        новое подходящее имя могло появиться в любом из них.
+        """
+        if get_name_index() is None:
+            tags = [f"director:{name}"] if field == 'director' else ['actors']
+            return {field: name, 'prefix': prefix}, tags
+
+        # Последнее слово при prefix ищется и как есть, поэтому его окончание не отбрасывается
+        normalized = words(name) if prefix else tokenize(name)
+        return {field: ' '.join(normalized), 'prefix': prefix}, [INDEX_TAGS[field]]
+
+    @staticmethod
+    def complete(field: str, query: str, limit: Optional[int] = None) -> Optional[List[Dict]]:
+        """Подсказки имен по началу ввода; None, если индекс имен еще не построен"""
+        index = get_name_index()
+        return index.complete(field, query, limit) if index is not None else None
+
+    @staticmethod
+    async def search(query: str, limit: Optional[int] = None) -> List[Dict]:
+        """Полнотекстовый поиск по названиям и описаниям"""
+        index = get_search_index()
+        if index is None:
+            return []
+        # Запрос к SQLite не держит цикл событий
+        return await asyncio.to_thread(index.search, query, limit)
+
+    async def plays_on_date(self, day: datetime) -> List[Dict]:
+        """Спектакли, которые идут в указанный день"""
+
+        async def compute():
+            cursor = self.shows.find(
+                {'date': {'$gte': day, '$lt': day + timedelta(days=1)}},
+                {'name': 1, 'theatre': 1, 'duration_minutes': 1, 'date': 1, '_id': 0}
+            ).sort('date', 1)
+            return [{
+                'name': show.get('name'),
+                'theatre': show.get('theatre'),
+                'duration_minutes': show.get('duration_minutes'),
+                'time': show['date'].strftime('%H:%M')
+            } async for show in cursor]
+
+        date_str = day.date().isoformat()
+        return await self._cached('plays_on_date', {'date': date_str}, 3600, [f"date:{date_str}"], compute)
+
+    async def theatre_stats(self) -> List[Dict]:
+        """Статистика по театрам"""
+
+        async def compute():
+            return format_theatre_stats(await self._read_view('theatre_stats', limit=15))
+
+        return await self._cached('theatre_stats', None, 6 * 3600, ['theatres'], compute)
+
+    async def genre_stats(self) -> List[Dict]:
+        """Статистика по жанрам"""
+
+        async def compute():
+            return format_genre_stats(await self._read_view('genre_stats'))
+
+        return await self._cached('genre_stats', None, 6 * 3600, ['genres'], compute)
+
+    async def upcoming_shows(self, days: int = 7) -> List[Dict]:
+        """Показы на N дней вперед"""
+
+        async def compute():
+            snapshot = get_snapshot()
+            if snapshot is not None:
+                return format_upcoming_shows(snapshot.upcoming_shows(days))
+            cursor = await self.shows.aggregate(upcoming_shows_pipeline(days))
+            return format_upcoming_shows(await cursor.to_list(None))
+
+        return await self._cached('upcoming_shows', {'days': days}, 300, date_tags(days), compute)
+
+    async def top_actors(self, limit: int = 10) -> List[Dict]:
+        """Самые занятые актеры"""
+
+        async def compute():
+            return await self._read_view('actor_stats', limit=limit)
+
+        return await self._cached('top_actors', {'limit': limit}, 6 * 3600, ['actors'], compute)
+
+    async def date_distribution(self) -> List[Dict]:
+        """Распределение показов по месяцам"""
+
+        async def compute():
+            return format_date_distribution(await self._read_view('monthly_distribution'))
+
+        return await self._cached('date_distribution', None, 6 * 3600, ['dates'], compute)
@@ -0,0 +1,142 @@
+import base64
+import binascii
+from typing import Dict, Iterator, List, Optional, Tuple
+from bson import json_util
+import config
+from src.name_index import get_name_index
+
+# Порядок для постраничной выдачи: _id есть у каждого документа, уникален и проиндексирован
+ID_ORDER = [('_id', 1)]
+
+DATES_COUNT = {'$size': {'$ifNull': ['$dates', []]}}
+
+# Списки спектаклей: поле условия, проекция на стороне сервера и поля строки результата.
+# Даты считаются в MongoDB, клиент не получает массивы целиком
+PLAY_LISTS = {
+    'theatre_repertoire': {
+        'field': 'theatre',
+        'name_index': False,
+        'projection': {
+            'name': 1,
+            'director': {'$ifNull': ['$director', 'Не указан']},
+            'genre': 1,
+            'duration_minutes': 1,
+            'dates_count': DATES_COUNT
+        },
+        'fields': ('name', 'director', 'genre', 'duration_minutes', 'dates_count'),
+    },
+    'director_works': {
+        'field': 'director',
+        'name_index': True,  # Имя ищется без учета регистра и падежа
+        'projection': {
+            'name': 1,
+            'theatre': 1,
+            'dates_count': DATES_COUNT,
+            'dates': {'$slice': [{'$ifNull': ['$dates', []]}, 3]}
+        },
+        'fields': ('name', 'theatre', 'dates_count', 'dates'),
+    },
+    'actor_plays': {
+        'field': 'actors',
+        'name_index': True,
+        'projection': {
+            'name': 1,
+            'theatre': 1,
+            'actors': {'$ifNull': ['$actors', []]},
+            'dates_count': DATES_COUNT
+        },
+        'fields': ('name', 'theatre', 'actors', 'dates_count'),
+    },
+    'plays_on_date': {
+        'field': 'dates',
+        'name_index': False,
+        'projection': {'name': 1, 'theatre': 1, 'duration_minutes': 1},
+        'fields': ('name', 'theatre', 'duration_minutes'),
+    },
+}
+
+
+def list_query(list_name: str, value, prefix: bool = False) -> Dict:
+    """Условие списка; имена ищутся через индекс имен, если он построен"""
+    spec = PLAY_LISTS[list_name]
+    index = get_name_index() if spec['name_index'] else None
+    if index is not None:
+        return {'_id': {'$in': index.lookup(spec['field'], value, prefix)}}
+    return {spec['field']: value}
+
+
+def encode_cursor(values: List) -> str:
+    """Курсор страницы: значения ключей сортировки последнего документа"""
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token: str, sort=ID_ORDER) -> List:
+    """Разбирает курсор страницы; ValueError, если он поврежден"""
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(token.encode('ascii')),
+                                 json_options=json_util.JSONOptions(tz_aware=False))
+    except (ValueError, TypeError, UnicodeError, binascii.Error):
+        raise ValueError("Некорректный курсор страницы")
+
+    if not isinstance(values, list) or len(values) != len(sort):
+        raise ValueError("Некорректный курсор страницы")
+    return values
+
+
+def keyset_filter(sort, values: List) -> Dict:
+    """Условие «после документа с такими ключами» для порядка sort"""
+    clauses = []
+    for i, (key, direction) in enumerate(sort):
+        clause = {prev_key: value for (prev_key, _), value in zip(sort[:i], values[:i])}
+        clause[key] = {'$gt' if direction == 1 else '$lt': values[i]}
+        clauses.append(clause)
+    return clauses[0] if len(clauses) == 1 else {'$or': clauses}
+
+
+def list_pipeline(list_name: str, query: Dict, sort=ID_ORDER, after: Optional[List] = None,
+                  limit: int = 0) -> List[Dict]:
+    """Конвейер списка спектаклей: условие, порядок, предел и проекция на сервере"""
+    if after is not None:
+        query = {'$and': [query, keyset_filter(sort, after)]}
+
+    pipeline = [{'$match': query}, {'$sort': dict(sort)}]
+    if limit:
+        pipeline.append({'$limit': limit})
+    # Ключи сортировки нужны для курсора следующей страницы
+    pipeline.append({'$project': {**PLAY_LISTS[list_name]['projection'], **{key: 1 for key, _ in sort}}})
+    return pipeline
+
+
+def format_row(list_name: str, doc: Dict) -> Dict:
+    """Строка результата без служебных полей"""
+    return {field: doc.get(field) for field in PLAY_LISTS[list_name]['fields']}
+
+
+def split_page(docs: List[Dict], limit: int, sort=ID_ORDER) -> Tuple[List[Dict], Optional[str]]:
+    """Отделяет страницу от лишнего документа и строит курсор следующей"""
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    return docs, encode_cursor([docs[-1][key] for key, _ in sort])
+
+
+def stream_plays(collection, list_name: str, query: Dict, batch_size: Optional[int] = None,
+                 sort=ID_ORDER) -> Iterator[Dict]:
+    """Строки списка по одной; в памяти не больше одной пачки курсора"""
+    cursor = collection.aggregate(list_pipeline(list_name, query, sort),
+                                  batchSize=batch_size or config.MONGO_CONFIG['cursor_batch_size'])
+    try:
+        for doc in cursor:
+            yield format_row(list_name, doc)
+    finally:
+        cursor.close()
+
+
+def page_plays(collection, list_name: str, query: Dict, limit: int, cursor: Optional[str] = None,
+               sort=ID_ORDER) -> Dict:
+    """Страница списка и курсор следующей (None на последней странице)"""
+    after = decode_cursor(cursor, sort) if cursor else None
+    docs = list(collection.aggregate(list_pipeline(list_name, query, sort, after, limit + 1),
+                                     batchSize=limit + 1))
+    docs, next_cursor = split_page(docs, limit, sort)
+    return {'items': [format_row(list_name, doc) for doc in docs], 'next_cursor': next_cursor}
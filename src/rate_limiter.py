@@ -0,0 +1,189 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlparse
+import config
+
+# Статусы, при которых сайт просит снизить частоту запросов
+THROTTLE_STATUSES = (429, 503)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Переводит заголовок Retry-After (секунды или HTTP-дата) в секунды ожидания"""
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def throttle_reason(response) -> Optional[str]:
+    """Возвращает причину замедления, если ответ говорит о перегрузке или капче"""
+    if response.status_code in THROTTLE_STATUSES:
+        return f"HTTP {response.status_code}"
+
+    text = response.text.lower()
+    if any(marker in text for marker in config.FETCH_CONFIG['captcha_markers']):
+        return "капча"
+
+    return None
+
+
+class _HostState:
+    """Текущий лимит и счетчики одного хоста"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.next_slot = 0.0
+        self.paused_until = 0.0
+        self.success_streak = 0
+        self.requests = 0
+        self.backoffs = 0
+        self.last_backoff = None
+
+
+class AdaptiveRateLimiter:
+    """Адаптивный лимитер запросов по хостам (AIMD).
+
+    Пока ответы успешные, частота растет на rate_increase после каждых
+    increase_every ответов. На 429/503 или капчу она умножается на
+    backoff_factor, а хост ставится на паузу по Retry-After.
+    """
+
+    def __init__(self, requests_per_second: Optional[float] = None):
+        settings = config.FETCH_CONFIG
+        self.initial_rate = requests_per_second or settings['requests_per_second']
+        self.min_rate = settings['min_requests_per_second']
+        self.max_rate = settings['max_requests_per_second']
+        self.rate_increase = settings['rate_increase']
+        self.increase_every = settings['increase_every']
+        self.backoff_factor = settings['backoff_factor']
+        self.backoff_pause = settings['backoff_pause']
+        self._hosts: Dict[str, _HostState] = {}
+        self._lock = threading.Lock()
+
+    def _state(self, url: str) -> _HostState:
+        host = urlparse(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = _HostState(self.initial_rate)
+        return self._hosts[host]
+
+    def reserve(self, url: str) -> float:
+        """Резервирует слот для запроса и возвращает задержку до него"""
+        with self._lock:
+            state = self._state(url)
+            now = time.monotonic()
+            slot = max(now, state.next_slot, state.paused_until)
+            state.next_slot = slot + 1.0 / state.rate
+            state.requests += 1
+
+        return slot - now
+
+    def wait(self, url: str):
+        """Блокирующее ожидание своего слота"""
+        delay = self.reserve(url)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self, url: str):
+        """Ожидание своего слота без блокировки event loop"""
+        delay = self.reserve(url)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def on_success(self, url: str):
+        """Учитывает успешный ответ: после серии успехов лимит растет"""
+        with self._lock:
+            state = self._state(url)
+            state.success_streak += 1
+            if state.success_streak >= self.increase_every:
+                state.success_streak = 0
+                state.rate = min(self.max_rate, state.rate + self.rate_increase)
+
+    def on_throttle(self, url: str, reason: str, retry_after: Optional[float] = None):
+        """Учитывает отказ сайта: снижает лимит и ставит хост на паузу"""
+        pause = retry_after if retry_after is not None else self.backoff_pause
+
+        with self._lock:
+            state = self._state(url)
+            state.rate = max(self.min_rate, state.rate * self.backoff_factor)
+            state.success_streak = 0
+            state.paused_until = max(state.paused_until, time.monotonic() + pause)
+            state.backoffs += 1
+            state.last_backoff = {
+                'reason': reason,
+                'pause': pause,
+                'at': datetime.now().isoformat(),
+            }
+            rate = state.rate
+
+        print(f"⚠️ {reason} на {urlparse(url).netloc}: пауза {pause:.0f} сек, "
+              f"лимит снижен до {rate:.2f} запр/сек")
+
+    def observe(self, url: str, response) -> bool:
+        """Передает лимитеру результат запроса; возвращает True, если нужно повторить"""
+        reason = throttle_reason(response)
+        if reason is None:
+            self.on_success(url)
+            return False
+
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        self.on_throttle(url, reason, retry_after)
+        return True
+
+    def send_with_backoff(self, url: str, send):
+        """Выполняет send(), повторяя запрос после замедления; None - если сайт так и не ответил"""
+        retries = config.FETCH_CONFIG['max_retries']
+
+        for attempt in range(retries + 1):
+            if attempt:
+                self.wait(url)
+
+            response = send()
+            if not self.observe(url, response):
+                return response
+
+        print(f"Сайт ограничивает запросы, пропускаем {url}")
+        return None
+
+    def get_metrics(self) -> Dict[str, Dict]:
+        """Текущий лимит и события замедления по хостам"""
+        now = time.monotonic()
+
+        with self._lock:
+            return {
+                host: {
+                    'rate': round(state.rate, 3),
+                    'requests': state.requests,
+                    'backoffs': state.backoffs,
+                    'paused_for': round(max(0.0, state.paused_until - now), 1),
+                    'last_backoff': state.last_backoff,
+                }
+                for host, state in self._hosts.items()
+            }
+
+
+_shared_limiter = None
+_shared_lock = threading.Lock()
+
+
+def get_rate_limiter() -> AdaptiveRateLimiter:
+    """Общий для процесса лимитер, который делят URLCollector и PageParser"""
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = AdaptiveRateLimiter()
+        return _shared_limiter
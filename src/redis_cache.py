@@ -1,11 +1,97 @@
 import json
 import time
 import hashlib
-import pickle
 from datetime import datetime, timedelta
 import redis
+import inspect
+import threading
+import uuid
+from collections import OrderedDict
 import config
 from functools import wraps
+from src.connections import get_redis_client, redis_available
+from src.cache_codec import CacheCodec, CodecError
+
+
+def make_key(query_name, params=None, prefix=None, schema_version=None):
+    """Ключ кеша запроса; одинаков для синхронного кеша и асинхронного сервиса"""
+    prefix = prefix or config.CACHE_CONFIG['prefix']
+    schema_version = schema_version or config.CACHE_CONFIG['schema_version']
+    if params:
+        # Создаем строку из параметров
+        param_str = json.dumps(params, sort_keys=True, ensure_ascii=False)
+        # Хешируем чтобы ключ не был слишком длинным
+        param_hash = hashlib.md5(param_str.encode()).hexdigest()[:16]
+        return f"{prefix}{query_name}:v{schema_version}:{param_hash}"
+    return f"{prefix}{query_name}:v{schema_version}"
+
+
+def make_tag_key(tag, prefix=None):
+    """Ключ множества кешированных значений, зависящих от тега"""
+    return f"{prefix or config.CACHE_CONFIG['prefix']}tag:{tag}"
+
+
+class LocalCache:
+    """Кеш первого уровня: LRU в памяти процесса с TTL и пределом объема в байтах.
+
+    Хранит готовые объекты, поэтому возвращаемые значения нельзя изменять.
+    """
+
+    def __init__(self, max_bytes: int, ttl: int):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        # ключ -> (значение, размер, момент устаревания)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Возвращает значение или None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            if entry[2] <= time.monotonic():
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, size: int, ttl=None):
+        """Сохраняет значение, вытесняя давно не использованные"""
+        if size > self.max_bytes:
+            return
+
+        expires_at = time.monotonic() + min(ttl or self.ttl, self.ttl)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        """Удаляет значение"""
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        """Очищает кеш"""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
 
 class RedisCache:
     def __init__(self):
@@ -13,68 +99,150 @@ class RedisCache:
         self.prefix = config.CACHE_CONFIG['prefix']
         self.ttl = config.CACHE_CONFIG['ttl']
         self.enabled = config.CACHE_CONFIG['enabled']
+        self.schema_version = config.CACHE_CONFIG['schema_version']
+        self.codec = CacheCodec(schema_version=self.schema_version)
+        # Размер закодированного значения по ключам: {ключ: байт}
+        self.sizes_key = f"{self.prefix}__sizes__"
+        # Счетчики обращений с момента создания
+        self.counters = {'hits': 0, 'local_hits': 0, 'stale_hits': 0, 'misses': 0,
+                         'sets': 0, 'errors': 0, 'lock_waits': 0, 'invalidated': 0}
+
+        self.local = None
+        if config.CACHE_CONFIG['local_enabled']:
+            self.local = LocalCache(config.CACHE_CONFIG['local_max_bytes'], config.CACHE_CONFIG['local_ttl'])
+        # Отличает собственные сообщения об инвалидации от сообщений других процессов
+        self.instance_id = uuid.uuid4().hex
+        self.channel = config.CACHE_CONFIG['invalidation_channel']
+        self._listener = None
+        # Время неудачного подключения: кеш отключен, пока повторная попытка не удастся
+        self.connect_failed_at = None
+
         self._connect()
 
     def _connect(self):
         """Подключается к Redis"""
         try:
-            self.client = redis.Redis(
-                host=config.REDIS_CONFIG['host'],
-                port=config.REDIS_CONFIG['port'],
-                db=config.REDIS_CONFIG['db'],
-                password=config.REDIS_CONFIG.get('password'),
-                socket_timeout=config.REDIS_CONFIG['socket_timeout'],
-                socket_connect_timeout=config.REDIS_CONFIG['socket_connect_timeout'],
-                retry_on_timeout=config.REDIS_CONFIG['retry_on_timeout'],
-                decode_responses=False
-            )
+            # Клиент работает поверх общего пула соединений процесса
+            self.client = get_redis_client()
 
             # Проверяем подключение
-            self.client.ping()
+            if not redis_available():
+                raise ConnectionError("Redis не отвечает на PING")
             print(f"Успешное подключение к Redis")
+
+            if self.local is not None and self._listener is None:
+                self._subscribe_invalidation()
+            self.connect_failed_at = None
             return True
 
         except Exception as e:
             print(f"Ошибка подключения к Redis: {e}")
             print("Продолжаем без кеширования")
             self.enabled = False
+            self.connect_failed_at = time.monotonic()
             return False
 
+    def reconnect_if_due(self):
+        """Повторяет неудачное подключение не чаще раза в reconnect_interval секунд"""
+        if self.connect_failed_at is None or not config.CACHE_CONFIG['enabled']:
+            return
+        if time.monotonic() - self.connect_failed_at < config.CACHE_CONFIG['reconnect_interval']:
+            return
+
+        if self._connect():
+            self.enabled = True
+
+    def _subscribe_invalidation(self):
+        """Слушает инвалидации L1 от других процессов в фоновом потоке"""
+        try:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.channel: self._on_invalidate})
+            self._listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+        except Exception as e:
+            # Без подписки L1 устаревает не дольше local_ttl
+            print(f"Не удалось подписаться на инвалидацию кеша: {e}")
+
+    def _on_invalidate(self, message):
+        """Удаляет из L1 ключ, измененный другим процессом"""
+        sender, key = message['data'].decode('utf-8').split(' ', 1)
+        if sender == self.instance_id:
+            return
+
+        if key == '*':
+            self.local.clear()
+        else:
+            self.local.delete(key)
+
+    def _publish_invalidation(self, key):
+        """Сообщает другим процессам, что ключ изменился"""
+        if self.local is None:
+            return
+        try:
+            self.client.publish(self.channel, f"{self.instance_id} {key}")
+        except Exception as e:
+            print(f"Ошибка при рассылке инвалидации: {e}")
+
     def _generate_key(self, query_name, params=None):
         """Генерирует ключ для кеша"""
-        if params:
-            # Создаем строку из параметров
-            param_str = json.dumps(params, sort_keys=True)
-            # Хешируем чтобы ключ не был слишком длинным
-            param_hash = hashlib.md5(param_str.encode()).hexdigest()[:8]
-            key = f"{self.prefix}{query_name}:{param_hash}"
-        else:
-            key = f"{self.prefix}{query_name}"
-        return key
+        return make_key(query_name, params, self.prefix, self.schema_version)
 
     def get(self, query_name, params=None):
         """Получает данные из кеша"""
+        entry = self.get_entry(query_name, params)
+        if entry is None or not entry[1]:
+            return None
+        return entry[0]
+
+    def get_entry(self, query_name, params=None):
+        """Возвращает (данные, свежие ли) или None; устаревшие данные живут stale_ttl после TTL"""
         if not self.enabled or not self.client:
             return None
 
         try:
             key = self._generate_key(query_name, params)
-            data = self.client.get(key)
 
-            if data:
-                # Десериализуем данные
-                result = pickle.loads(data)
-                print(f"[CACHE HIT] Получены данные из кеша: {query_name}")
-                return result
-            else:
+            envelope = self.local.get(key) if self.local is not None else None
+            from_local = envelope is not None
+
+            if envelope is None:
+                data = self.client.get(key)
+                if data:
+                    # Десериализуем данные
+                    try:
+                        envelope = self.codec.decode(data)
+                    except CodecError as e:
+                        # Значение старого формата считается отсутствующим
+                        print(f"Не удалось прочитать {query_name} из кеша: {e}")
+                        data = None
+                if data:
+                    if self.local is not None:
+                        self.local.set(key, envelope, len(data))
+
+            if envelope is None:
+                self.counters['misses'] += 1
                 print(f"[CACHE MISS] Данных нет в кеше: {query_name}")
                 return None
 
+            fresh_until, result = envelope
+            if time.time() >= fresh_until:
+                self.counters['stale_hits'] += 1
+                print(f"[CACHE STALE] Устаревшие данные в кеше: {query_name}")
+                return result, False
+
+            # local_hits - часть hits, обслуженная без обращения к Redis
+            self.counters['hits'] += 1
+            if from_local:
+                self.counters['local_hits'] += 1
+            else:
+                print(f"[CACHE HIT] Получены данные из кеша: {query_name}")
+            return result, True
+
         except Exception as e:
+            self.counters['errors'] += 1
             print(f"Ошибка при чтении из кеша: {e}")
             return None
 
-    def set(self, query_name, data, params=None, ttl=None):
+    def set(self, query_name, data, params=None, ttl=None, stale_ttl=0, tags=None):
         """Сохраняет данные в кеш"""
         if not self.enabled or not self.client:
             return False
@@ -82,24 +250,81 @@ class RedisCache:
         try:
             key = self._generate_key(query_name, params)
 
-            serialized_data = pickle.dumps(data)
-
             # Устанавливаем TTL
             expire_time = ttl if ttl is not None else self.ttl
 
-            result = self.client.setex(key, expire_time, serialized_data)
+            # Момент устаревания хранится рядом с данными: ключ живет дольше на stale_ttl
+            envelope = [time.time() + expire_time, data]
+            serialized_data = self.codec.encode(envelope)
+
+            pipe = self.client.pipeline(transaction=False)
+            pipe.set(key, serialized_data, ex=expire_time + stale_ttl)
+            pipe.hset(self.sizes_key, key, len(serialized_data))
+            if tags:
+                # Полный пересчет после загрузки затрагивает любой запрос с тегами
+                tag_ttl = max(config.CACHE_CONFIG['tag_ttl'], expire_time + stale_ttl)
+                for tag in {PLAYS_TAG, *tags}:
+                    pipe.sadd(self._tag_key(tag), key)
+                    # Теги дней, которые уже прошли, не должны копиться
+                    pipe.expire(self._tag_key(tag), tag_ttl)
+            result = pipe.execute()[0]
 
             if result:
-                print(f"[CACHE SET] Данные сохранены в кеш: {query_name} (TTL: {expire_time} сек)")
+                if self.local is not None:
+                    self.local.set(key, envelope, len(serialized_data), expire_time + stale_ttl)
+                self._publish_invalidation(key)
+                self.counters['sets'] += 1
+                print(f"[CACHE SET] Данные сохранены в кеш: {query_name} "
+                      f"(TTL: {expire_time} сек, {len(serialized_data)} байт)")
                 return True
             else:
                 print(f"Ошибка сохранения в кеш: {query_name}")
                 return False
 
         except Exception as e:
+            self.counters['errors'] += 1
             print(f"Ошибка при сохранении в кеш: {e}")
             return False
 
+    def acquire_lock(self, query_name, params=None):
+        """Захватывает право на пересчет запроса; возвращает токен или None"""
+        if not self.enabled or not self.client:
+            return None
+
+        token = uuid.uuid4().hex
+        lock_key = f"{self._generate_key(query_name, params)}:lock"
+        try:
+            if self.client.set(lock_key, token, nx=True, ex=config.CACHE_CONFIG['lock_timeout']):
+                return token
+        except Exception as e:
+            print(f"Ошибка при захвате блокировки: {e}")
+        return None
+
+    def lock_held(self, query_name, params=None) -> bool:
+        """Идет ли сейчас пересчет запроса"""
+        try:
+            return bool(self.client.exists(f"{self._generate_key(query_name, params)}:lock"))
+        except Exception:
+            return False
+
+    def release_lock(self, query_name, token, params=None):
+        """Снимает блокировку, если она все еще принадлежит нам"""
+        lock_key = f"{self._generate_key(query_name, params)}:lock"
+        try:
+            with self.client.pipeline() as pipe:
+                # Блокировка могла истечь и достаться другому процессу
+                pipe.watch(lock_key)
+                if pipe.get(lock_key) == token.encode():
+                    pipe.multi()
+                    pipe.delete(lock_key)
+                    pipe.execute()
+                else:
+                    pipe.unwatch()
+        except redis.WatchError:
+            pass
+        except Exception as e:
+            print(f"Ошибка при снятии блокировки: {e}")
+
     def delete(self, query_name, params=None):
         """Удаляет данные из кеша"""
         if not self.enabled or not self.client:
@@ -107,7 +332,11 @@ class RedisCache:
 
         try:
             key = self._generate_key(query_name, params)
+            if self.local is not None:
+                self.local.delete(key)
             result = self.client.delete(key)
+            self.client.hdel(self.sizes_key, key)
+            self._publish_invalidation(key)
 
             if result > 0:
                 print(f"[CACHE DEL] Данные удалены из кеша: {query_name}")
@@ -120,22 +349,102 @@ class RedisCache:
             print(f"Ошибка при удалении из кеша: {e}")
             return False
 
+    def _tag_key(self, tag):
+        """Ключ множества кешированных значений, зависящих от тега"""
+        return make_tag_key(tag, self.prefix)
+
+    def invalidate_tags(self, tags) -> int:
+        """Удаляет значения, зависящие от любого из тегов; возвращает число удаленных"""
+        if not self.enabled or not self.client or not tags:
+            return 0
+
+        try:
+            tag_keys = [self._tag_key(tag) for tag in set(tags)]
+            keys = set()
+            pipe = self.client.pipeline(transaction=False)
+            for tag_key in tag_keys:
+                pipe.smembers(tag_key)
+            for members in pipe.execute():
+                keys.update(members)
+
+            pipe = self.client.pipeline(transaction=False)
+            if keys:
+                pipe.unlink(*keys)
+                pipe.hdel(self.sizes_key, *keys)
+            pipe.unlink(*tag_keys)
+            pipe.execute()
+
+            for key in keys:
+                key = key.decode('utf-8')
+                if self.local is not None:
+                    self.local.delete(key)
+                self._publish_invalidation(key)
+
+            self.counters['invalidated'] += len(keys)
+            if keys:
+                print(f"[CACHE INVALIDATE] Удалено {len(keys)} значений по тегам: {', '.join(sorted(set(tags))[:5])}")
+            return len(keys)
+
+        except Exception as e:
+            print(f"Ошибка при инвалидации кеша: {e}")
+            return 0
+
+    def _scan_batches(self, pattern=None):
+        """Перебирает ключи кеша пачками через SCAN, не блокируя Redis"""
+        count = config.CACHE_CONFIG['scan_count']
+        batch = []
+        for key in self.client.scan_iter(match=pattern or f"{self.prefix}*", count=count):
+            batch.append(key)
+            if len(batch) >= count:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _key_type(self, key: str) -> str:
+        """Тип ключа для статистики: имя запроса, tag, lock или служебный"""
+        name = key[len(self.prefix):] if key.startswith(self.prefix) else key
+        if key == self.sizes_key:
+            return 'service'
+        if name.startswith('tag:'):
+            return 'tag'
+        if name.endswith(':lock'):
+            return 'lock'
+        return name.split(':')[0]
+
+    @staticmethod
+    def _ttl_bucket(ttl: int) -> str:
+        """Интервал оставшегося времени жизни ключа"""
+        if ttl < 0:
+            return 'без TTL'
+        for limit, label in ((60, '< 1 мин'), (600, '< 10 мин'), (3600, '< 1 ч'), (6 * 3600, '< 6 ч'), (86400, '< 1 дня')):
+            if ttl < limit:
+                return label
+        return '>= 1 дня'
+
     def clear_all(self):
         """Очищает весь кеш"""
         if not self.enabled or not self.client:
             return False
 
         try:
-            pattern = f"{self.prefix}*"
-            keys = self.client.keys(pattern)
-
-            if keys:
-                self.client.delete(*keys)
-                print(f"[CACHE CLEAR] Очищено {len(keys)} ключей")
-                return True
+            if self.local is not None:
+                self.local.clear()
+            self._publish_invalidation('*')
+
+            removed = 0
+            for batch in self._scan_batches():
+                # UNLINK освобождает память в фоне, не задерживая другие команды
+                pipe = self.client.pipeline(transaction=False)
+                pipe.unlink(*batch)
+                pipe.execute()
+                removed += len(batch)
+
+            if removed:
+                print(f"[CACHE CLEAR] Очищено {removed} ключей")
             else:
                 print("Кеш уже пуст")
-                return True
+            return True
 
         except Exception as e:
             print(f"Ошибка при очистке кеша: {e}")
@@ -147,21 +456,59 @@ class RedisCache:
             return {}
 
         try:
-            pattern = f"{self.prefix}*"
-            keys = self.client.keys(pattern)
-
+            lookups = self.counters['hits'] + self.counters['misses']
             stats = {
-                'total_keys': len(keys),
+                'total_keys': 0,
                 'memory_usage': 0,
-                'keys_by_type': {}
+                'keys_by_type': {},
+                'bytes_by_type': {},
+                'ttl_distribution': {},
+                **self.counters,
+                'local_keys': len(self.local) if self.local is not None else 0,
+                'local_bytes': self.local.size if self.local is not None else 0,
+                'hit_rate': round(self.counters['hits'] / lookups, 3) if lookups else 0.0
             }
 
-            for key in keys[:100]:
-                key_str = key.decode('utf-8')
-                parts = key_str.replace(self.prefix, '').split(':')
-                if parts:
-                    query_type = parts[0]
-                    stats['keys_by_type'][query_type] = stats['keys_by_type'].get(query_type, 0) + 1
+            # Размеры закодированных значений, записанные при сохранении
+            sizes = {field.decode('utf-8'): int(size)
+                     for field, size in self.client.hscan_iter(self.sizes_key, count=config.CACHE_CONFIG['scan_count'])}
+            live_keys = set()
+
+            for batch in self._scan_batches():
+                pipe = self.client.pipeline(transaction=False)
+                for key in batch:
+                    pipe.memory_usage(key)
+                    pipe.ttl(key)
+                # MEMORY может быть запрещен (управляемый Redis) - тогда берем размер значения
+                results = pipe.execute(raise_on_error=False)
+
+                for i, key in enumerate(batch):
+                    key_str = key.decode('utf-8')
+                    memory, ttl = results[2 * i], results[2 * i + 1]
+                    if isinstance(memory, Exception) or memory is None:
+                        memory = sizes.get(key_str, 0)
+                    if isinstance(ttl, Exception) or ttl == -2:
+                        # Ключ истек между SCAN и проверкой
+                        continue
+
+                    live_keys.add(key_str)
+                    key_type = self._key_type(key_str)
+                    stats['total_keys'] += 1
+                    stats['memory_usage'] += memory
+                    stats['keys_by_type'][key_type] = stats['keys_by_type'].get(key_type, 0) + 1
+                    stats['bytes_by_type'][key_type] = stats['bytes_by_type'].get(key_type, 0) + memory
+                    bucket = self._ttl_bucket(ttl)
+                    stats['ttl_distribution'][bucket] = stats['ttl_distribution'].get(bucket, 0) + 1
+
+            # Размеры значений, которые уже истекли, больше не нужны
+            expired = [field for field in sizes if field not in live_keys]
+            count = config.CACHE_CONFIG['scan_count']
+            for start in range(0, len(expired), count):
+                self.client.hdel(self.sizes_key, *expired[start:start + count])
+
+            live_sizes = {key: size for key, size in sizes.items() if key in live_keys}
+            stats['encoded_bytes'] = sum(live_sizes.values())
+            stats['largest_keys'] = sorted(live_sizes.items(), key=lambda item: item[1], reverse=True)[:5]
 
             return stats
 
@@ -170,49 +517,182 @@ class RedisCache:
             return {}
 
     def close(self):
-        """Закрывает соединение с Redis"""
-        if self.client:
-            self.client.close()
-            print("Соединение с Redis закрыто")
+        """Останавливает подписку на инвалидацию; общий пул соединений закрывает точка входа (close_redis)"""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        self.client = None
+        self.enabled = False
+
+
+# Тег, который получает каждый запрос с тегами: его сбрасывает полная перезагрузка
+PLAYS_TAG = 'plays'
+
+
+def write_tags(plays, full_reload=False):
+    """Теги данных, которые затронула запись спектаклей в MongoDB"""
+    if full_reload:
+        return [PLAYS_TAG]
+
+    tags = set()
+    for play in plays:
+        if play.get('theatre'):
+            tags.update(('theatres', f"theatre:{play['theatre']}"))
+        if play.get('genre'):
+            tags.update(('genres', f"genre:{play['genre']}"))
+        if play.get('director'):
+            tags.update(('directors', f"director:{play['director']}"))
+        if play.get('actors'):
+            tags.add('actors')
+        for date in play.get('dates') or []:
+            tags.update(('dates', f"date:{str(date)[:10]}"))
+    return sorted(tags)
+
+
+def date_tags(days):
+    """Теги дней от сегодняшнего на days вперед"""
+    today = datetime.now().date()
+    return [f"date:{today + timedelta(days=offset)}" for offset in range(days)]
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_redis_cache() -> RedisCache:
+    """Общий для процесса экземпляр кеша (без подключения на каждый вызов)"""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None or _shared_cache.client is None:
+            _shared_cache = RedisCache()
+        else:
+            # Redis мог быть недоступен при запуске: кеш не остается отключенным навсегда
+            _shared_cache.reconnect_if_due()
+        return _shared_cache
+
 
+def close_redis_cache():
+    """Закрывает общий экземпляр кеша; вызывается точкой входа перед close_redis"""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is not None:
+            _shared_cache.close()
+            _shared_cache = None
 
-def cache_query(query_name, ttl=None):
-    """Декоратор для кеширования результатов функций"""
+
+def query_params(func, args, kwargs, key_func=None) -> dict:
+    """Параметры вызова для ключа кеша: именованные, со значениями по умолчанию, без self"""
+    if key_func is not None:
+        return key_func(*args, **kwargs)
+
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    params = dict(bound.arguments)
+    # Экземпляр класса не влияет на результат запроса
+    params.pop('self', None)
+    params.pop('cls', None)
+    return params
+
+
+def _recompute(cache, query_name, params, store, func, args, kwargs):
+    """Выполняет запрос и сохраняет результат в кеш"""
+    start_time = time.time()
+    result = func(*args, **kwargs)
+    execution_time = time.time() - start_time
+
+    # Сохраняем результат в кеш
+    if result is not None:
+        cache.set(query_name, result, params, **store)
+        print(f"Время выполнения запроса: {execution_time:.3f} сек")
+
+    return result
+
+
+def _refresh_in_background(cache, token, query_name, params, store, func, args, kwargs):
+    """Пересчитывает устаревший запрос, пока вызывающие получают старые данные"""
+
+    def refresh():
+        try:
+            _recompute(cache, query_name, params, store, func, args, kwargs)
+        except Exception as e:
+            print(f"Ошибка фонового обновления {query_name}: {e}")
+        finally:
+            cache.release_lock(query_name, token, params)
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+def _wait_for_recompute(cache, query_name, params):
+    """Ждет, пока запрос пересчитает владелец блокировки"""
+    cache.counters['lock_waits'] += 1
+    deadline = time.monotonic() + config.CACHE_CONFIG['lock_wait']
+
+    while time.monotonic() < deadline and cache.lock_held(query_name, params):
+        time.sleep(config.CACHE_CONFIG['lock_poll_interval'])
+
+    entry = cache.get_entry(query_name, params)
+    if entry is not None and entry[1]:
+        return entry[0]
+    return None
+
+
+def cache_query(query_name, ttl=None, key_func=None, stale_ttl=0, tags=None):
+    """Декоратор для кеширования результатов функций.
+
+    key_func(*args, **kwargs) возвращает параметры для ключа, если аргументы
+    функции не сериализуются в JSON. При stale_ttl > 0 истекший результат еще
+    stale_ttl секунд отдается сразу, а пересчитывается в фоне. tags - список
+    тегов данных (или функция от параметров), при изменении которых результат
+    удаляется из кеша (см. write_tags).
+    """
 
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            cache = RedisCache()
+            cache = get_redis_cache()
 
             # Если кеш не доступен, просто выполняем функцию
             if not cache.enabled:
                 return func(*args, **kwargs)
 
             # Формируем параметры для ключа
-            params = {
-                'args': args,
-                'kwargs': kwargs
-            }
+            params = query_params(func, args, kwargs, key_func)
+            try:
+                json.dumps(params)
+            except TypeError as e:
+                # Нельзя построить стабильный ключ - не кешируем, чтобы не копить промахи
+                print(f"Запрос {query_name} не кешируется: {e}. Укажите key_func")
+                return func(*args, **kwargs)
 
-            cached_result = cache.get(query_name, params)
+            query_tags = tags(params) if callable(tags) else tags
+            store = {'ttl': ttl, 'stale_ttl': stale_ttl, 'tags': query_tags}
 
-            if cached_result is not None:
-                cache.close()
-                return cached_result
-            else:
-                # Выполняем функцию
-                start_time = time.time()
-                result = func(*args, **kwargs)
-                execution_time = time.time() - start_time
+            entry = cache.get_entry(query_name, params)
+            if entry is not None and entry[1]:
+                return entry[0]
 
-                # Сохраняем результат в кеш
-                if result is not None:
-                    cache.set(query_name, result, params, ttl)
-                    print(f"Время выполнения запроса: {execution_time:.3f} сек")
+            # Пересчитывает только владелец блокировки, остальные не нагружают MongoDB
+            token = cache.acquire_lock(query_name, params)
 
-                cache.close()
+            if entry is not None:
+                # Устаревшие данные: отдаем их, пересчет (если он наш) идет в фоне
+                if token:
+                    _refresh_in_background(cache, token, query_name, params, store, func, args, kwargs)
+                return entry[0]
+
+            if token:
+                try:
+                    return _recompute(cache, query_name, params, store, func, args, kwargs)
+                finally:
+                    cache.release_lock(query_name, token, params)
+
+            result = _wait_for_recompute(cache, query_name, params)
+            if result is not None:
                 return result
 
+            # Владелец блокировки не успел - считаем сами, чтобы не ждать бесконечно
+            return _recompute(cache, query_name, params, store, func, args, kwargs)
+
         return wrapper
 
-    return decorator
\ No newline at end of file
+    return decorator
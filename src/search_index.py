@@ -0,0 +1,244 @@
+import os
+import re
+import sqlite3
+import threading
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+import config
+
+# Меняется при изменении разбора текста: индекс старой версии строится заново
+ANALYZER_VERSION = 1
+
+VOWELS = 'аеиоуыэюя'
+
+# Окончания стеммера Портера (Snowball) для русского языка.
+# Окончаниям первой группы должна предшествовать «а» или «я»
+PERFECTIVE_GERUND_1 = ('в', 'вши', 'вшись')
+PERFECTIVE_GERUND_2 = ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись')
+ADJECTIVE = ('ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+             'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+PARTICIPLE_1 = ('ем', 'нн', 'вш', 'ющ', 'щ')
+PARTICIPLE_2 = ('ивш', 'ывш', 'ующ')
+REFLEXIVE = ('ся', 'сь')
+VERB_1 = ('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны', 'ть',
+          'ешь', 'нно')
+VERB_2 = ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им',
+          'ым', 'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь',
+          'ую', 'ю')
+NOUN = ('а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой',
+        'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию',
+        'ью', 'ю', 'ия', 'ья', 'я')
+DERIVATIONAL = ('ост', 'ость')
+SUPERLATIVE = ('ейш', 'ейше')
+
+STOP_WORDS = {
+    'и', 'в', 'во', 'не', 'что', 'он', 'на', 'я', 'с', 'со', 'как', 'а', 'то', 'все', 'она', 'так',
+    'его', 'но', 'да', 'ты', 'к', 'у', 'же', 'вы', 'за', 'бы', 'по', 'только', 'ее', 'мне', 'было',
+    'вот', 'от', 'меня', 'еще', 'нет', 'о', 'из', 'ему', 'когда', 'даже', 'ли', 'если', 'уже', 'или',
+    'ни', 'быть', 'был', 'до', 'вас', 'там', 'себя', 'ей', 'может', 'они', 'тут', 'где', 'есть',
+    'для', 'мы', 'их', 'чем', 'была', 'без', 'кто', 'этот', 'того', 'этого', 'какой', 'при', 'об',
+    'после', 'над', 'через', 'эти', 'нас', 'про', 'них', 'эту', 'этой', 'перед', 'том', 'между',
+}
+
+_shared_index = None
+_shared_lock = threading.Lock()
+
+
+def _regions(word: str):
+    """Начала областей RV и R2 слова"""
+    rv = r1 = r2 = len(word)
+    for i, char in enumerate(word):
+        if char in VOWELS:
+            rv = i + 1
+            break
+    for i in range(1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            r1 = i + 1
+            break
+    for i in range(r1 + 1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            r2 = i + 1
+            break
+    return rv, r2
+
+
+def _strip(word: str, start: int, group1=(), group2=()) -> Optional[str]:
+    """Снимает самое длинное окончание, лежащее в области от start; None, если снять нечего"""
+    best = ''
+    for ending in group1 + group2:
+        if len(ending) > len(best) and word.endswith(ending) and len(word) - len(ending) >= start:
+            best = ending
+    if not best:
+        return None
+
+    cut = len(word) - len(best)
+    if best in group1 and not (cut - 1 >= start and word[cut - 1] in 'ая'):
+        return None
+    return word[:cut]
+
+
+@lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    """Основа слова по стеммеру Портера для русского языка"""
+    word = word.lower().replace('ё', 'е')
+    rv, r2 = _regions(word)
+
+    # Шаг 1: деепричастие, иначе возвратная частица и прилагательное, глагол или существительное
+    stripped = _strip(word, rv, PERFECTIVE_GERUND_1, PERFECTIVE_GERUND_2)
+    if stripped is None:
+        word = _strip(word, rv, (), REFLEXIVE) or word
+        stripped = _strip(word, rv, (), ADJECTIVE)
+        if stripped is not None:
+            stripped = _strip(stripped, rv, PARTICIPLE_1, PARTICIPLE_2) or stripped
+        else:
+            stripped = _strip(word, rv, VERB_1, VERB_2) or _strip(word, rv, (), NOUN)
+    word = stripped or word
+
+    # Шаг 2: конечная «и»
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    # Шаг 3: словообразовательные окончания в R2
+    word = _strip(word, r2, (), DERIVATIONAL) or word
+
+    # Шаг 4: превосходная степень, двойная «н», мягкий знак
+    superlative = _strip(word, rv, (), SUPERLATIVE)
+    if superlative is not None:
+        word = superlative
+    if word.endswith('нн') and len(word) - 2 >= rv:
+        word = word[:-1]
+    elif superlative is None and word.endswith('ь') and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    return word
+
+
+def analyze(text: Optional[str]) -> List[str]:
+    """Основы значимых слов текста"""
+    if not text:
+        return []
+    words = re.findall(r'[^\W\d_]+|\d+', text.lower().replace('ё', 'е'))
+    return [stem(word) for word in words if word not in STOP_WORDS]
+
+
+class SearchIndex:
+    """Полнотекстовый индекс названий и описаний спектаклей на диске.
+
+    Тексты хранятся основами слов в таблице SQLite FTS5 - инвертированном
+    индексе с ранжированием BM25; спектакли обновляются по одному без перестроения.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or config.SEARCH_CONFIG['path']
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Загрузчик пишет, API читает: одно соединение на процесс под блокировкой
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.lock = threading.Lock()
+        self._create_tables()
+
+    def _create_tables(self):
+        """Создает таблицы; индекс со старой версией разбора текста очищается"""
+        with self.lock, self.conn:
+            version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != ANALYZER_VERSION:
+                if version:
+                    print("Индекс поиска построен старой версией разбора текста, его нужно перестроить")
+                self.conn.execute('DROP TABLE IF EXISTS plays')
+                self.conn.execute('DROP TABLE IF EXISTS play_text')
+
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS plays ('
+                'id INTEGER PRIMARY KEY, url TEXT UNIQUE NOT NULL, name TEXT, theatre TEXT, genre TEXT)'
+            )
+            # В колонках лежат основы слов через пробел, поэтому токенизатор только делит по пробелам
+            self.conn.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS play_text '
+                'USING fts5(name, description, tokenize="unicode61 remove_diacritics 0")'
+            )
+            self.conn.execute(f'PRAGMA user_version = {ANALYZER_VERSION}')
+
+    def _write(self, plays: Iterable[Dict]) -> int:
+        """Добавляет или заменяет тексты спектаклей (внутри открытой транзакции)"""
+        count = 0
+        for play in plays:
+            if not play.get('url'):
+                continue
+            play_id = self.conn.execute(
+                'INSERT INTO plays (url, name, theatre, genre) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(url) DO UPDATE SET name = excluded.name, theatre = excluded.theatre, '
+                'genre = excluded.genre RETURNING id',
+                (play['url'], play.get('name'), play.get('theatre'), play.get('genre'))
+            ).fetchone()[0]
+            self.conn.execute('DELETE FROM play_text WHERE rowid = ?', (play_id,))
+            self.conn.execute(
+                'INSERT INTO play_text (rowid, name, description) VALUES (?, ?, ?)',
+                (play_id, ' '.join(analyze(play.get('name'))), ' '.join(analyze(play.get('description'))))
+            )
+            count += 1
+        return count
+
+    def update(self, plays: Iterable[Dict]) -> int:
+        """Обновляет в индексе только переданные спектакли"""
+        with self.lock, self.conn:
+            return self._write(plays)
+
+    def remove(self, urls: Iterable[str]):
+        """Удаляет спектакли из индекса"""
+        with self.lock, self.conn:
+            for url in urls:
+                row = self.conn.execute('DELETE FROM plays WHERE url = ? RETURNING id', (url,)).fetchone()
+                if row:
+                    self.conn.execute('DELETE FROM play_text WHERE rowid = ?', row)
+
+    def rebuild(self, plays: Iterable[Dict]) -> int:
+        """Строит индекс заново по полному набору спектаклей"""
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM plays')
+            self.conn.execute('DELETE FROM play_text')
+            count = self._write(plays)
+            # Сливаем сегменты инвертированного индекса в один
+            self.conn.execute("INSERT INTO play_text (play_text) VALUES ('optimize')")
+        return count
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[Dict]:
+        """Спектакли по убыванию релевантности (BM25) запросу"""
+        terms = list(dict.fromkeys(analyze(query)))
+        if not terms:
+            return []
+
+        match = ' OR '.join(f'"{term}"' for term in terms)
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT plays.url, plays.name, plays.theatre, plays.genre, bm25(play_text, ?, ?) AS rank '
+                'FROM play_text JOIN plays ON plays.id = play_text.rowid '
+                'WHERE play_text MATCH ? ORDER BY rank LIMIT ?',
+                (config.SEARCH_CONFIG['name_weight'], config.SEARCH_CONFIG['description_weight'],
+                 match, limit or config.SEARCH_CONFIG['limit'])
+            ).fetchall()
+
+        # bm25() в FTS5 отрицательный: чем меньше, тем релевантнее
+        return [{'url': url, 'name': name, 'theatre': theatre, 'genre': genre, 'score': round(-rank, 3)}
+                for url, name, theatre, genre, rank in rows]
+
+    def count(self) -> int:
+        """Число спектаклей в индексе"""
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM plays').fetchone()[0]
+
+    def close(self):
+        """Закрывает файл индекса"""
+        with self.lock:
+            self.conn.close()
+
+
+def get_search_index() -> Optional[SearchIndex]:
+    """Общий для процесса индекс поиска; None, если поиск отключен"""
+    global _shared_index
+    if not config.SEARCH_CONFIG['enabled']:
+        return None
+
+    with _shared_lock:
+        if _shared_index is None:
+            _shared_index = SearchIndex()
+        return _shared_index
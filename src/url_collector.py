@@ -1,21 +1,47 @@
 import re
+import asyncio
+from contextlib import aclosing
 from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
 import requests
-import time
 import os
 import random
-from bs4 import BeautifulSoup
+from src.html_backend import make_soup
+from src.http_cache import HTTPCache
+from src.rate_limiter import AdaptiveRateLimiter, get_rate_limiter
 from urllib.parse import urljoin, urlparse
 import config
 
+# Признак окончания обхода в очереди найденных ссылок
+_DONE = object()
+
 class URLCollector:
-    def __init__(self):
+    CATEGORIES = [
+        '',
+        'myuzikl',
+        'drama',
+        'komediya',
+        'balet',
+        'opera',
+        'detektiv',
+        'skazki',
+        'melodrama',
+        'klassicheskaya-drama',
+        'sovremennaya-drama',
+        'veselye-komedii',
+    ]
+    MAX_CATEGORY_PAGES = 5
+    CALENDAR_DAYS = 30
+
+    def __init__(self, rate_limiter: Optional[AdaptiveRateLimiter] = None):
         self.base_url = config.BASE_URL
         self.theater_url = config.THEATER_URL
         self.headers = config.HEADERS
         self.session = requests.Session()
         self.session.headers.update(self.headers)
         self.play_urls = set()
+        self.http_cache = HTTPCache()
+        self.rate_limiter = rate_limiter or get_rate_limiter()
 
         self.user_agents = [
             'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
@@ -25,30 +51,48 @@ class URLCollector:
             'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36 Edg/119.0.0.0',
         ]
 
-    def get_soup(self, url):
-        """Загружает страницу с ротацией User-Agent и случайными задержками"""
+    def _request(self, url):
+        """Выполняет запрос с ротацией User-Agent и возвращает HTML"""
         try:
             headers = self.headers.copy()
             headers['User-Agent'] = random.choice(self.user_agents)
 
-            time.sleep(random.uniform(2, 5))
+            # 429/503 и капчу обрабатывает лимитер: снижает частоту и повторяет запрос
+            response = self.rate_limiter.send_with_backoff(
+                url, lambda: self.http_cache.fetch(self.session, url, headers=headers, timeout=config.TIMEOUT)
+            )
+            if response is None:
+                self.http_cache.invalidate(url)
+                return None
 
-            response = self.session.get(url, headers=headers, timeout=config.TIMEOUT)
             response.raise_for_status()
-
-            if 'captcha' in response.text.lower() or 'доступ временно ограничен' in response.text:
-                print(f"⚠️ Возможная капча на {url}")
-                time.sleep(10)
-
-            return BeautifulSoup(response.text, 'html.parser')
+            return response.text
         except requests.RequestException as e:
             print(f"Ошибка при загрузке {url}: {e}")
+            return None
 
-            if '429' in str(e):
-                print(f"⚠️ Слишком много запросов. Ждем 30 секунд...")
-                time.sleep(30)
-
+    def get_soup(self, url):
+        """Загружает страницу из кеша или из сети с учетом лимита запросов"""
+        cached = self.http_cache.get_fresh(url)
+        if cached is not None:
+            return make_soup(cached.text)
+
+        self.rate_limiter.wait(url)
+        html = self._request(url)
+        return make_soup(html) if html is not None else None
+
+    async def get_soup_async(self, url):
+        """Асинхронная версия get_soup для параллельного обхода"""
+        cached = await asyncio.to_thread(self.http_cache.get_fresh, url)
+        if cached is not None:
+            html = cached.text
+        else:
+            await self.rate_limiter.wait_async(url)
+            html = await asyncio.to_thread(self._request, url)
+
+        if html is None:
             return None
+        return await asyncio.to_thread(make_soup, html)
 
     def extract_play_urls_from_page(self, soup):
         """Извлекает ссылки на спектакли - УЛУЧШЕННАЯ ВЕРСИЯ"""
@@ -95,125 +139,125 @@ class URLCollector:
 
         return list(set(urls))
 
-    def collect_urls_from_categories(self):
-        """Собирает ссылки из разных категорий"""
-        categories = [
-            '',
-            'myuzikl',
-            'drama',
-            'komediya',
-            'balet',
-            'opera',
-            'detektiv',
-            'skazki',
-            'melodrama',
-            'klassicheskaya-drama',
-            'sovremennaya-drama',
-            'veselye-komedii',
-        ]
-
-        all_urls = set()
-
-        for category in categories:
-            try:
-                if category:
-                    category_url = f"{self.theater_url}/{category}"
-                    print(f"📂 Собираем из категории: {category}")
-                else:
-                    category_url = self.theater_url
-                    print(f"📂 Собираем с главной страницы")
-
-                for page in range(1, 6):
-                    if page > 1:
-                        if category:
-                            page_url = f"{category_url}?page={page}"
-                        else:
-                            page_url = f"{category_url}?page={page}"
-                    else:
-                        page_url = category_url
+    def category_page_url(self, category_url, page):
+        """Ссылка на страницу категории с номером page"""
+        return category_url if page == 1 else f"{category_url}?page={page}"
 
-                    print(f"   Страница {page}...")
-                    soup = self.get_soup(page_url)
-
-                    if not soup:
-                        break
-
-                    page_urls = self.extract_play_urls_from_page(soup)
-                    all_urls.update(page_urls)
+    def popular_pages(self):
+        """Страницы с популярными спектаклями"""
+        return [
+            f"{self.theater_url}/popular",
+            f"{self.theater_url}/recommendations",
+            f"{self.theater_url}/best",
+        ]
 
-                    print(f"     Найдено {len(page_urls)} ссылок (всего: {len(all_urls)})")
+    def seed_pages(self):
+        """Начальные страницы обхода: (ссылка, ссылка категории, номер страницы)"""
+        pages = []
 
-                    if not self.has_next_page(soup):
-                        break
+        for category in self.CATEGORIES:
+            category_url = f"{self.theater_url}/{category}" if category else self.theater_url
+            pages.append((category_url, category_url, 1))
 
-                    time.sleep(random.uniform(3, 7))
+        today = datetime.now()
+        for i in range(self.CALENDAR_DAYS):
+            date_str = (today + timedelta(days=i)).strftime('%Y-%m-%d')
+            pages.append((f"{self.theater_url}/{date_str}", None, 1))
+
+        for page_url in self.popular_pages():
+            pages.append((page_url, None, 1))
+
+        return pages
+
+    async def iter_play_urls(self, concurrency: Optional[int] = None) -> AsyncIterator[str]:
+        """Параллельно обходит категории, календарь и популярное, отдавая новые ссылки сразу"""
+        frontier = asyncio.Queue()
+        found = asyncio.Queue()
+
+        for page in self.seed_pages():
+            frontier.put_nowait(page)
+
+        async def crawl():
+            while True:
+                page_url, category_url, page = await frontier.get()
+                try:
+                    soup = await self.get_soup_async(page_url)
+                    if soup:
+                        for url in self.extract_play_urls_from_page(soup):
+                            await found.put(url)
+
+                        # Следующая страница категории попадает в ту же очередь обхода
+                        if category_url and page < self.MAX_CATEGORY_PAGES and self.has_next_page(soup):
+                            next_url = self.category_page_url(category_url, page + 1)
+                            frontier.put_nowait((next_url, category_url, page + 1))
+                except Exception as e:
+                    print(f"Ошибка обхода {page_url}: {e}")
+                finally:
+                    frontier.task_done()
+
+        async def finish():
+            await frontier.join()
+            await found.put(_DONE)
+
+        tasks = [asyncio.create_task(crawl())
+                 for _ in range(concurrency or config.FETCH_CONFIG['concurrency'])]
+        tasks.append(asyncio.create_task(finish()))
+
+        seen = set()
 
-            except Exception as e:
-                print(f"Ошибка: {e}")
-                continue
+        try:
+            while True:
+                url = await found.get()
+                if url is _DONE:
+                    break
+                if url not in seen:
+                    seen.add(url)
+                    self.play_urls.add(url)
+                    yield url
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def stream_urls(self, limit=400) -> AsyncIterator[str]:
+        """Потоковый аналог run(): ссылки уходят в парсинг по мере обнаружения"""
+        print("🔄 Начинаем параллельный сбор ссылок...")
+        count = 0
+
+        async with aclosing(self.iter_play_urls()) as urls:
+            async for url in urls:
+                yield url
+                count += 1
+                if count >= limit:
+                    break
+
+        urls = list(self.play_urls)
+        print(f"\n🎉 ИТОГО собрано: {len(urls)} уникальных ссылок")
+        if urls:
+            self.save_urls_to_file(urls)
 
-        return list(all_urls)
+        if len(urls) < 50:
+            print(f"⚠️ Собрано мало ссылок ({len(urls)}). Добавляем сохраненные ранее...")
+            for url in self.load_urls_from_file():
+                if count >= limit:
+                    break
+                if url not in self.play_urls:
+                    self.play_urls.add(url)
+                    count += 1
+                    yield url
 
     def has_next_page(self, soup):
         """Проверяет есть ли следующая страница"""
         next_button = soup.find('a', text=re.compile(r'дальше|следующая|next', re.I))
         return next_button is not None
 
-    def collect_urls_from_calendar(self):
-        """Собирает ссылки на ближайшие 30 дней"""
-        print("📅 Собираем ссылки по календарю (30 дней)...")
-
-        all_urls = set()
-        today = datetime.now()
-
-        for i in range(30):  # Следующие 30 дней
-            try:
-                date = today + timedelta(days=i)
-                date_str = date.strftime('%Y-%m-%d')
-                date_url = f"{self.theater_url}/{date_str}"
-
-                print(f"   📆 {date_str}...")
-
-                soup = self.get_soup(date_url)
-
-                if soup:
-                    date_urls = self.extract_play_urls_from_page(soup)
-                    all_urls.update(date_urls)
-                    print(f"     Найдено {len(date_urls)} спектаклей")
-
-                time.sleep(random.uniform(2, 4))
-
-            except Exception as e:
-                print(f"     ❌ Ошибка для даты {date_str}: {e}")
-                continue
+    def collect_all_urls(self):
+        """Основной метод сбора всех ссылок (параллельный обход)"""
+        print("🚀 Начинаем параллельный сбор ссылок...")
 
-        return list(all_urls)
+        async def collect():
+            return [url async for url in self.iter_play_urls()]
 
-    def collect_all_urls(self):
-        """Основной метод сбора всех ссылок"""
-        print("🚀 Начинаем агрессивный сбор ссылок...")
-
-        all_urls = set()
-
-        # Метод 1: Категории
-        print("\n📋 Метод 1: Сбор по категориям")
-        category_urls = self.collect_urls_from_categories()
-        all_urls.update(category_urls)
-        print(f"✅ Категории: {len(category_urls)} ссылок")
-
-        # Метод 2: Календарь
-        print("\n📅 Метод 2: Сбор по календарю")
-        calendar_urls = self.collect_urls_from_calendar()
-        all_urls.update(calendar_urls)
-        print(f"✅ Календарь: {len(calendar_urls)} ссылок")
-
-        # Метод 3: Популярные страницы
-        print("\n🔥 Метод 3: Популярные спектакли")
-        popular_urls = self.collect_popular_urls()
-        all_urls.update(popular_urls)
-        print(f"✅ Популярные: {len(popular_urls)} ссылок")
-
-        urls = list(all_urls)
+        urls = asyncio.run(collect())
         print(f"\n🎉 ИТОГО собрано: {len(urls)} уникальных ссылок")
 
         if urls:
@@ -221,27 +265,6 @@ class URLCollector:
 
         return urls
 
-    def collect_popular_urls(self):
-        """Собирает ссылки на популярные спектакли"""
-        popular_pages = [
-            f"{self.theater_url}/popular",
-            f"{self.theater_url}/recommendations",
-            f"{self.theater_url}/best",
-        ]
-
-        urls = set()
-
-        for page_url in popular_pages:
-            try:
-                soup = self.get_soup(page_url)
-                if soup:
-                    page_urls = self.extract_play_urls_from_page(soup)
-                    urls.update(page_urls)
-            except:
-                continue
-
-        return list(urls)
-
     def run(self, force_collect=True):
         """Основной метод сбора ссылок"""
         if not force_collect and os.path.exists(config.URLS_FILE):
@@ -0,0 +1,42 @@
+import os
+import sys
+import fakeredis
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import src.redis_cache as redis_cache
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """Общий кеш процесса поверх fakeredis, без кеша первого уровня"""
+    server = fakeredis.FakeServer()
+    monkeypatch.setitem(config.CACHE_CONFIG, 'local_enabled', False)
+    monkeypatch.setattr(redis_cache, 'get_redis_client', lambda: fakeredis.FakeRedis(server=server))
+    monkeypatch.setattr(redis_cache, 'redis_available', lambda: True)
+    monkeypatch.setattr(redis_cache, '_shared_cache', None)
+    return redis_cache.get_redis_cache()
+
+
+@pytest.fixture
+def mongo(monkeypatch, tmp_path):
+    """MongoHandler поверх mongomock; индекс имен пишется во временный каталог"""
+    mongomock = pytest.importorskip('mongomock')
+    from src.mongo_handler import MongoHandler
+    from src.materialized_views import MaterializedViews
+
+    monkeypatch.setitem(config.NAME_INDEX_CONFIG, 'path', str(tmp_path / 'name_index.json'))
+    monkeypatch.setitem(config.SNAPSHOT_CONFIG, 'enabled', False)
+    monkeypatch.setitem(config.SEARCH_CONFIG, 'enabled', False)
+    monkeypatch.setitem(config.CACHE_CONFIG, 'enabled', False)
+
+    handler = MongoHandler()
+    handler.client = mongomock.MongoClient()
+    handler.db = handler.client[config.MONGO_CONFIG['database']]
+    handler.collection = handler.db[config.MONGO_CONFIG['collection']]
+    handler.shows = handler.db[config.MONGO_CONFIG['shows_collection']]
+    handler.views = MaterializedViews(handler.db)
+    handler.connected = True
+    return handler
@@ -0,0 +1,93 @@
+from datetime import datetime
+from src.cached_queries import CachedQueries
+from src.redis_cache import cache_query, query_params, make_key
+import src.cached_queries as cached_queries
+
+
+class FakeSnapshot:
+    """Снимок спектаклей, который считает обращения"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def read(self, name, limit=0):
+        self.calls += 1
+        return [{'_id': 'Актер', 'actor': 'Актер', 'play_count': 1}]
+
+    def upcoming_shows(self, days, limit=20):
+        self.calls += 1
+        return []
+
+
+def make_queries(monkeypatch):
+    """CachedQueries без MongoDB: агрегаты читаются из FakeSnapshot"""
+    snapshot = FakeSnapshot()
+    monkeypatch.setattr(cached_queries, 'get_snapshot', lambda: snapshot)
+    queries = CachedQueries.__new__(CachedQueries)
+    queries.cache = cached_queries.get_redis_cache()
+    return queries, snapshot
+
+
+def test_second_call_is_cache_hit(cache, monkeypatch):
+    queries, snapshot = make_queries(monkeypatch)
+
+    first = queries.get_top_actors(5)
+    second = queries.get_top_actors(5)
+
+    assert first == second
+    assert snapshot.calls == 1
+    assert cache.counters['misses'] == 1
+    assert cache.counters['hits'] == 1
+
+
+def test_default_args_and_self_map_to_same_key(cache, monkeypatch):
+    queries, snapshot = make_queries(monkeypatch)
+    func = CachedQueries.get_upcoming_shows.__wrapped__
+
+    assert query_params(func, (queries,), {}) == {'days': 7}
+    assert query_params(func, (queries,), {'days': 7}) == {'days': 7}
+    # Другой экземпляр не меняет ключ
+    other = CachedQueries.__new__(CachedQueries)
+    assert make_key('upcoming_shows', query_params(func, (other, 7), {})) == \
+        make_key('upcoming_shows', query_params(func, (queries,), {}))
+
+    queries.get_upcoming_shows()
+    queries.get_upcoming_shows(days=7)
+    assert snapshot.calls == 1
+    assert cache.counters['hits'] == 1
+
+
+def test_key_func_builds_key_from_unserializable_args(cache):
+    calls = []
+
+    @cache_query('plays_on_day', ttl=60, key_func=lambda day: {'date': day.date().isoformat()})
+    def plays_on_day(day):
+        calls.append(day)
+        return [day.isoformat()]
+
+    # datetime не сериализуется в JSON, ключ строится только по дню
+    first = plays_on_day(datetime(2025, 3, 1, 10, 0))
+    second = plays_on_day(datetime(2025, 3, 1, 19, 30))
+
+    assert first == second == ['2025-03-01T10:00:00']
+    assert len(calls) == 1
+    assert cache.counters['hits'] == 1
+    assert cache.get('plays_on_day', {'date': '2025-03-01'}) == first
+
+
+def test_cache_reconnects_after_failed_start(cache, monkeypatch):
+    import config
+    import src.redis_cache as redis_cache
+
+    available = {'value': False}
+    monkeypatch.setattr(redis_cache, 'redis_available', lambda: available['value'])
+    monkeypatch.setattr(redis_cache, '_shared_cache', None)
+    monkeypatch.setitem(config.CACHE_CONFIG, 'reconnect_interval', 0)
+
+    assert not redis_cache.get_redis_cache().enabled
+
+    available['value'] = True
+    restored = redis_cache.get_redis_cache()
+    assert restored.enabled
+    restored.set('plays_on_day', [1], {'date': '2025-03-01'})
+    assert restored.get('plays_on_day', {'date': '2025-03-01'}) == [1]
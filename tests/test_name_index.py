@@ -0,0 +1,32 @@
+from bson import ObjectId
+from src.name_index import NameIndex
+
+
+def make_play(url, name, director, actors):
+    return {'url': url, 'name': name, 'theatre': 'Театр', 'genre': 'Драма', 'director': director,
+            'actors': actors, 'dates': ['2025-03-01T19:00:00'], 'duration_minutes': 120}
+
+
+def test_save_play_keeps_name_index_loadable(mongo):
+    play = make_play('https://example.com/1', 'Гроза', 'Кама Гинкас', ['Анна Музыченко'])
+
+    assert mongo.save_play(play)
+
+    stored = mongo.collection.find_one({'url': play['url']})
+    assert stored['_id'] == mongo.generate_id(play)
+    index = NameIndex.load()
+    assert index.lookup('director', 'камы гинкас') == [stored['_id']]
+    assert index.lookup('actors', 'Анны Музыченко') == [stored['_id']]
+
+
+def test_name_index_round_trips_object_ids(mongo):
+    # Документ, вставленный в обход загрузчика, получает ObjectId
+    inserted = mongo.collection.insert_one(make_play('https://example.com/2', 'Чайка', 'Кама Гинкас', [])).inserted_id
+    mongo.save_play(make_play('https://example.com/3', 'Лес', 'Кама Гинкас', []))
+
+    index = NameIndex.load()
+    ids = index.lookup('director', 'Кама Гинкас')
+
+    assert isinstance(inserted, ObjectId)
+    assert inserted in ids and len(ids) == 2
+    assert mongo.collection.count_documents({'_id': {'$in': ids}}) == 2
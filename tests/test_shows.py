@@ -0,0 +1,14 @@
+from tests.test_name_index import make_play
+
+
+def test_shows_point_at_stored_play(mongo):
+    play = make_play('https://example.com/1', 'Гроза', 'Кама Гинкас', [])
+    mongo.save_play(play)
+    stored_id = mongo.collection.find_one({'url': play['url']})['_id']
+
+    # Новое название дает другой generate_id, но _id документа не меняется
+    mongo.upsert_plays([dict(play, name='Гроза (новая редакция)', dates=['2025-03-02T19:00:00'])])
+
+    shows = list(mongo.shows.find({'url': play['url']}))
+    assert [show['play_id'] for show in shows] == [stored_id]
+    assert mongo.collection.count_documents({'_id': shows[0]['play_id']}) == 1